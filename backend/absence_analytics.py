@@ -0,0 +1,253 @@
+"""
+Analytics absences - Pipelines d'agrégation MongoDB
+MOZAIK RH - KPI calculés côté serveur
+
+Les absences stockent leurs dates sous forme de chaînes (DD/MM/YYYY ou
+YYYY-MM-DD). Les pipelines ci-dessous les normalisent en dates typées
+avant de regrouper : Python ne fait plus que mettre en forme le résultat.
+"""
+
+from typing import Dict, List, Optional
+
+# Libellés et couleurs des motifs pour les graphiques
+MOTIF_DISPLAY = {
+    "DEL": {"name": "Délégation CSE", "color": "bg-indigo-600", "justified": True},
+    "CA": {"name": "CA - Congés Annuels", "color": "bg-blue-500", "justified": True},
+    "AM": {"name": "Arrêt maladie", "color": "bg-red-500", "justified": False},
+    "RTT": {"name": "RTT/Récupération", "color": "bg-green-500", "justified": True},
+    "REC": {"name": "Récupération", "color": "bg-green-400", "justified": True},
+    "FO": {"name": "Formation", "color": "bg-purple-500", "justified": True},
+    "AT": {"name": "Accident travail", "color": "bg-red-600", "justified": False},
+    "MAT": {"name": "Congé maternité", "color": "bg-pink-500", "justified": True},
+    "PAT": {"name": "Congé paternité", "color": "bg-pink-400", "justified": True},
+    "FAM": {"name": "Événement familial", "color": "bg-purple-300", "justified": True},
+    "CT": {"name": "Congés Trimestriels", "color": "bg-blue-300", "justified": True},
+    "NAUT": {"name": "Absence non autorisée", "color": "bg-red-700", "justified": False},
+    "AUT": {"name": "Absence autorisée", "color": "bg-gray-500", "justified": True},
+    "TEL": {"name": "Télétravail", "color": "bg-cyan-500", "justified": True},
+    "STG": {"name": "Stage", "color": "bg-cyan-400", "justified": True},
+    "CEX": {"name": "Congé exceptionnel", "color": "bg-indigo-400", "justified": True}
+}
+
+MONTHS_FR = ["Jan", "Fév", "Mar", "Avr", "Mai", "Juin", "Juil", "Août", "Sep", "Oct", "Nov", "Déc"]
+
+DEFAULT_DEPARTMENT = "Non spécifié"
+
+
+# ============================================================================
+# EXPRESSIONS DE NORMALISATION
+# ============================================================================
+
+def normalized_date_expr(field: str) -> Dict:
+    """
+    Expression d'agrégation convertissant un champ date texte en Date MongoDB
+
+    Formats acceptés : DD/MM/YYYY et YYYY-MM-DD (éventuellement suivi d'une heure).
+    Toute autre valeur donne null.
+
+    Args:
+        field: Nom du champ (sans le préfixe $)
+    """
+    as_string = {"$convert": {"input": f"${field}", "to": "string", "onError": "", "onNull": ""}}
+    first_10 = {"$substrCP": [as_string, 0, 10]}
+
+    return {
+        "$switch": {
+            "branches": [
+                {
+                    "case": {"$regexMatch": {"input": as_string, "regex": r"^\d{2}/\d{2}/\d{4}"}},
+                    "then": {"$dateFromString": {"dateString": first_10, "format": "%d/%m/%Y", "onError": None}}
+                },
+                {
+                    "case": {"$regexMatch": {"input": as_string, "regex": r"^\d{4}-\d{2}-\d{2}"}},
+                    "then": {"$dateFromString": {"dateString": first_10, "format": "%Y-%m-%d", "onError": None}}
+                }
+            ],
+            "default": None
+        }
+    }
+
+
+def is_delegation_expr(motif_field: str = "$motif_absence") -> Dict:
+    """1 si l'absence est une délégation CSE, 0 sinon (pour $sum)"""
+    return {"$cond": [{"$eq": [motif_field, "DEL"]}, 1, 0]}
+
+
+# ============================================================================
+# PIPELINE KPI
+# ============================================================================
+
+def build_absence_kpi_pipeline(year: int) -> List[Dict]:
+    """
+    Construit le pipeline $facet du tableau de bord absences
+
+    Facettes :
+    - summary : total et délégations (toutes périodes)
+    - byMotif : nombre d'absences par motif
+    - byMonth : absences de l'année `year` par mois (dates normalisées)
+    - byDepartment : regroupement par employé puis $lookup vers users
+
+    Args:
+        year: Année de la tendance mensuelle
+    """
+    return [
+        {"$project": {"_id": 0, "employee_id": 1, "motif_absence": 1, "date_debut": 1}},
+        {"$facet": {
+            "summary": [
+                {"$group": {
+                    "_id": None,
+                    "total": {"$sum": 1},
+                    "del": {"$sum": is_delegation_expr()}
+                }}
+            ],
+            "byMotif": [
+                {"$group": {"_id": "$motif_absence", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1}}
+            ],
+            "byMonth": [
+                {"$addFields": {"start": normalized_date_expr("date_debut")}},
+                {"$match": {"start": {"$ne": None}}},
+                {"$match": {"$expr": {"$eq": [{"$year": "$start"}, year]}}},
+                {"$group": {
+                    "_id": {"$month": "$start"},
+                    "total": {"$sum": 1},
+                    "del": {"$sum": is_delegation_expr()}
+                }}
+            ],
+            "byDepartment": [
+                {"$group": {
+                    "_id": "$employee_id",
+                    "total": {"$sum": 1},
+                    "del": {"$sum": is_delegation_expr()}
+                }},
+                {"$lookup": {
+                    "from": "users",
+                    "localField": "_id",
+                    "foreignField": "id",
+                    "as": "employee"
+                }},
+                {"$group": {
+                    "_id": {"$ifNull": [{"$arrayElemAt": ["$employee.department", 0]}, DEFAULT_DEPARTMENT]},
+                    "total": {"$sum": "$total"},
+                    "del": {"$sum": "$del"}
+                }}
+            ]
+        }}
+    ]
+
+
+def build_rollup_kpi_pipeline(year: int) -> List[Dict]:
+    """
+    Équivalent de build_absence_kpi_pipeline sur la collection absence_rollups
+
+    Ne lit que les rollups mensuels : le coût dépend du nombre de combinaisons
+    (mois × département × motif...), pas du volume d'historique.
+
+    Args:
+        year: Année de la tendance mensuelle
+    """
+    del_count = {"$cond": [{"$eq": ["$motif", "DEL"]}, "$count", 0]}
+
+    return [
+        {"$match": {"granularity": "month"}},
+        {"$facet": {
+            "summary": [
+                {"$group": {"_id": None, "total": {"$sum": "$count"}, "del": {"$sum": del_count}}}
+            ],
+            "byMotif": [
+                {"$group": {"_id": "$motif", "count": {"$sum": "$count"}}},
+                {"$match": {"count": {"$gt": 0}}},
+                {"$sort": {"count": -1}}
+            ],
+            "byMonth": [
+                {"$match": {"period": {"$regex": f"^{year}-"}}},
+                {"$group": {"_id": "$period", "total": {"$sum": "$count"}, "del": {"$sum": del_count}}},
+                {"$project": {"_id": {"$toInt": {"$substrCP": ["$_id", 5, 2]}}, "total": 1, "del": 1}}
+            ],
+            "byDepartment": [
+                {"$group": {"_id": "$department", "total": {"$sum": "$count"}, "del": {"$sum": del_count}}},
+                {"$match": {"total": {"$gt": 0}}}
+            ]
+        }}
+    ]
+
+
+# ============================================================================
+# MISE EN FORME
+# ============================================================================
+
+def _rate(part: float, total: float) -> float:
+    return round((part / total * 100), 1) if total > 0 else 0
+
+
+def format_absence_kpi(
+    facets: Dict,
+    total_employees: int,
+    departments: Optional[List[str]] = None
+) -> Dict:
+    """
+    Met en forme le résultat du pipeline KPI pour le frontend
+
+    Args:
+        facets: Document unique renvoyé par le $facet
+        total_employees: Nombre d'employés (moyenne par employé)
+        departments: Départements connus (affichés même sans absence)
+    """
+    summary = (facets.get("summary") or [{}])[0]
+    total_absences = summary.get("total", 0)
+    del_count = summary.get("del", 0)
+
+    by_category = []
+    for item in facets.get("byMotif", []):
+        code = item["_id"]
+        config = MOTIF_DISPLAY.get(code, {"name": code, "color": "bg-gray-500", "justified": False})
+        by_category.append({
+            "code": code,
+            "name": config["name"],
+            "count": item["count"],
+            "percentage": _rate(item["count"], total_absences),
+            "color": config["color"],
+            "justified": config["justified"]
+        })
+
+    months = {item["_id"]: item for item in facets.get("byMonth", [])}
+    monthly_trend = []
+    for month_number, month_name in enumerate(MONTHS_FR, start=1):
+        item = months.get(month_number, {})
+        total_month = item.get("total", 0)
+        del_month = item.get("del", 0)
+        monthly_trend.append({
+            "month": month_name,
+            "del": del_month,
+            "personal": total_month - del_month,
+            "total": total_month
+        })
+
+    by_department = {item["_id"]: item for item in facets.get("byDepartment", [])}
+    for department in departments or []:
+        by_department.setdefault(department or DEFAULT_DEPARTMENT, {"total": 0, "del": 0})
+
+    department_breakdown = []
+    for department, item in by_department.items():
+        department_breakdown.append({
+            "department": department,
+            "del": item["del"],
+            "personal": item["total"] - item["del"],
+            "total": item["total"],
+            "delRate": _rate(item["del"], item["total"])
+        })
+    department_breakdown.sort(key=lambda x: x["total"], reverse=True)
+
+    return {
+        "summary": {
+            "totalAbsences": total_absences,
+            "delegationHours": del_count,
+            "personalAbsences": total_absences - del_count,
+            "averagePerEmployee": round(total_absences / total_employees, 1) if total_employees > 0 else 0,
+            "delegationRate": _rate(del_count, total_absences),
+            "comparisonLastYear": "N/A"  # Nécessite historique année précédente
+        },
+        "byCategory": by_category[:10],  # Top 10
+        "monthlyTrend": monthly_trend,
+        "departmentBreakdown": department_breakdown
+    }
@@ -0,0 +1,168 @@
+"""
+Rapports d'absences - Génération en processus et cache
+MOZAIK RH - Rapport Excel double-bloc (Programmées | Absentéisme)
+
+Le DataFrame source est construit directement depuis un curseur MongoDB
+(rollups par employé et par mois, ou absences brutes), puis
+AbsenceTableauAdapter est exécuté dans un pool de processus : la boucle
+d'événements n'est jamais bloquée.
+
+Chaque rapport est un artefact adressé par son contenu : la clé SHA-256
+couvre la période, les données source, le mapping et la méthode de calcul.
+Deux demandes identiques servent le même fichier ; toute modification des
+données produit une nouvelle clé.
+"""
+
+import asyncio
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+
+from adapt_absences_tableau import AbsenceTableauAdapter
+
+logger = logging.getLogger(__name__)
+
+# À incrémenter quand le format du fichier généré change (invalide le cache)
+REPORT_FORMAT_VERSION = 1
+
+SOURCE_COLUMNS = ['EmployeNom', 'TypeAbsence', 'Duree', 'DateDebut', 'DateFin', 'StatutPlanif']
+
+MEDIA_TYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+# Export Parquet : moteur pyarrow requis (requirements.txt)
+PARQUET_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+DEFAULT_MAPPING_PATH = Path(__file__).parent / "config" / "mapping_absences.csv"
+DEFAULT_CACHE_DIR = Path(__file__).parent / "out" / "reports"
+
+
+def render_report(source_df: pd.DataFrame, mapping_path: str, output_path: str,
+                  counting_method: str = 'Jours Ouvrés', output_format: str = 'xlsx') -> Dict:
+    """
+    Exécute l'adaptateur sur un DataFrame (fonction de niveau module : exécutable en sous-processus)
+
+    Returns:
+        Log de l'adaptateur
+    """
+    adapter = AbsenceTableauAdapter(
+        source_df=source_df,
+        mapping_path=mapping_path,
+        output_path=output_path,
+        counting_method=counting_method,
+        log_path=None,
+        output_format=output_format
+    )
+    adapter.run()
+    return adapter.log
+
+
+class AbsenceReportService:
+    """Génération et cache des rapports Excel d'absences"""
+
+    def __init__(self, cache_dir: Optional[Path] = None, mapping_path: Optional[Path] = None,
+                 max_workers: Optional[int] = None, max_cached: int = 200):
+        self.cache_dir = Path(cache_dir or os.environ.get("REPORT_CACHE_DIR", DEFAULT_CACHE_DIR))
+        self.mapping_path = Path(mapping_path or DEFAULT_MAPPING_PATH)
+        self.max_workers = max_workers or int(os.environ.get("REPORT_WORKERS", "2"))
+        self.max_cached = max_cached
+        self._executor = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """Pool de processus créé à la première génération"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def shutdown(self):
+        """Arrête le pool de processus (arrêt du serveur)"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @staticmethod
+    async def dataframe_from_cursor(cursor) -> pd.DataFrame:
+        """Construit le DataFrame source de l'adaptateur depuis un curseur (ou générateur) async"""
+        rows = [row async for row in cursor]
+        return pd.DataFrame(rows, columns=SOURCE_COLUMNS)
+
+    def cache_key(self, period: str, source_df: pd.DataFrame, counting_method: str,
+                  output_format: str = 'xlsx') -> str:
+        """Empreinte SHA-256 du rapport (période + données + mapping + format)"""
+        digest = hashlib.sha256()
+        digest.update(json.dumps({
+            "period": period,
+            "counting_method": counting_method,
+            "output_format": output_format,
+            "format": REPORT_FORMAT_VERSION
+        }, sort_keys=True).encode("utf-8"))
+
+        if self.mapping_path.exists():
+            digest.update(self.mapping_path.read_bytes())
+
+        # Ordre des lignes normalisé : même contenu ⇒ même clé
+        canonical = source_df.astype(str).sort_values(SOURCE_COLUMNS).to_csv(index=False)
+        digest.update(canonical.encode("utf-8"))
+        return digest.hexdigest()
+
+    def artifact_path(self, key: str, output_format: str = 'xlsx') -> Path:
+        return self.cache_dir / f"{key}.{output_format}"
+
+    async def get_or_generate(self, period: str, source_df: pd.DataFrame,
+                              counting_method: str = 'Jours Ouvrés',
+                              output_format: str = 'xlsx') -> Tuple[Path, bool]:
+        """
+        Retourne le fichier du rapport, généré seulement s'il n'est pas en cache
+
+        Args:
+            output_format: xlsx (double-bloc), csv ou parquet (tableau plat pour BI)
+
+        Returns:
+            (chemin de l'artefact, True si servi depuis le cache)
+        """
+        key = self.cache_key(period, source_df, counting_method, output_format)
+        artifact = self.artifact_path(key, output_format)
+        if artifact.exists():
+            os.utime(artifact)  # Récence pour l'éviction
+            logger.info(f"📦 Rapport {period} servi depuis le cache ({key[:12]})")
+            return artifact, True
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # Fichier temporaire unique puis renommage atomique : pas d'écrasement concurrent
+        tmp_path = self.cache_dir / f"{key}.{uuid.uuid4().hex}.tmp.{output_format}"
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(
+                self.executor, render_report,
+                source_df, str(self.mapping_path), str(tmp_path), counting_method, output_format
+            )
+            os.replace(tmp_path, artifact)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+        logger.info(f"📊 Rapport {period} généré ({len(source_df)} lignes source, clé {key[:12]})")
+        self._prune()
+        return artifact, False
+
+    def _prune(self):
+        """Conserve les `max_cached` artefacts les plus récents"""
+        artifacts = sorted(
+            (p for p in self.cache_dir.iterdir() if p.suffix.lstrip('.') in MEDIA_TYPES),
+            key=lambda p: p.stat().st_mtime, reverse=True
+        )
+        for stale in artifacts[self.max_cached:]:
+            if ".tmp." not in stale.name:
+                stale.unlink(missing_ok=True)
@@ -0,0 +1,373 @@
+"""
+Rollups absences - Agrégats maintenus incrémentalement
+MOZAIK RH - Tableaux de bord en temps constant
+
+La collection `absence_rollups` contient des compteurs pré-agrégés
+(nombre d'absences et total de jours) par période, indexés par
+tenant, département, site, motif et catégorie d'employé :
+
+- granularity "day"            : période YYYY-MM-DD (date de début)
+- granularity "month"          : période YYYY-MM
+- granularity "employee_month" : période YYYY-MM, par employé et statut
+                                 (source du générateur de rapports)
+
+Chaque écriture sur `absences` (création, modification, suppression,
+approbation, import) applique un delta ; `rebuild()` recalcule tout
+depuis l'historique.
+
+Les dimensions de l'employé (département, site, catégorie) retenues à
+l'ajout d'une absence sont enregistrées sur l'absence (`rollup_dims`) : un
+retrait décrémente exactement les compteurs incrémentés, même après une
+mutation de l'employé. `rebuild()` relit les profils actuels (réalignement
+de l'historique après changement de département/site) et réécrit
+`rollup_dims` ; les rollups sont construits dans une collection temporaire
+puis renommés, la collection servie n'est jamais vide ni partielle.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from absence_analytics import DEFAULT_DEPARTMENT, build_rollup_kpi_pipeline
+from db_indexes import replace_collection
+import materialized_state
+
+logger = logging.getLogger(__name__)
+
+# Version des données d'absence dans `materialized_state` : incrémentée à
+# chaque écriture des rollups (clé des caches calculés sur l'historique des
+# absences, partagée entre processus)
+STATE_NAME = "absence_rollups"
+
+
+async def data_version(db) -> int:
+    """Version courante des absences (change à chaque création, modification, suppression)"""
+    return await materialized_state.current_version(db, STATE_NAME)
+
+
+# Dimensions de l'employé figées sur l'absence à son ajout dans les rollups
+PROFILE_FIELDS = ("department", "site", "categorie_employe")
+
+# Champs composant la clé unique d'un document de rollup
+KEY_FIELDS = (
+    "granularity", "period", "tenant", "department", "site",
+    "motif", "categorie_employe", "employee_id", "status"
+)
+
+
+def parse_absence_date(value) -> Optional[date]:
+    """Convertit une date d'absence (DD/MM/YYYY, YYYY-MM-DD ou datetime) en date"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if not value or not isinstance(value, str):
+        return None
+
+    for fmt in ("%d/%m/%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value[:10], fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def absence_days(absence: Dict) -> float:
+    """
+    Durée en jours d'une absence
+
+    Utilise `jours_absence` s'il est numérique, sinon l'écart calendaire
+    entre date de début et date de fin (même règle que le générateur de rapports).
+    """
+    raw = absence.get("jours_absence")
+    try:
+        days = float(str(raw).replace(",", "."))
+    except (TypeError, ValueError):
+        days = 0.0
+
+    if days > 0:
+        return days
+
+    start = parse_absence_date(absence.get("date_debut"))
+    end = parse_absence_date(absence.get("date_fin"))
+    if start and end:
+        return float(max((end - start).days + 1, 1))
+    return 0.0
+
+
+class AbsenceRollupService:
+    """Maintenance et lecture des rollups d'absences"""
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = db.absence_rollups
+        # Écritures incrémentales de ce processus suspendues pendant rebuild()
+        self._rebuild_lock = asyncio.Lock()
+
+    # ========================================================================
+    # ÉCRITURE INCRÉMENTALE
+    # ========================================================================
+
+    async def apply(self, absence: Dict, sign: int = 1) -> int:
+        """Ajoute (sign=1) ou retire (sign=-1) une absence des rollups"""
+        return await self.apply_many([absence], sign=sign)
+
+    async def replace(self, old_absence: Dict, new_absence: Dict) -> int:
+        """Applique une modification : retrait de l'ancienne version, ajout de la nouvelle"""
+        return await self._write([(old_absence, -1), (new_absence, 1)])
+
+    async def apply_many(self, absences: Iterable[Dict], sign: int = 1) -> int:
+        """
+        Applique un lot d'absences en un seul bulk_write
+
+        Returns:
+            Nombre de documents de rollup touchés
+        """
+        return await self._write([(absence, sign) for absence in absences])
+
+    async def _write(self, signed_absences: List[Tuple[Dict, int]]) -> int:
+        """
+        Écrit les deltas d'un lot d'absences
+
+        Une erreur est journalisée sans faire échouer l'opération métier :
+        `rebuild()` permet de réaligner les rollups.
+        """
+        signed_absences = [(a, s) for a, s in signed_absences if a]
+        if not signed_absences:
+            return 0
+
+        try:
+            async with self._rebuild_lock:
+                written = await self._write_deltas(signed_absences)
+        except Exception as e:
+            logger.error(f"❌ Erreur mise à jour rollups absences: {str(e)}")
+            written = 0
+        # Après l'écriture (même en échec : les absences ont changé) : un cache ne
+        # peut pas associer l'état précédent à la nouvelle version
+        try:
+            await materialized_state.bump_version(self.db, STATE_NAME)
+        except Exception as e:
+            logger.error(f"❌ Erreur mise à jour version des absences: {str(e)}")
+        return written
+
+    async def _write_deltas(self, signed_absences: List[Tuple[Dict, int]]) -> int:
+        # Dimensions enregistrées sur l'absence ; profil courant pour une absence jamais ajoutée
+        missing = {a.get("employee_id") for a, _ in signed_absences if not a.get("rollup_dims")}
+        profiles = await self._load_profiles(missing)
+
+        # Cumul des deltas par clé avant écriture
+        deltas: Dict[Tuple, Dict] = {}
+        stamped: Dict[str, Dict] = {}
+        for absence, sign in signed_absences:
+            dims = absence.get("rollup_dims")
+            if not dims:
+                dims = self._dims(profiles, absence)
+                if sign > 0 and absence.get("id"):
+                    stamped[absence["id"]] = dims
+            self._accumulate(deltas, absence, dims, sign)
+
+        now = datetime.utcnow().isoformat()
+        operations = []
+        for key, delta in deltas.items():
+            if delta["count"] == 0 and delta["days"] == 0:
+                continue
+            update = {
+                "$inc": {"count": delta["count"], "days": round(delta["days"], 4)},
+                "$set": {"updated_at": now}
+            }
+            if delta.get("employee_name"):
+                update["$set"]["employee_name"] = delta["employee_name"]
+            operations.append(UpdateOne(dict(zip(KEY_FIELDS, key)), update, upsert=True))
+
+        if operations:
+            await self.collection.bulk_write(operations, ordered=False)
+
+        # Dimensions retenues, enregistrées sur les absences ajoutées
+        if stamped:
+            await self.db.absences.bulk_write([
+                UpdateOne({"id": absence_id}, {"$set": {"rollup_dims": dims}})
+                for absence_id, dims in stamped.items()
+            ], ordered=False)
+            for absence, sign in signed_absences:
+                if absence.get("id") in stamped:
+                    absence["rollup_dims"] = stamped[absence["id"]]
+
+        # Combinaisons retombées exactement à zéro : supprimées ; un compteur négatif
+        # signale une dérive, conservé pour rebuild()
+        decremented = [dict(zip(KEY_FIELDS, key)) for key, delta in deltas.items() if delta["count"] < 0]
+        if decremented:
+            await self.collection.delete_many({"$or": decremented, "count": 0})
+            negative = await self.collection.count_documents({"$or": decremented, "count": {"$lt": 0}})
+            if negative:
+                logger.warning(f"⚠️ Rollups absences: {negative} compteur(s) négatif(s), rebuild() recommandé")
+
+        return len(operations)
+
+    def _accumulate(self, deltas: Dict[Tuple, Dict], absence: Dict, dims: Dict, sign: int):
+        """Ajoute la contribution d'une absence aux deltas par clé"""
+        days = absence_days(absence)
+        for key in self._keys_for(absence, dims):
+            delta = deltas.setdefault(key, {"count": 0, "days": 0.0})
+            delta["count"] += sign
+            delta["days"] += sign * days
+            if key[0] == "employee_month" and sign > 0:
+                delta["employee_name"] = absence.get("employee_name")
+
+    @staticmethod
+    def _dims(profiles: Dict[str, Dict], absence: Dict) -> Dict:
+        """Dimensions du profil courant de l'employé d'une absence"""
+        profile = profiles.get(absence.get("employee_id"), {})
+        return {field: profile.get(field) for field in PROFILE_FIELDS}
+
+    async def _load_profiles(self, employee_ids) -> Dict[str, Dict]:
+        """Département, site et catégorie des employés concernés (une seule requête)"""
+        ids = [i for i in employee_ids if i]
+        if not ids:
+            return {}
+        users = await self.db.users.find(
+            {"id": {"$in": ids}},
+            {"_id": 0, "id": 1, "department": 1, "site": 1, "categorie_employe": 1}
+        ).to_list(len(ids))
+        return {u["id"]: u for u in users}
+
+    def _keys_for(self, absence: Dict, dims: Dict) -> List[Tuple]:
+        """Clés de rollup (une par granularité) auxquelles contribue une absence"""
+        start = parse_absence_date(absence.get("date_debut"))
+        day = start.isoformat() if start else None
+        month = start.strftime("%Y-%m") if start else None
+
+        base = {
+            "tenant": absence.get("tenant_id") or self.db.name,
+            "department": dims.get("department") or DEFAULT_DEPARTMENT,
+            "site": dims.get("site"),
+            "motif": absence.get("motif_absence"),
+            "categorie_employe": dims.get("categorie_employe"),
+            "employee_id": None,
+            "status": None
+        }
+
+        keys = []
+        for granularity, period in (("day", day), ("month", month), ("employee_month", month)):
+            # Une date illisible n'alimente pas le rollup journalier (période inconnue)
+            if granularity == "day" and period is None:
+                continue
+            fields = dict(base, granularity=granularity, period=period)
+            if granularity == "employee_month":
+                fields["employee_id"] = absence.get("employee_id")
+                fields["status"] = absence.get("status") or "approved"
+            keys.append(tuple(fields[f] for f in KEY_FIELDS))
+        return keys
+
+    # ========================================================================
+    # RECONSTRUCTION
+    # ========================================================================
+
+    async def rebuild(self, batch_size: int = 1000) -> Dict:
+        """
+        Recalcule entièrement les rollups depuis la collection `absences`
+
+        Les dimensions sont relues sur les profils actuels (`users`) et
+        réécrites sur les absences (`rollup_dims`). Les rollups sont écrits
+        dans une collection temporaire, indexée comme la collection servie,
+        puis renommée à sa place (remplacement atomique). Les écritures
+        incrémentales de ce processus attendent la fin du recalcul ; celles
+        d'un autre processus pendant le recalcul sont écrasées par le
+        renommage (recalcul à lancer hors période d'écriture).
+
+        Returns:
+            {"absences": int, "rollups": int}
+        """
+        async with self._rebuild_lock:
+            deltas: Dict[Tuple, Dict] = {}
+            processed = 0
+            batch = []
+            async for absence in self.db.absences.find({}, {"_id": 0}):
+                batch.append(absence)
+                if len(batch) >= batch_size:
+                    await self._rebuild_batch(batch, deltas)
+                    processed += len(batch)
+                    batch = []
+            if batch:
+                await self._rebuild_batch(batch, deltas)
+                processed += len(batch)
+
+            now = datetime.utcnow().isoformat()
+            documents = []
+            for key, delta in deltas.items():
+                if delta["count"] == 0:
+                    continue
+                document = {**dict(zip(KEY_FIELDS, key)), "count": delta["count"],
+                            "days": round(delta["days"], 4), "updated_at": now}
+                if delta.get("employee_name"):
+                    document["employee_name"] = delta["employee_name"]
+                documents.append(document)
+
+            await replace_collection(self.db, self.collection.name, documents)
+            await materialized_state.bump_version(self.db, STATE_NAME)
+
+        logger.info(f"📊 Rollups absences reconstruits: {processed} absences → {len(documents)} documents")
+        return {"absences": processed, "rollups": len(documents)}
+
+    async def _rebuild_batch(self, absences: List[Dict], deltas: Dict[Tuple, Dict]):
+        """Un lot du recalcul : profils actuels en une requête, `rollup_dims` réalignées"""
+        profiles = await self._load_profiles({a.get("employee_id") for a in absences})
+        restamp = []
+        for absence in absences:
+            dims = self._dims(profiles, absence)
+            self._accumulate(deltas, absence, dims, 1)
+            if absence.get("id") and absence.get("rollup_dims") != dims:
+                restamp.append(UpdateOne({"id": absence["id"]}, {"$set": {"rollup_dims": dims}}))
+        if restamp:
+            await self.db.absences.bulk_write(restamp, ordered=False)
+
+    async def clear(self) -> int:
+        """Vide les rollups (suppression de toutes les absences)"""
+        result = await self.collection.delete_many({})
+        return result.deleted_count
+
+    # ========================================================================
+    # LECTURE
+    # ========================================================================
+
+    async def has_rollups(self) -> bool:
+        """True si les rollups ont été alimentés"""
+        return await self.collection.find_one({}, {"_id": 1}) is not None
+
+    async def kpi_facets(self, year: int) -> Dict:
+        """Facettes KPI (même forme que le pipeline sur `absences`) lues depuis les rollups"""
+        result = await self.collection.aggregate(build_rollup_kpi_pipeline(year)).to_list(1)
+        return result[0] if result else {}
+
+    async def iter_report_rows(self, year: int, month: Optional[int] = None):
+        """
+        Lignes source du rapport double-bloc (une par employé, motif, statut et mois)
+
+        Générateur async sur le curseur MongoDB. Format attendu par
+        AbsenceTableauAdapter : EmployeNom, TypeAbsence, Duree, StatutPlanif.
+        """
+        period = f"{year}-{month:02d}" if month else {"$regex": f"^{year}-"}
+        cursor = self.collection.find(
+            {"granularity": "employee_month", "period": period, "count": {"$gt": 0}},
+            {"_id": 0, "employee_name": 1, "motif": 1, "days": 1, "status": 1}
+        )
+
+        async for rollup in cursor:
+            yield {
+                "EmployeNom": rollup.get("employee_name") or "Inconnu",
+                "TypeAbsence": rollup.get("motif") or "INCONNU",
+                "Duree": rollup.get("days", 0),
+                "DateDebut": "",
+                "DateFin": "",
+                "StatutPlanif": rollup.get("status") or "approved"
+            }
+
+    async def rename_employee(self, employee_id: str, new_name: str) -> int:
+        """Propage un changement de nom dans les rollups par employé"""
+        result = await self.collection.update_many(
+            {"granularity": "employee_month", "employee_id": employee_id},
+            {"$set": {"employee_name": new_name}}
+        )
+        return result.modified_count
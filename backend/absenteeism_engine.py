@@ -0,0 +1,310 @@
+"""
+Moteur d'absentéisme - Matrice employé × jour (NumPy)
+MOZAIK RH - Taux, indices et comparaison N-1
+
+Pour une période donnée, chaque absence d'absentéisme est projetée sur une
+matrice int8 (une ligne par employé, une colonne par jour calendaire).
+Tous les indicateurs en découlent par opérations vectorisées :
+
+- Taux d'absentéisme   : jours ouvrés d'absence pondérés par le temps de travail
+                         / jours ouvrés théoriques (en ETP) × 100
+- Indice de fréquence  : nombre d'arrêts (épisodes) par ETP
+- Indice de gravité    : durée moyenne d'un arrêt (jours ouvrés par épisode)
+- Facteur de Bradford  : S² × D par employé (S = épisodes, D = jours ouvrés d'absence)
+
+Jours ouvrés : lundi à vendredi (jours fériés non déduits).
+
+Seules les absences commencées entre l'année N-1 - LOOKBACK_YEARS et la fin
+de période sont lues. Le résultat est mis en cache par (période, motifs)
+tant que la version des rollups d'absence (absence_rollups.data_version,
+stockée dans MongoDB et donc partagée par tous les processus) ne change pas.
+"""
+
+import logging
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+from absence_analytics import DEFAULT_DEPARTMENT
+from absence_rollups import data_version, parse_absence_date
+from ccn66_rules import calculate_prorata
+
+logger = logging.getLogger(__name__)
+
+# Motifs comptés comme absentéisme (mêmes codes que le rapport double-bloc)
+ABSENTEEISM_MOTIFS = ("AM", "AT", "MPRO", "NAUT", "AUT", "CSS")
+
+# Années de début lues avant la période : arrêts longs commencés l'année précédente
+LOOKBACK_YEARS = 1
+
+# Résultats mis en cache par (période, motifs) jusqu'à la prochaine écriture
+# d'absence ; la durée de vie couvre les écritures faites hors des rollups
+# (scripts, accès direct à la base)
+CACHE_TTL_SECONDS = 300
+
+
+def build_start_years_filter(start: date, end: date) -> Dict:
+    """
+    Absences dont la date de début tombe entre start.year - LOOKBACK_YEARS et end.year
+
+    date_debut est stockée en DD/MM/YYYY, YYYY-MM-DD (préfixe/suffixe d'année)
+    ou en date typée.
+    """
+    years = range(start.year - LOOKBACK_YEARS, end.year + 1)
+    clauses = [{"date_debut": {"$regex": f"^{year}-"}} for year in years]
+    clauses += [{"date_debut": {"$regex": f"/{year}$"}} for year in years]
+    clauses.append({"date_debut": {
+        "$gte": datetime(years[0], 1, 1), "$lt": datetime(end.year + 1, 1, 1)
+    }})
+    return {"$or": clauses}
+
+
+def shift_year(day: date, years: int) -> date:
+    """Décale une date d'un nombre d'années (29/02 → 28/02)"""
+    try:
+        return day.replace(year=day.year + years)
+    except ValueError:
+        return day.replace(year=day.year + years, day=28)
+
+
+def absence_span(absence: Dict) -> Optional[Tuple[date, date]]:
+    """
+    Période couverte par une absence (bornes incluses)
+
+    Sans date de fin lisible, la durée déclarée est comptée en jours calendaires.
+    """
+    start = parse_absence_date(absence.get("date_debut"))
+    if not start:
+        return None
+
+    end = parse_absence_date(absence.get("date_fin"))
+    if not end:
+        try:
+            days = float(str(absence.get("jours_absence")).replace(",", "."))
+        except (TypeError, ValueError):
+            days = 1
+        end = start + timedelta(days=max(int(np.ceil(days)), 1) - 1)
+
+    return (start, end) if end >= start else (start, start)
+
+
+class AbsenceMatrix:
+    """Matrice d'absence employé × jour calendaire (int8, 1 = absent)"""
+
+    def __init__(self, employee_ids: Sequence[str], start: date, end: date):
+        self.employee_ids = list(employee_ids)
+        self.row_of = {employee_id: i for i, employee_id in enumerate(self.employee_ids)}
+        self.start = start
+        self.end = end
+        self.n_days = (end - start).days + 1
+        self.values = np.zeros((len(self.employee_ids), self.n_days), dtype=np.int8)
+
+    @classmethod
+    def build(
+        cls,
+        employee_ids: Sequence[str],
+        start: date,
+        end: date,
+        spans: Iterable[Tuple[str, date, date]]
+    ) -> "AbsenceMatrix":
+        """
+        Construit la matrice à partir de périodes (employee_id, début, fin)
+
+        Les périodes sont cumulées dans un tableau de différences puis
+        intégrées (cumsum) : coût O(absences + employés × jours).
+        """
+        matrix = cls(employee_ids, start, end)
+        rows, firsts, lasts = [], [], []
+        for employee_id, span_start, span_end in spans:
+            row = matrix.row_of.get(employee_id)
+            if row is None or span_end < start or span_start > end:
+                continue
+            rows.append(row)
+            firsts.append((max(span_start, start) - start).days)
+            lasts.append((min(span_end, end) - start).days)
+
+        if rows:
+            diff = np.zeros((len(matrix.employee_ids), matrix.n_days + 1), dtype=np.int32)
+            rows = np.asarray(rows)
+            np.add.at(diff, (rows, np.asarray(firsts)), 1)
+            np.add.at(diff, (rows, np.asarray(lasts) + 1), -1)
+            matrix.values = (np.cumsum(diff[:, :-1], axis=1) > 0).astype(np.int8)
+
+        return matrix
+
+    def working_day_mask(self) -> np.ndarray:
+        """Colonnes correspondant aux jours ouvrés (lundi → vendredi)"""
+        weekdays = (np.arange(self.n_days) + self.start.weekday()) % 7
+        return weekdays < 5
+
+    def absent_working_days(self) -> np.ndarray:
+        """Jours ouvrés d'absence par employé"""
+        return self.values[:, self.working_day_mask()].sum(axis=1, dtype=np.int64)
+
+    def spells(self) -> np.ndarray:
+        """Nombre d'épisodes d'absence (transitions présent → absent) par employé"""
+        padded = np.pad(self.values, ((0, 0), (1, 0)))
+        return (np.diff(padded, axis=1) > 0).sum(axis=1, dtype=np.int64)
+
+
+class AbsenteeismEngine:
+    """Indicateurs d'absentéisme d'une période, avec comparaison N-1 par département"""
+
+    def __init__(self, db):
+        self.db = db
+        self._cache: Dict[tuple, tuple] = {}
+
+    async def _load(self, start: date, end: date, motifs: Sequence[str]):
+        """Employés actifs et périodes d'absence (une requête par collection)"""
+        employees = await self.db.users.find(
+            {"is_active": {"$ne": False}},
+            {"_id": 0, "id": 1, "name": 1, "department": 1, "temps_travail": 1}
+        ).to_list(None)
+
+        spans = []
+        cursor = self.db.absences.find(
+            {"motif_absence": {"$in": list(motifs)}, "status": {"$ne": "rejected"},
+             **build_start_years_filter(start, end)},
+            {"_id": 0, "employee_id": 1, "date_debut": 1, "date_fin": 1, "jours_absence": 1}
+        )
+        async for absence in cursor:
+            span = absence_span(absence)
+            if span and span[1] >= start and span[0] <= end:
+                spans.append((absence.get("employee_id"), span[0], span[1]))
+
+        return employees, spans
+
+    @staticmethod
+    def _metrics(absent_days: np.ndarray, spells: np.ndarray, weights: np.ndarray, working_days: int) -> Dict:
+        """Indicateurs agrégés d'un groupe d'employés"""
+        fte = float(weights.sum())
+        total_spells = int(spells.sum())
+        total_days = int(absent_days.sum())
+        theoretical = fte * working_days
+
+        return {
+            "headcount": int(len(weights)),
+            "fte": round(fte, 2),
+            "absentDays": total_days,
+            "spells": total_spells,
+            "absenteeismRate": round(float((absent_days * weights).sum()) / theoretical * 100, 2) if theoretical > 0 else 0,
+            "frequencyIndex": round(total_spells / fte, 3) if fte > 0 else 0,
+            "gravityIndex": round(total_days / total_spells, 2) if total_spells > 0 else 0
+        }
+
+    def _period_metrics(self, employees, weights, departments, spans, start, end) -> Dict:
+        """Matrice et indicateurs (global + par département) d'une période"""
+        matrix = AbsenceMatrix.build([e["id"] for e in employees], start, end, spans)
+        working_days = int(matrix.working_day_mask().sum())
+        absent_days = matrix.absent_working_days()
+        spells = matrix.spells()
+
+        department_names, department_codes = np.unique(departments, return_inverse=True)
+        by_department = {}
+        for code, name in enumerate(department_names):
+            mask = department_codes == code
+            by_department[str(name)] = self._metrics(absent_days[mask], spells[mask], weights[mask], working_days)
+
+        return {
+            "workingDays": working_days,
+            "overall": self._metrics(absent_days, spells, weights, working_days),
+            "byDepartment": by_department,
+            "absentDays": absent_days,
+            "spellsPerEmployee": spells
+        }
+
+    async def compute(
+        self,
+        start: date,
+        end: date,
+        motifs: Optional[Sequence[str]] = None,
+        top_bradford: int = 20
+    ) -> Dict:
+        """
+        Calcule les indicateurs de la période et leur évolution vs la même période N-1
+
+        Args:
+            start: Début de période (inclus)
+            end: Fin de période (incluse)
+            motifs: Codes d'absence comptés (défaut : ABSENTEEISM_MOTIFS)
+            top_bradford: Nombre d'employés retournés dans le classement Bradford
+        """
+        motifs = list(motifs or ABSENTEEISM_MOTIFS)
+        key = (start, end, tuple(sorted(motifs)), top_bradford)
+        version = await data_version(self.db)
+        cached = self._cache.get(key)
+        if cached and cached[0] == version and time.monotonic() - cached[1] < CACHE_TTL_SECONDS:
+            return {**cached[2], "cached": True}
+
+        result = await self._compute(start, end, motifs, top_bradford)
+        self._cache[key] = (version, time.monotonic(), result)
+        return {**result, "cached": False}
+
+    async def _compute(self, start: date, end: date, motifs: Sequence[str], top_bradford: int) -> Dict:
+        """Calcul (sans cache) : chargement de la fenêtre N-1 → N, puis matrices"""
+        previous_start, previous_end = shift_year(start, -1), shift_year(end, -1)
+        timings = {}
+
+        step = time.perf_counter()
+        employees, spans = await self._load(previous_start, end, motifs)
+        timings["load"] = round((time.perf_counter() - step) * 1000, 2)
+
+        step = time.perf_counter()
+        weights = np.array([calculate_prorata(1.0, e.get("temps_travail")) for e in employees], dtype=np.float64)
+        departments = np.array([e.get("department") or DEFAULT_DEPARTMENT for e in employees], dtype=object)
+
+        current = self._period_metrics(employees, weights, departments, spans, start, end)
+        previous = self._period_metrics(employees, weights, departments, spans, previous_start, previous_end)
+        timings["compute"] = round((time.perf_counter() - step) * 1000, 2)
+
+        # 📈 Évolution N-1 par département
+        department_rows = []
+        for department, metrics in current["byDepartment"].items():
+            before = previous["byDepartment"].get(department, {})
+            department_rows.append({
+                "department": department,
+                **metrics,
+                "previousAbsenteeismRate": before.get("absenteeismRate", 0),
+                "absenteeismRateDelta": round(metrics["absenteeismRate"] - before.get("absenteeismRate", 0), 2),
+                "absentDaysDelta": metrics["absentDays"] - before.get("absentDays", 0)
+            })
+        department_rows.sort(key=lambda x: x["absenteeismRate"], reverse=True)
+
+        # 🚨 Facteur de Bradford (S² × D)
+        spells = current["spellsPerEmployee"]
+        absent_days = current["absentDays"]
+        bradford = spells ** 2 * absent_days
+        bradford_rows = []
+        for row in np.argsort(-bradford, kind="stable")[:top_bradford]:
+            if bradford[row] <= 0:
+                break
+            employee = employees[row]
+            bradford_rows.append({
+                "employee_id": employee["id"],
+                "employee_name": employee.get("name"),
+                "department": departments[row],
+                "spells": int(spells[row]),
+                "absentDays": int(absent_days[row]),
+                "bradfordFactor": int(bradford[row])
+            })
+
+        overall = current["overall"]
+        previous_overall = previous["overall"]
+
+        return {
+            "period": {"start": start.isoformat(), "end": end.isoformat(), "workingDays": current["workingDays"]},
+            "previousPeriod": {"start": previous_start.isoformat(), "end": previous_end.isoformat()},
+            "motifs": motifs,
+            "overall": overall,
+            "previous": previous_overall,
+            "comparison": {
+                "absenteeismRateDelta": round(overall["absenteeismRate"] - previous_overall["absenteeismRate"], 2),
+                "absentDaysDelta": overall["absentDays"] - previous_overall["absentDays"],
+                "spellsDelta": overall["spells"] - previous_overall["spells"]
+            },
+            "byDepartment": department_rows,
+            "bradford": bradford_rows,
+            "timings": timings
+        }
@@ -6,17 +6,22 @@ Transforme TableauAnalyseAbsences en format double-bloc :
 
 Usage:
     python adapt_absences_tableau.py --source data/absences.xlsx --mapping config/mapping.csv --output out/Analyse_Final.xlsx
+
+Usage en processus (serveur) :
+    AbsenceTableauAdapter(source_df=df, mapping_path=..., output_path=..., log_path=...).run()
 """
 
 import pandas as pd
 import numpy as np
 import json
 import argparse
+from copy import copy
 from pathlib import Path
 from datetime import datetime
 from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils.dataframe import dataframe_to_rows
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
+from openpyxl.utils import get_column_letter
 
 # 📋 CONFIGURATION DES TYPES D'ABSENCE
 TYPES_PROGRAMMEES = [
@@ -47,6 +52,16 @@ TYPES_ABSENTEISME = [
     'CSS'   # Congés Sans Solde
 ]
 
+# 💾 Formats d'export : Excel double-bloc, ou tableau plat pour les outils BI
+OUTPUT_FORMATS = ('xlsx', 'csv', 'parquet')
+
+# 📅 Jours comptés par méthode de décompte (lundi → dimanche, cf. calculate_end_date)
+# "Jours Calendaires" : tous les jours (pas de masque)
+COUNTING_WEEKMASKS = {
+    'Jours Ouvrés': '1111110',     # Lundi → samedi
+    'Jours Ouvrables': '1111100'   # Lundi → vendredi
+}
+
 # Mapping par défaut si fichier mapping non fourni
 DEFAULT_MAPPING = {
     'Congés Annuels': 'CA',
@@ -83,16 +98,26 @@ DEFAULT_MAPPING = {
 }
 
 class AbsenceTableauAdapter:
-    def __init__(self, source_path, mapping_path=None, output_path=None, counting_method='Jours Ouvrés'):
-        self.source_path = Path(source_path)
+    def __init__(self, source_path=None, mapping_path=None, output_path=None, counting_method='Jours Ouvrés',
+                 source_df=None, log_path='./out/absences_adapt_log.json', output_format=None):
+        if source_path is None and source_df is None:
+            raise ValueError("source_path ou source_df requis")
+        
+        self.source_path = Path(source_path) if source_path else None
         self.mapping_path = Path(mapping_path) if mapping_path else None
         self.output_path = Path(output_path) if output_path else Path('./out/Analyse_Absences_Final.xlsx')
         self.counting_method = counting_method
+        self.log_path = Path(log_path) if log_path else None
+        
+        # Format de sortie : explicite, sinon déduit de l'extension (xlsx par défaut)
+        self.output_format = (output_format or self.output_path.suffix.lstrip('.') or 'xlsx').lower()
+        if self.output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Format de sortie non supporté: {self.output_format}")
         
         # Logs
         self.log = {
             'timestamp': datetime.now().isoformat(),
-            'source_file': str(self.source_path),
+            'source_file': str(self.source_path) if self.source_path else 'DataFrame',
             'output_file': str(self.output_path),
             'rows_processed': 0,
             'unmapped_types': [],
@@ -102,22 +127,23 @@ class AbsenceTableauAdapter:
             'errors': []
         }
         
-        # Data
-        self.df_source = None
+        # Data (un DataFrame fourni évite tout fichier intermédiaire)
+        self.df_source = source_df.copy() if source_df is not None else None
         self.mapping = None
         self.df_final = None
     
     def load_source_data(self):
-        """Charge le fichier source (CSV ou XLSX)"""
-        print(f"📂 Chargement de {self.source_path}...")
+        """Charge le fichier source (CSV ou XLSX) ou valide le DataFrame fourni"""
+        print(f"📂 Chargement de {self.source_path or 'DataFrame en mémoire'}...")
         
         try:
-            if self.source_path.suffix.lower() == '.csv':
-                self.df_source = pd.read_csv(self.source_path)
-            elif self.source_path.suffix.lower() in ['.xlsx', '.xls']:
-                self.df_source = pd.read_excel(self.source_path)
-            else:
-                raise ValueError(f"Format non supporté: {self.source_path.suffix}")
+            if self.source_path is not None:
+                if self.source_path.suffix.lower() == '.csv':
+                    self.df_source = pd.read_csv(self.source_path)
+                elif self.source_path.suffix.lower() in ['.xlsx', '.xls']:
+                    self.df_source = pd.read_excel(self.source_path)
+                else:
+                    raise ValueError(f"Format non supporté: {self.source_path.suffix}")
             
             print(f"✅ {len(self.df_source)} lignes chargées")
             self.log['rows_processed'] = len(self.df_source)
@@ -188,32 +214,32 @@ class AbsenceTableauAdapter:
         return self.mapping
     
     def map_type_codes(self):
-        """Mappe les types d'absence vers les codes officiels"""
+        """Mappe les types d'absence vers les codes officiels (vectorisé)"""
         print("\n🔄 Mapping des types d'absence...")
         
-        def map_type(type_str):
-            if pd.isna(type_str):
-                return 'INCONNU'
-            
-            type_str = str(type_str).strip()
-            
-            # Recherche exacte
-            if type_str in self.mapping:
-                return self.mapping[type_str]
-            
-            # Recherche insensible à la casse
-            for intitule, code in self.mapping.items():
-                if type_str.lower() == intitule.lower():
-                    return code
-            
-            # Type non mappé
+        types = self.df_source['TypeAbsence']
+        missing = types.isna()
+        labels = types.astype(str).str.strip()
+        
+        # Dictionnaire insensible à la casse : la première entrée l'emporte (comme l'ancien parcours linéaire)
+        casefolded = {}
+        for intitule, code in self.mapping.items():
+            casefolded.setdefault(str(intitule).casefold(), code)
+        
+        # Recherche exacte, puis insensible à la casse
+        # (where plutôt que fillna : pas de conversion implicite de dtype)
+        codes = labels.map(self.mapping)
+        codes = codes.where(codes.notna(), labels.str.casefold().map(casefolded))
+        codes = codes.where(codes.notna() & ~missing, 'INCONNU')
+        
+        # Types non mappés (ordre de première apparition)
+        unmapped = pd.unique(labels[(codes == 'INCONNU') & ~missing])
+        for type_str in unmapped:
             if type_str not in self.log['unmapped_types']:
                 self.log['unmapped_types'].append(type_str)
                 print(f"   ⚠️  Type non mappé: '{type_str}'")
-            
-            return 'INCONNU'
         
-        self.df_source['CodeTypeAbsence'] = self.df_source['TypeAbsence'].apply(map_type)
+        self.df_source['CodeTypeAbsence'] = codes
         
         mapped_count = (self.df_source['CodeTypeAbsence'] != 'INCONNU').sum()
         print(f"✅ {mapped_count}/{len(self.df_source)} types mappés avec succès")
@@ -224,30 +250,26 @@ class AbsenceTableauAdapter:
         return self.df_source
     
     def classify_absences(self):
-        """Classifie en PROGRAMMÉES vs ABSENTÉISME"""
+        """Classifie en PROGRAMMÉES vs ABSENTÉISME (vectorisé)"""
         print("\n📊 Classification des absences...")
         
-        def classify(row):
-            code = row['CodeTypeAbsence']
-            
-            # Si StatutPlanif existe, le respecter
-            if 'StatutPlanif' in row and pd.notna(row['StatutPlanif']):
-                statut = str(row['StatutPlanif']).lower()
-                if 'planif' in statut or 'valid' in statut or 'appro' in statut:
-                    return 'programmee'
-                else:
-                    return 'absenteisme'
-            
-            # Classification par code
-            if code in TYPES_PROGRAMMEES:
-                return 'programmee'
-            elif code in TYPES_ABSENTEISME:
-                return 'absenteisme'
-            else:
-                # Par défaut : absentéisme pour INCONNU
-                return 'absenteisme'
+        codes = self.df_source['CodeTypeAbsence']
+        
+        # Si StatutPlanif existe, le respecter ; sinon classification par code
+        # (INCONNU et codes hors listes : absentéisme)
+        if 'StatutPlanif' in self.df_source.columns:
+            statut = self.df_source['StatutPlanif']
+            has_statut = statut.notna().to_numpy()
+            statut_prog = statut.astype(str).str.lower().str.contains('planif|valid|appro', regex=True).to_numpy()
+        else:
+            has_statut = np.zeros(len(self.df_source), dtype=bool)
+            statut_prog = has_statut
         
-        self.df_source['Classification'] = self.df_source.apply(classify, axis=1)
+        self.df_source['Classification'] = np.select(
+            [has_statut & statut_prog, has_statut, codes.isin(TYPES_PROGRAMMEES).to_numpy()],
+            ['programmee', 'absenteisme', 'programmee'],
+            default='absenteisme'
+        )
         
         prog_count = (self.df_source['Classification'] == 'programmee').sum()
         absent_count = (self.df_source['Classification'] == 'absenteisme').sum()
@@ -256,8 +278,16 @@ class AbsenceTableauAdapter:
         
         return self.df_source
     
+    @staticmethod
+    def _parse_dates(series):
+        """Dates DD/MM/YYYY ou YYYY-MM-DD (éventuellement suivies d'une heure) → datetime64"""
+        values = series.astype(str).str.strip().str[:10]
+        iso = pd.to_datetime(values, format='%Y-%m-%d', errors='coerce')
+        french = pd.to_datetime(values, format='%d/%m/%Y', errors='coerce')
+        return iso.fillna(french)
+    
     def calculate_durations(self):
-        """Calcule les durées si manquantes"""
+        """Calcule les durées si manquantes, selon la méthode de décompte (vectorisé)"""
         print("\n⏱️  Calcul des durées...")
         
         if 'Duree' not in self.df_source.columns:
@@ -275,28 +305,35 @@ class AbsenceTableauAdapter:
         
         # Si Duree = 0 et dates disponibles, calculer
         if 'DateDebut' in self.df_source.columns and 'DateFin' in self.df_source.columns:
-            mask_missing = self.df_source['Duree'] == 0
+            mask_missing = (self.df_source['Duree'] == 0).to_numpy()
             
-            for idx in self.df_source[mask_missing].index:
-                try:
-                    date_debut = pd.to_datetime(self.df_source.loc[idx, 'DateDebut'])
-                    date_fin = pd.to_datetime(self.df_source.loc[idx, 'DateFin'])
-                    
-                    if pd.notna(date_debut) and pd.notna(date_fin):
-                        # Calcul simple : différence en jours + 1
-                        days = (date_fin - date_debut).days + 1
-                        
-                        # TODO: Implémenter counting_method (Jours Ouvrés vs Calendaires)
-                        # Pour l'instant, utilisation simple
-                        
-                        self.df_source.loc[idx, 'Duree'] = max(days, 1)
-                        self.log['durations_calculated'] += 1
-                        
-                except Exception as e:
-                    self.log['warnings'].append(f"Erreur calcul durée ligne {idx}: {str(e)}")
+            if mask_missing.any():
+                date_debut = self._parse_dates(self.df_source.loc[mask_missing, 'DateDebut'])
+                date_fin = self._parse_dates(self.df_source.loc[mask_missing, 'DateFin'])
+                valid = (date_debut.notna() & date_fin.notna()).to_numpy()
+                
+                starts = date_debut.to_numpy()[valid].astype('datetime64[D]')
+                ends = date_fin.to_numpy()[valid].astype('datetime64[D]')
+                
+                # Décompte selon la méthode (mêmes conventions que calculate_end_date du serveur)
+                weekmask = COUNTING_WEEKMASKS.get(self.counting_method)
+                if weekmask:
+                    days = np.busday_count(starts, ends + np.timedelta64(1, 'D'), weekmask=weekmask)
+                else:
+                    days = (ends - starts).astype(np.int64) + 1
+                
+                rows = np.flatnonzero(mask_missing)[valid]
+                duree = self.df_source['Duree'].to_numpy(copy=True)
+                duree[rows] = np.maximum(days, 1)
+                self.df_source['Duree'] = duree
+                self.log['durations_calculated'] += int(valid.sum())
+                
+                invalid = int((~valid).sum())
+                if invalid:
+                    self.log['warnings'].append(f"{invalid} durée(s) non calculable(s): dates manquantes ou invalides")
         
         if self.log['durations_calculated'] > 0:
-            print(f"✅ {self.log['durations_calculated']} durées calculées")
+            print(f"✅ {self.log['durations_calculated']} durées calculées ({self.counting_method})")
         
         return self.df_source
     
@@ -400,99 +437,133 @@ class AbsenceTableauAdapter:
         
         return self.df_final
     
+    def _register_styles(self, wb):
+        """Enregistre les styles nommés du rapport (calculés une fois, appliqués par ligne)"""
+        thin = Side(style='thin')
+        border = Border(left=thin, right=thin, top=thin, bottom=thin)
+        center = Alignment(horizontal='center', vertical='center')
+        
+        definitions = {
+            # Ligne 1 : titres de blocs
+            'abs_title_prog': dict(font=Font(bold=True, size=12), fill=PatternFill(start_color="FFA500", end_color="FFA500", fill_type="solid"), alignment=center),
+            'abs_title_absent': dict(font=Font(bold=True, size=12), fill=PatternFill(start_color="90EE90", end_color="90EE90", fill_type="solid"), alignment=center),
+            # Ligne 2 : en-têtes de colonnes
+            'abs_header_prog': dict(font=Font(bold=True, size=11), fill=PatternFill(start_color="FFA500", end_color="FFA500", fill_type="solid"), alignment=center, border=border),
+            'abs_header_absent': dict(font=Font(bold=True, size=11), fill=PatternFill(start_color="90EE90", end_color="90EE90", fill_type="solid"), alignment=center, border=border),
+            # Données
+            'abs_name': dict(font=Font(name='Calibri', size=11), border=border),
+            'abs_value': dict(font=Font(name='Calibri', size=11), border=border, alignment=center),
+            'abs_total': dict(font=Font(bold=True, size=10), fill=PatternFill(start_color="FFD700", end_color="FFD700", fill_type="solid"), alignment=center, border=border)
+        }
+        
+        for name, attributes in definitions.items():
+            style = NamedStyle(name=name)
+            for attribute, value in attributes.items():
+                setattr(style, attribute, value)
+            wb.add_named_style(style)
+    
     def export_to_excel(self):
-        """Exporte vers Excel avec formatage"""
+        """
+        Exporte vers Excel en écriture streaming (openpyxl write-only)
+        
+        Les lignes sont écrites au fil de l'eau avec des styles nommés précalculés :
+        la mémoire du classeur ne croît pas avec la taille du rapport.
+        """
         print(f"\n💾 Export vers {self.output_path}...")
         
         # Créer répertoire si nécessaire
         self.output_path.parent.mkdir(parents=True, exist_ok=True)
         
-        # Créer workbook
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Analyse"
-        
-        # Styles
-        header_prog_fill = PatternFill(start_color="FFA500", end_color="FFA500", fill_type="solid")  # Orange
-        header_absent_fill = PatternFill(start_color="90EE90", end_color="90EE90", fill_type="solid")  # Vert clair
-        total_fill = PatternFill(start_color="FFD700", end_color="FFD700", fill_type="solid")  # Or
-        
-        header_font = Font(bold=True, size=11)
-        total_font = Font(bold=True, size=10)
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(title="Analyse")
+        self._register_styles(wb)
         
-        center_align = Alignment(horizontal='center', vertical='center')
-        
-        thin_border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
-        
-        # Écrire en-têtes
         headers = list(self.df_final.columns)
         
         # Trouver index de séparation (après 'Total' des programmées)
         try:
             sep_idx = headers.index('Total') + 1
-        except:
+        except ValueError:
             sep_idx = len([c for c in headers if c in TYPES_PROGRAMMEES]) + 1
         
-        # Ligne 1 : Titres de blocs
-        ws['A1'] = 'ABSENCES PROGRAMMÉES'
-        ws.merge_cells(start_row=1, start_column=1, end_row=1, end_column=sep_idx)
-        ws['A1'].font = Font(bold=True, size=12)
-        ws['A1'].fill = header_prog_fill
-        ws['A1'].alignment = center_align
-        
-        ws.cell(row=1, column=sep_idx+1, value='ABSENTÉISME')
-        ws.merge_cells(start_row=1, start_column=sep_idx+1, end_row=1, end_column=len(headers))
-        ws.cell(row=1, column=sep_idx+1).font = Font(bold=True, size=12)
-        ws.cell(row=1, column=sep_idx+1).fill = header_absent_fill
-        ws.cell(row=1, column=sep_idx+1).alignment = center_align
-        
-        # Ligne 2 : En-têtes de colonnes
-        for col_idx, col_name in enumerate(headers, start=1):
-            cell = ws.cell(row=2, column=col_idx, value=col_name)
-            cell.font = header_font
-            cell.alignment = center_align
-            cell.border = thin_border
-            
-            if col_idx <= sep_idx:
-                cell.fill = header_prog_fill
-            else:
-                cell.fill = header_absent_fill
-        
-        # Données
-        for row_idx, row_data in enumerate(self.df_final.itertuples(index=False), start=3):
-            for col_idx, value in enumerate(row_data, start=1):
-                cell = ws.cell(row=row_idx, column=col_idx, value=value)
-                cell.border = thin_border
-                
-                # Formatage des totaux
-                if headers[col_idx-1] in ['Total', 'TOTAL']:
-                    cell.font = total_font
-                    cell.fill = total_fill
-                
-                # Centrage sauf EmployeNom
-                if col_idx > 1:
-                    cell.alignment = center_align
-        
-        # Ajuster largeurs
+        # Largeurs (à déclarer avant la première ligne en mode write-only)
         ws.column_dimensions['A'].width = 25  # EmployeNom
         for col_idx in range(2, len(headers) + 1):
-            ws.column_dimensions[ws.cell(row=2, column=col_idx).column_letter].width = 8
+            ws.column_dimensions[get_column_letter(col_idx)].width = 8
+        
+        # Style résolu une fois par nom, puis recopié (évite la recherche du style nommé à chaque cellule)
+        resolved_styles = {}
+        
+        def styled(value, style):
+            cell = WriteOnlyCell(ws, value=value)
+            if style in resolved_styles:
+                cell._style = copy(resolved_styles[style])
+            else:
+                cell.style = style
+                resolved_styles[style] = copy(cell._style)
+            return cell
+        
+        # Ligne 1 : titres de blocs fusionnés
+        ws.merged_cells.add(f"A1:{get_column_letter(sep_idx)}1")
+        ws.merged_cells.add(f"{get_column_letter(sep_idx + 1)}1:{get_column_letter(len(headers))}1")
+        title_row = [None] * len(headers)
+        title_row[0] = styled('ABSENCES PROGRAMMÉES', 'abs_title_prog')
+        title_row[sep_idx] = styled('ABSENTÉISME', 'abs_title_absent')
+        ws.append(title_row)
+        
+        # Ligne 2 : en-têtes de colonnes
+        ws.append([
+            styled(col_name, 'abs_header_prog' if col_idx <= sep_idx else 'abs_header_absent')
+            for col_idx, col_name in enumerate(headers, start=1)
+        ])
+        
+        # Données : style par colonne calculé une seule fois
+        column_styles = ['abs_name'] + [
+            'abs_total' if col_name in ['Total', 'TOTAL'] else 'abs_value'
+            for col_name in headers[1:]
+        ]
+        for row_data in self.df_final.itertuples(index=False):
+            ws.append([styled(value, style) for value, style in zip(row_data, column_styles)])
         
-        # Sauvegarder
         wb.save(self.output_path)
         
         print(f"✅ Fichier Excel créé: {self.output_path}")
         
         return self.output_path
     
+    def export_to_csv(self):
+        """Exporte le tableau final en CSV (consommateurs BI)"""
+        print(f"\n💾 Export CSV vers {self.output_path}...")
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        self.df_final.to_csv(self.output_path, index=False, encoding='utf-8')
+        print(f"✅ Fichier CSV créé: {self.output_path}")
+        return self.output_path
+    
+    def export_to_parquet(self):
+        """Exporte le tableau final en Parquet (consommateurs BI, nécessite pyarrow)"""
+        print(f"\n💾 Export Parquet vers {self.output_path}...")
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            self.df_final.to_parquet(self.output_path, index=False)
+        except ImportError as e:
+            raise ValueError(f"Export Parquet indisponible (installer pyarrow): {str(e)}")
+        print(f"✅ Fichier Parquet créé: {self.output_path}")
+        return self.output_path
+    
+    def export(self):
+        """Exporte dans le format demandé (xlsx, csv ou parquet)"""
+        exporters = {
+            'xlsx': self.export_to_excel,
+            'csv': self.export_to_csv,
+            'parquet': self.export_to_parquet
+        }
+        return exporters[self.output_format]()
+    
     def save_log(self):
-        """Sauvegarde le log JSON"""
-        log_path = Path('./out/absences_adapt_log.json')
+        """Sauvegarde le log JSON (désactivé si log_path=None)"""
+        log_path = self.log_path
+        if log_path is None:
+            return None
         log_path.parent.mkdir(parents=True, exist_ok=True)
         
         with open(log_path, 'w', encoding='utf-8') as f:
@@ -530,8 +601,8 @@ class AbsenceTableauAdapter:
             # 7. Assembler
             self.assemble_final_table(pivot_prog, pivot_absent)
             
-            # 8. Exporter Excel
-            self.export_to_excel()
+            # 8. Exporter (Excel streaming, CSV ou Parquet)
+            self.export()
             
             # 9. Sauvegarder log
             self.save_log()
@@ -566,8 +637,9 @@ def main():
     parser = argparse.ArgumentParser(description='Adaptateur Tableau Analyse Absences')
     parser.add_argument('--source', required=True, help='Chemin du fichier source (CSV/XLSX)')
     parser.add_argument('--mapping', help='Chemin du fichier de mapping (CSV/JSON, optionnel)')
-    parser.add_argument('--output', default='./out/Analyse_Absences_Final.xlsx', help='Chemin du fichier Excel de sortie')
-    parser.add_argument('--counting-method', default='Jours Ouvrés', choices=['Jours Ouvrés', 'Jours Calendaires'], help='Méthode de calcul des durées')
+    parser.add_argument('--output', default='./out/Analyse_Absences_Final.xlsx', help='Chemin du fichier de sortie (.xlsx, .csv ou .parquet)')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, help='Format de sortie (défaut : déduit de l\'extension)')
+    parser.add_argument('--counting-method', default='Jours Ouvrés', choices=['Jours Ouvrés', 'Jours Ouvrables', 'Jours Calendaires'], help='Méthode de calcul des durées')
     
     args = parser.parse_args()
     
@@ -575,7 +647,8 @@ def main():
         source_path=args.source,
         mapping_path=args.mapping,
         output_path=args.output,
-        counting_method=args.counting_method
+        counting_method=args.counting_method,
+        output_format=args.format
     )
     
     adapter.run()
@@ -4,15 +4,18 @@ MOZAIK RH - Version simplifiée et fonctionnelle
 
 Endpoints :
 - GET /api/leave-balances : Tous les soldes
+- GET /api/leave-balances/projection : Soldes projetés (demandes en attente)
 - GET /api/leave-balances/{user_id} : Solde d'un employé
 - GET /api/leave-balances/{user_id}/history : Historique
 - POST /api/leave-balances/initialize : Initialiser (admin)
 - POST /api/leave-balances/deduct : Déduire
 - POST /api/leave-balances/reintegrate : Réintégrer
 - POST /api/leave-balances/validate : Valider disponibilité
+- POST /api/leave-balances/validate-batch : Valider un lot de demandes
 - POST /api/leave-balances/detect/{absence_id} : Détection auto réintégration
 """
 
+from bson import ObjectId
 from fastapi import APIRouter, Depends, HTTPException
 from typing import Optional
 from datetime import datetime
@@ -22,9 +25,12 @@ from models_leave_balance import (
     DeductLeaveRequest,
     ReintegrateLeaveRequest,
     ValidateLeaveRequest,
+    ValidateLeaveBatchRequest,
     ManualAdjustmentRequest
 )
 from service_leave_balance import LeaveBalanceService
+from leave_balance_init import LeaveBalanceInitializer
+from leave_projection import LeaveProjectionService, invalidate as invalidate_projection
 
 router = APIRouter(prefix="/api/leave-balances", tags=["Leave Balances"])
 
@@ -63,6 +69,33 @@ async def get_all_balances(
     }
 
 
+@router.get("/projection")
+async def get_projected_balances(
+    fiscal_year: Optional[int] = None,
+    department: Optional[str] = None
+):
+    """
+    📈 Soldes projetés : solde actuel, demandes en attente, solde après approbation
+    
+    Lecture seule (aucun solde créé) : une agrégation joignant leave_balances,
+    absence_requests et absences en attente, mise en cache jusqu'à la
+    prochaine modification.
+    
+    Query params:
+    - fiscal_year: Année (défaut: année en cours)
+    - department: Limiter à un service (défaut: tous les employés)
+    """
+    import server
+    
+    projection = await LeaveProjectionService(server.db).get_projection(fiscal_year, department)
+    
+    return {
+        "success": True,
+        **projection,
+        "count": len(projection["employees"])
+    }
+
+
 @router.get("/{user_id}")
 async def get_user_balance(
     user_id: str,
@@ -189,6 +222,7 @@ async def initialize_balance(request: InitializeBalanceRequest):
         {"$set": balance},
         upsert=True
     )
+    await invalidate_projection(server.db)
     
     return {
         "success": True,
@@ -299,13 +333,46 @@ async def validate_leave_availability(request: ValidateLeaveRequest):
     result = await service.validate_leave_request(
         user_id=request.user_id,
         leave_type=request.leave_type,
-        amount=request.amount,
+        days=request.amount,
         fiscal_year=request.fiscal_year
     )
     
     return result
 
 
+@router.post("/validate-batch")
+async def validate_leave_batch(request: ValidateLeaveBatchRequest):
+    """
+    ✅ Valider un lot de demandes candidates (plan d'équipe)
+    
+    Les demandes sur un même solde (employé + type) sont cumulées dans
+    l'ordre du lot. Lecture seule : aucun solde n'est créé.
+    
+    Body:
+    - fiscal_year: Année (défaut: année en cours)
+    - requests: [{user_id, leave_type, amount, reference?}]
+    
+    Retourne un verdict par demande (valid, available, requested,
+    cumulative_requested, remaining) et la liste des soldes dépassés.
+    """
+    service = get_service()
+    
+    verdicts = await service.validate_leave_requests(
+        [item.dict() for item in request.requests],
+        request.fiscal_year
+    )
+    
+    exceeded = sorted({(v["user_id"], v["leave_type"]) for v in verdicts if not v["valid"]})
+    
+    return {
+        "success": True,
+        "valid": not exceeded,
+        "verdicts": verdicts,
+        "exceeded": [{"user_id": user_id, "leave_type": leave_type} for user_id, leave_type in exceeded],
+        "count": len(verdicts)
+    }
+
+
 @router.post("/detect/{absence_id}")
 async def detect_and_reintegrate(absence_id: str):
     """
@@ -320,7 +387,13 @@ async def detect_and_reintegrate(absence_id: str):
     service = get_service()
     
     try:
-        reintegrations = await service.detect_and_reintegrate(absence_id)
+        sick_leave = await service.absences_collection.find_one({"id": absence_id})
+        if sick_leave is None and ObjectId.is_valid(absence_id):
+            sick_leave = await service.absences_collection.find_one({"_id": ObjectId(absence_id)})
+        if sick_leave is None:
+            raise HTTPException(status_code=404, detail="Absence not found")
+        
+        reintegrations = await service.detect_and_reintegrate(sick_leave)
         
         return {
             "success": True,
@@ -328,6 +401,8 @@ async def detect_and_reintegrate(absence_id: str):
             "count": len(reintegrations)
         }
     
+    except HTTPException:
+        raise
     except Exception as e:
         return {
             "success": False,
@@ -383,13 +458,13 @@ async def initialize_all_balances(
     🚀 Initialiser les soldes de tous les employés avec calcul CCN66
     
     Cette fonction:
-    1. Récupère tous les employés de la base
-    2. Calcule les droits selon CCN66:
-       - CA: 25j (proratisé temps partiel)
+    1. Parcourt tous les employés de la base (par lots)
+    2. Calcule les droits selon CCN66 (ccn66_rules):
+       - CA: 30j (proratisé temps partiel)
        - RTT: 12j
        - CT: 9j ou 18j selon catégorie (proratisé)
        - CEX: Ancienneté 2j/5ans max 6j (non proratisé)
-    3. Crée les soldes dans la collection leave_balances
+    3. Écrit les soldes dans leave_balances (bulk_write d'upserts)
     
     Query params:
     - fiscal_year: Année (défaut: année en cours)
@@ -397,123 +472,16 @@ async def initialize_all_balances(
     """
     import server
     
-    if fiscal_year is None:
-        fiscal_year = datetime.now().year
-    
-    print(f"\n🚀 Starting initialization for fiscal year {fiscal_year}")
-    
-    # Get all users
-    users = await server.db.users.find({}).to_list(None)
-    print(f"📋 Found {len(users)} users")
-    
-    initialized = 0
-    skipped = 0
-    updated = 0
-    errors = []
-    
-    for user in users:
-        user_id = user.get("id")
-        if not user_id:
-            continue
-        
-        try:
-            # Check if balance exists
-            existing = await server.db.leave_balances.find_one({
-                "user_id": user_id,
-                "fiscal_year": fiscal_year
-            })
-            
-            if existing and not force_recalculate:
-                skipped += 1
-                continue
-            
-            # Calculate CCN66-compliant balances
-            categorie = user.get("categorie_employe", "").upper()
-            metier = user.get("metier", "").lower()
-            temps_travail = user.get("temps_travail", "100%")
-            date_embauche = user.get("date_embauche")
-            
-            # Parse temps_travail percentage
-            try:
-                if isinstance(temps_travail, str):
-                    temps_percent = float(temps_travail.replace("%", "").strip()) / 100.0
-                else:
-                    temps_percent = float(temps_travail) / 100.0
-            except:
-                temps_percent = 1.0
-            
-            # Calculate CA (prorated for part-time)
-            ca_initial = 25.0 if temps_percent == 1.0 else round(25.0 * temps_percent, 1)
-            
-            # Calculate CT based on category
-            category_a_keywords = ["educateur", "éducateur", "ouvrier", "chef"]
-            is_category_a = categorie == "A" or any(kw in metier for kw in category_a_keywords)
-            
-            ct_base = 18.0 if is_category_a else 9.0
-            ct_initial = ct_base if temps_percent == 1.0 else round(ct_base * temps_percent, 1)
-            
-            # Calculate ancienneté (NOT prorated)
-            cex_initial = 0.0
-            if date_embauche:
-                try:
-                    if isinstance(date_embauche, str):
-                        for fmt in ["%Y-%m-%d", "%d/%m/%Y", "%Y/%m/%d"]:
-                            try:
-                                hire_date = datetime.strptime(date_embauche, fmt)
-                                break
-                            except:
-                                continue
-                    else:
-                        hire_date = date_embauche
-                    
-                    years_service = (datetime.now() - hire_date).days / 365.25
-                    if years_service >= 5:
-                        cex_initial = min(6.0, (int(years_service / 5) * 2))
-                except:
-                    pass
-            
-            # RTT: 12 days base
-            rtt_initial = 12.0
-            
-            # Create balance document
-            balance_doc = {
-                "id": f"lb_{user_id}_{fiscal_year}",
-                "user_id": user_id,
-                "fiscal_year": fiscal_year,
-                "ca_balance": ca_initial,
-                "rtt_balance": rtt_initial,
-                "rec_balance": 0.0,
-                "ct_balance": ct_initial,
-                "cex_balance": cex_initial,
-                "last_updated": datetime.utcnow()
-            }
-            
-            if existing:
-                # Update existing
-                await server.db.leave_balances.update_one(
-                    {"user_id": user_id, "fiscal_year": fiscal_year},
-                    {"$set": balance_doc}
-                )
-                updated += 1
-                print(f"  ✅ Updated: {user.get('prenom')} {user.get('nom')} - CA={ca_initial}j, CT={ct_initial}j, CEX={cex_initial}j")
-            else:
-                # Create new
-                await server.db.leave_balances.insert_one(balance_doc)
-                initialized += 1
-                print(f"  ✅ Created: {user.get('prenom')} {user.get('nom')} - CA={ca_initial}j, CT={ct_initial}j, CEX={cex_initial}j")
-        
-        except Exception as e:
-            errors.append({"user_id": user_id, "error": str(e)})
-            print(f"  ❌ Error for {user.get('email')}: {e}")
+    result = await LeaveBalanceInitializer(server.db, schema="user").initialize_all(fiscal_year, force_recalculate)
     
     return {
         "success": True,
-        "fiscal_year": fiscal_year,
-        "initialized": initialized,
-        "updated": updated,
-        "skipped": skipped,
-        "errors": len(errors),
-        "error_details": errors if errors else None,
-        "total_processed": initialized + updated + skipped
+        "fiscal_year": result["year"],
+        "initialized": result["initialized"],
+        "updated": result["updated"],
+        "skipped": result["skipped"],
+        "errors": result["errors"],
+        "error_details": result["error_details"] or None,
+        "total_processed": result["total_processed"] + result["skipped"]
     }
 
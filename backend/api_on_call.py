@@ -6,16 +6,48 @@ Gestion des plannings d'astreintes pour MOZAIK RH
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, Field, field_validator
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime, date
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+import asyncio
 import uuid
 import logging
 import os
+import time
+from collections import OrderedDict
+
+import materialized_state
 
 logger = logging.getLogger(__name__)
 security = HTTPBearer()
 
+# Code d'erreur MongoDB d'une clé unique déjà présente (index employee_id + date)
+DUPLICATE_KEY_CODE = 11000
+
+# Statut de chaque élément retourné par la création d'astreintes
+STATUS_CREATED = "created"
+STATUS_ALREADY_EXISTS = "already_exists"
+
+# Journalisation de diagnostic (nom de base, nombre total de documents) : coûte
+# deux requêtes supplémentaires, activée uniquement avec ON_CALL_DEBUG=1
+ON_CALL_DEBUG = os.environ.get("ON_CALL_DEBUG", "").lower() in ("1", "true", "yes")
+
+# Cache des astreintes par mois (LRU, par processus) : la version de chaque
+# mois est stockée dans MongoDB (materialized_state) et incrémentée par les
+# écritures de ce module, de sorte que tous les workers invalident leur
+# cache ; la durée de vie maximale couvre les écritures faites hors de ce
+# module (scripts, accès direct à la base)
+CACHE_TTL_SECONDS = 300
+
+# Entrées conservées (mois complets et mois par employé)
+MAX_CACHE_ENTRIES = 256
+
+# Au-delà, une plage de dates est lue en une seule requête plutôt que mois par mois
+MAX_CACHED_MONTHS = 12
+
+_month_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+
 router = APIRouter(prefix="/api/on-call", tags=["on-call"])
 
 
@@ -105,6 +137,7 @@ class OnCallScheduleResponse(OnCallScheduleBase):
     id: str = Field(..., description="Unique identifier")
     created_at: str = Field(..., description="Creation timestamp")
     created_by: str = Field(..., description="User who created this schedule")
+    status: Optional[str] = Field(default=None, description="'created' or 'already_exists' (creation endpoints)")
     
     class Config:
         json_schema_extra = {
@@ -166,6 +199,150 @@ def parse_from_mongo(item: dict) -> dict:
     return item
 
 
+def build_schedule_doc(schedule: OnCallScheduleCreate, created_by: str, now: str) -> dict:
+    """Document MongoDB d'une nouvelle astreinte"""
+    return {
+        'id': str(uuid.uuid4()),
+        'employee_id': schedule.employee_id,
+        'employee_name': schedule.employee_name,
+        'date': schedule.date,
+        'type': schedule.type,
+        'notes': schedule.notes,
+        'created_at': now,
+        'created_by': created_by
+    }
+
+
+async def find_existing_schedules(db: AsyncIOMotorDatabase, keys: List[tuple]) -> dict:
+    """
+    Astreintes déjà enregistrées pour des couples (employee_id, date), en une requête
+
+    Returns:
+        {(employee_id, date): document}
+    """
+    if not keys:
+        return {}
+    query = {'$or': [{'employee_id': employee_id, 'date': day} for employee_id, day in set(keys)]}
+    existing = await db.on_call_schedules.find(query, {'_id': 0}).to_list(length=None)
+    return {(doc['employee_id'], doc['date']): doc for doc in existing}
+
+
+# ========================
+# Month Cache
+# ========================
+
+def month_of(day: str) -> Optional[Tuple[int, int]]:
+    """(année, mois) d'une date YYYY-MM-DD (None si illisible)"""
+    try:
+        return int(day[:4]), int(day[5:7])
+    except (TypeError, ValueError):
+        return None
+
+
+def month_range(year: int, month: int) -> dict:
+    """Filtre de plage sur `date` (chaînes YYYY-MM-DD) couvrant un mois"""
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return {'$gte': f"{year:04d}-{month:02d}-01", '$lt': f"{next_year:04d}-{next_month:02d}-01"}
+
+
+def months_between(start: str, end: str) -> List[Tuple[int, int]]:
+    """Mois couverts par une plage de dates YYYY-MM-DD (bornes incluses)"""
+    year, month = month_of(start)
+    last = month_of(end)
+    months = []
+    while (year, month) <= last:
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def month_state_name(year: int, month: int) -> str:
+    return f"on_call_schedules:{year:04d}-{month:02d}"
+
+
+async def month_version(db: AsyncIOMotorDatabase, year: int, month: int) -> int:
+    """Version des astreintes d'un mois (incrémentée à chaque écriture, partagée entre processus)"""
+    return await materialized_state.current_version(db, month_state_name(year, month))
+
+
+async def invalidate_months(db: AsyncIOMotorDatabase, *days: str):
+    """À appeler après toute écriture sur on_call_schedules (dates concernées)"""
+    months = {month_of(day) for day in days if day} - {None}
+    await asyncio.gather(*(
+        materialized_state.bump_version(db, month_state_name(*key)) for key in months
+    ))
+
+
+async def get_month_schedules(db: AsyncIOMotorDatabase, year: int, month: int,
+                              employee_id: Optional[str] = None) -> List[dict]:
+    """
+    Astreintes d'un mois (d'un employé) triées par date, depuis le cache
+
+    Lecture par plage d'index sur `date` ou `(employee_id, date)`.
+    """
+    key = (year, month, employee_id)
+    version = await month_version(db, year, month)
+    cached = _month_cache.get(key)
+    if cached and cached[0] == version and time.monotonic() - cached[1] < CACHE_TTL_SECONDS:
+        _month_cache.move_to_end(key)
+        return [dict(schedule) for schedule in cached[2]]
+
+    query = {'date': month_range(year, month)}
+    if employee_id:
+        query['employee_id'] = employee_id
+    schedules = await db.on_call_schedules.find(query, {'_id': 0}).sort('date', 1).to_list(length=None)
+
+    _month_cache[key] = (version, time.monotonic(), schedules)
+    _month_cache.move_to_end(key)
+    while len(_month_cache) > MAX_CACHE_ENTRIES:
+        _month_cache.popitem(last=False)
+    return [dict(schedule) for schedule in schedules]
+
+
+async def insert_schedules(db: AsyncIOMotorDatabase, schedules: List[OnCallScheduleCreate],
+                           created_by: str) -> List[dict]:
+    """
+    Création en lot (saisie manuelle ou planning généré), en un aller-retour
+
+    Returns:
+        Une astreinte par élément, avec status 'created' ou 'already_exists'
+    """
+    now = datetime.now().isoformat()
+    docs = [build_schedule_doc(schedule, created_by, now) for schedule in schedules]
+    if not docs:
+        return []
+    
+    # Un seul aller-retour : insertion non ordonnée, l'index unique
+    # (employee_id, date) rejette les doublons sans interrompre le lot
+    duplicates = set()
+    try:
+        await db.on_call_schedules.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get('writeErrors', []):
+            if error.get('code') != DUPLICATE_KEY_CODE:
+                raise
+            duplicates.add(error['index'])
+    finally:
+        await invalidate_months(db, *{doc['date'] for doc in docs})
+    
+    existing = await find_existing_schedules(
+        db, [(docs[index]['employee_id'], docs[index]['date']) for index in duplicates]
+    )
+    
+    results = []
+    for index, doc in enumerate(docs):
+        if index in duplicates:
+            logger.info(f"⏩ Skipping duplicate schedule for {doc['employee_id']} on {doc['date']}")
+            doc = existing.get((doc['employee_id'], doc['date']), doc)
+            results.append({**doc, 'status': STATUS_ALREADY_EXISTS})
+        else:
+            results.append({**parse_from_mongo(doc), 'status': STATUS_CREATED})
+    
+    logger.info(f"✅ Created {len(docs) - len(duplicates)} on-call schedules successfully "
+                f"({len(duplicates)} already existing)")
+    return results
+
+
 # ========================
 # API Endpoints
 # ========================
@@ -188,23 +365,16 @@ async def get_on_call_schedule(
     try:
         logger.info(f"📅 Fetching on-call schedule - month={month}, year={year}, employee_id={employee_id}")
         
-        # Build query filter
-        query = {}
-        
-        if employee_id:
-            query['employee_id'] = employee_id
-        
         if month and year:
-            # Filter by month and year in date string (YYYY-MM-DD format)
-            month_str = f"{year}-{str(month).zfill(2)}"
-            query['date'] = {'$regex': f'^{month_str}'}
-        elif year:
-            # Filter by year only
-            query['date'] = {'$regex': f'^{year}'}
-        
-        # Get schedules from database
-        cursor = db.on_call_schedules.find(query)
-        schedules = await cursor.to_list(length=None)
+            # Un mois : plage d'index, servie depuis le cache
+            schedules = await get_month_schedules(db, year, month, employee_id)
+        else:
+            query = {}
+            if employee_id:
+                query['employee_id'] = employee_id
+            if year:
+                query['date'] = {'$gte': f"{year:04d}-01-01", '$lt': f"{year + 1:04d}-01-01"}
+            schedules = await db.on_call_schedules.find(query, {'_id': 0}).sort('date', 1).to_list(length=None)
         
         # Parse and return
         result = [parse_from_mongo(schedule) for schedule in schedules]
@@ -231,12 +401,6 @@ async def get_on_call_assignments(
     """
     try:
         logger.info(f"📅 Fetching on-call assignments - startDate={startDate}, endDate={endDate}")
-        logger.info(f"📊 Database name: {db.name}")
-        logger.info(f"📊 Collection exists: {('on_call_schedules' in await db.list_collection_names())}")
-        
-        # Count total documents in collection
-        total_count = await db.on_call_schedules.count_documents({})
-        logger.info(f"📊 Total on-call schedules in DB: {total_count}")
         
         # Validate date format
         try:
@@ -245,20 +409,27 @@ async def get_on_call_assignments(
         except ValueError:
             raise HTTPException(status_code=400, detail="Dates must be in YYYY-MM-DD format")
         
-        # Build query for date range
-        query = {
-            'date': {
-                '$gte': startDate,
-                '$lte': endDate
-            }
-        }
-        
-        logger.info(f"📊 Query: {query}")
-        
-        cursor = db.on_call_schedules.find(query)
-        assignments = await cursor.to_list(length=None)
-        
-        logger.info(f"📊 Found {len(assignments)} raw documents")
+        if ON_CALL_DEBUG:
+            logger.info(f"📊 Database name: {db.name}")
+            logger.info(f"📊 Collection exists: {('on_call_schedules' in await db.list_collection_names())}")
+            logger.info(f"📊 Total on-call schedules in DB: {await db.on_call_schedules.count_documents({})}")
+        
+        # Mois couverts par la plage (cache par mois), puis filtrage aux bornes
+        months = months_between(startDate, endDate)
+        if len(months) > MAX_CACHED_MONTHS:
+            assignments = await db.on_call_schedules.find(
+                {'date': {'$gte': startDate, '$lte': endDate}}, {'_id': 0}
+            ).sort('date', 1).to_list(length=None)
+        else:
+            assignments = []
+            for year, month in months:
+                assignments.extend(
+                    schedule for schedule in await get_month_schedules(db, year, month)
+                    if startDate <= schedule['date'] <= endDate
+                )
+        
+        if ON_CALL_DEBUG:
+            logger.info(f"📊 Found {len(assignments)} raw documents")
         
         # Parse and return
         result = [parse_from_mongo(assignment) for assignment in assignments]
@@ -286,37 +457,22 @@ async def create_on_call_schedule(
     try:
         logger.info(f"➕ Creating on-call schedule for employee {schedule.employee_id} on {schedule.date}")
         
-        # Create schedule document
-        schedule_id = str(uuid.uuid4())
-        now = datetime.now().isoformat()
+        schedule_doc = build_schedule_doc(schedule, current_user, datetime.now().isoformat())
         
-        schedule_doc = {
-            'id': schedule_id,
-            'employee_id': schedule.employee_id,
-            'employee_name': schedule.employee_name,
-            'date': schedule.date,
-            'type': schedule.type,
-            'notes': schedule.notes,
-            'created_at': now,
-            'created_by': current_user
-        }
-        
-        # Check for duplicate
-        existing = await db.on_call_schedules.find_one({
-            'employee_id': schedule.employee_id,
-            'date': schedule.date
-        })
-        
-        if existing:
+        # L'index unique (employee_id, date) arbitre les créations concurrentes
+        try:
+            await db.on_call_schedules.insert_one(schedule_doc)
+            await invalidate_months(db, schedule_doc['date'])
+        except DuplicateKeyError:
             logger.warning(f"⚠️ Duplicate on-call schedule found for {schedule.employee_id} on {schedule.date}")
             # Return existing instead of error for better UX
-            return parse_from_mongo(existing)
+            existing = await db.on_call_schedules.find_one(
+                {'employee_id': schedule.employee_id, 'date': schedule.date}, {'_id': 0}
+            )
+            return {**existing, 'status': STATUS_ALREADY_EXISTS}
         
-        # Insert into database
-        await db.on_call_schedules.insert_one(schedule_doc)
-        
-        logger.info(f"✅ On-call schedule created successfully: {schedule_id}")
-        return schedule_doc
+        logger.info(f"✅ On-call schedule created successfully: {schedule_doc['id']}")
+        return {**parse_from_mongo(schedule_doc), 'status': STATUS_CREATED}
         
     except Exception as e:
         logger.error(f"❌ Error creating on-call schedule: {str(e)}")
@@ -337,39 +493,7 @@ async def create_bulk_on_call_schedules(
     try:
         logger.info(f"➕ Creating {len(bulk_data.schedules)} on-call schedules in bulk")
         
-        created_schedules = []
-        now = datetime.now().isoformat()
-        
-        for schedule in bulk_data.schedules:
-            # Check for duplicate
-            existing = await db.on_call_schedules.find_one({
-                'employee_id': schedule.employee_id,
-                'date': schedule.date
-            })
-            
-            if existing:
-                logger.info(f"⏩ Skipping duplicate schedule for {schedule.employee_id} on {schedule.date}")
-                created_schedules.append(parse_from_mongo(existing))
-                continue
-            
-            # Create new schedule
-            schedule_id = str(uuid.uuid4())
-            schedule_doc = {
-                'id': schedule_id,
-                'employee_id': schedule.employee_id,
-                'employee_name': schedule.employee_name,
-                'date': schedule.date,
-                'type': schedule.type,
-                'notes': schedule.notes,
-                'created_at': now,
-                'created_by': current_user
-            }
-            
-            await db.on_call_schedules.insert_one(schedule_doc)
-            created_schedules.append(schedule_doc)
-        
-        logger.info(f"✅ Created {len(created_schedules)} on-call schedules successfully")
-        return created_schedules
+        return await insert_schedules(db, bulk_data.schedules, current_user)
         
     except Exception as e:
         logger.error(f"❌ Error creating bulk on-call schedules: {str(e)}")
@@ -391,12 +515,13 @@ async def delete_on_call_schedule(
         logger.info(f"🗑️ Deleting on-call schedule: {schedule_id}")
         
         # Delete from database
-        result = await db.on_call_schedules.delete_one({'id': schedule_id})
+        deleted = await db.on_call_schedules.find_one_and_delete({'id': schedule_id}, projection={'date': 1})
         
-        if result.deleted_count == 0:
+        if not deleted:
             logger.warning(f"⚠️ On-call schedule not found: {schedule_id}")
             raise HTTPException(status_code=404, detail="Schedule not found")
         
+        await invalidate_months(db, deleted.get('date'))
         logger.info(f"✅ On-call schedule deleted successfully: {schedule_id}")
         return None
         
@@ -439,10 +564,17 @@ async def update_on_call_schedule(
             'updated_by': current_user
         }
         
-        await db.on_call_schedules.update_one(
-            {'id': schedule_id},
-            {'$set': update_doc}
-        )
+        try:
+            await db.on_call_schedules.update_one(
+                {'id': schedule_id},
+                {'$set': update_doc}
+            )
+        except DuplicateKeyError:
+            raise HTTPException(
+                status_code=409,
+                detail=f"An on-call schedule already exists for this employee on {schedule.date}"
+            )
+        await invalidate_months(db, existing.get('date'), schedule.date)
         
         # Fetch updated document
         updated = await db.on_call_schedules.find_one({'id': schedule_id})
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+⏱️ BENCHMARK ADAPTATEUR TABLEAU ANALYSE ABSENCES
+Compare les étapes de transformation vectorisées d'AbsenceTableauAdapter
+(map_type_codes, classify_absences, calculate_durations) à l'implémentation
+historique ligne par ligne, sur une source synthétique.
+
+La sortie doit être identique avec le mapping CSV livré. La comparaison se
+fait en "Jours Calendaires", seule méthode que l'ancienne version calculait,
+et avec des dates ISO, interprétées de la même façon par les deux versions.
+
+Usage:
+    python benchmark_adapt_absences.py --rows 200000
+"""
+
+import argparse
+import contextlib
+import io
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from adapt_absences_tableau import AbsenceTableauAdapter, TYPES_PROGRAMMEES, TYPES_ABSENTEISME
+
+MAPPING_PATH = Path(__file__).parent / "config" / "mapping_absences.csv"
+STAGES = ('map_type_codes', 'classify_absences', 'calculate_durations')
+
+
+class LegacyAbsenceTableauAdapter(AbsenceTableauAdapter):
+    """Étapes de transformation telles qu'implémentées avant vectorisation (référence)"""
+
+    def map_type_codes(self):
+        def map_type(type_str):
+            if pd.isna(type_str):
+                return 'INCONNU'
+            type_str = str(type_str).strip()
+            if type_str in self.mapping:
+                return self.mapping[type_str]
+            for intitule, code in self.mapping.items():
+                if type_str.lower() == intitule.lower():
+                    return code
+            if type_str not in self.log['unmapped_types']:
+                self.log['unmapped_types'].append(type_str)
+            return 'INCONNU'
+
+        self.df_source['CodeTypeAbsence'] = self.df_source['TypeAbsence'].apply(map_type)
+        return self.df_source
+
+    def classify_absences(self):
+        def classify(row):
+            code = row['CodeTypeAbsence']
+            if 'StatutPlanif' in row and pd.notna(row['StatutPlanif']):
+                statut = str(row['StatutPlanif']).lower()
+                if 'planif' in statut or 'valid' in statut or 'appro' in statut:
+                    return 'programmee'
+                return 'absenteisme'
+            if code in TYPES_PROGRAMMEES:
+                return 'programmee'
+            return 'absenteisme'
+
+        self.df_source['Classification'] = self.df_source.apply(classify, axis=1)
+        return self.df_source
+
+    def calculate_durations(self):
+        self.df_source['Duree'] = pd.to_numeric(self.df_source['Duree'], errors='coerce').fillna(0)
+        mask_missing = self.df_source['Duree'] == 0
+        for idx in self.df_source[mask_missing].index:
+            try:
+                date_debut = pd.to_datetime(self.df_source.loc[idx, 'DateDebut'])
+                date_fin = pd.to_datetime(self.df_source.loc[idx, 'DateFin'])
+                if pd.notna(date_debut) and pd.notna(date_fin):
+                    days = (date_fin - date_debut).days + 1
+                    self.df_source.loc[idx, 'Duree'] = max(days, 1)
+                    self.log['durations_calculated'] += 1
+            except Exception as e:
+                self.log['warnings'].append(f"Erreur calcul durée ligne {idx}: {str(e)}")
+        return self.df_source
+
+
+def build_source(rows: int, seed: int = 42) -> pd.DataFrame:
+    """Source synthétique : intitulés du mapping (casse variée), inconnus, durées manquantes"""
+    rng = np.random.default_rng(seed)
+    mapping = pd.read_csv(MAPPING_PATH)
+    labels = list(mapping['Intitule']) + [c for c in TYPES_PROGRAMMEES + TYPES_ABSENTEISME]
+    labels += ['Motif inconnu', 'Autre absence', '  Arrêt maladie  ']
+
+    types = rng.choice(np.array(labels, dtype=object), size=rows)
+    case = rng.random(rows)
+    types = np.where(case < 0.1, np.char.upper(types.astype(str)).astype(object), types)
+    types = np.where((case >= 0.1) & (case < 0.2), np.char.lower(types.astype(str)).astype(object), types)
+    types[rng.random(rows) < 0.01] = None
+
+    starts = np.datetime64('2024-01-01') + rng.integers(0, 730, size=rows).astype('timedelta64[D]')
+    ends = starts + rng.integers(0, 15, size=rows).astype('timedelta64[D]')
+    durations = rng.integers(1, 15, size=rows).astype(object)
+    durations[rng.random(rows) < 0.2] = 0
+    durations[rng.random(rows) < 0.05] = ''
+
+    statuts = rng.choice(np.array(['approved', 'pending', 'validated_by_manager', 'planifiée', 'rejected', None],
+                                  dtype=object), size=rows)
+
+    return pd.DataFrame({
+        'EmployeNom': [f"Employé {i:04d}" for i in rng.integers(0, 2000, size=rows)],
+        'TypeAbsence': types,
+        'Duree': durations,
+        'DateDebut': pd.Series(starts).dt.strftime('%Y-%m-%d'),
+        'DateFin': pd.Series(ends).dt.strftime('%Y-%m-%d'),
+        'StatutPlanif': statuts
+    })
+
+
+def run_stages(adapter_cls, source: pd.DataFrame, counting_method: str):
+    """Exécute chargement, mapping, classification, durées puis pivots ; retourne (adaptateur, temps par étape)"""
+    adapter = adapter_cls(source_df=source, mapping_path=MAPPING_PATH, counting_method=counting_method, log_path=None)
+
+    timings = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        adapter.load_source_data()
+        adapter.load_mapping()
+
+        for stage in STAGES:
+            start = time.perf_counter()
+            getattr(adapter, stage)()
+            timings[stage] = time.perf_counter() - start
+
+        adapter.assemble_final_table(*adapter.create_pivot_tables())
+    return adapter, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark des étapes vectorisées de l\'adaptateur absences')
+    parser.add_argument('--rows', type=int, default=200_000, help='Nombre de lignes source synthétiques')
+    args = parser.parse_args()
+
+    source = build_source(args.rows)
+    print(f"📊 Source synthétique: {len(source)} lignes")
+
+    legacy, legacy_times = run_stages(LegacyAbsenceTableauAdapter, source, 'Jours Calendaires')
+    vectorized, vectorized_times = run_stages(AbsenceTableauAdapter, source, 'Jours Calendaires')
+
+    print("\n" + "=" * 64)
+    print(f"{'Étape':<24}{'Historique (s)':>14}{'Vectorisé (s)':>14}{'Gain':>10}")
+    print("=" * 64)
+    for stage in STAGES:
+        speedup = legacy_times[stage] / vectorized_times[stage] if vectorized_times[stage] else float('inf')
+        print(f"{stage:<24}{legacy_times[stage]:>14.3f}{vectorized_times[stage]:>14.3f}{speedup:>9.1f}x")
+    total_legacy, total_vectorized = sum(legacy_times.values()), sum(vectorized_times.values())
+    print(f"{'TOTAL':<24}{total_legacy:>14.3f}{total_vectorized:>14.3f}{total_legacy / total_vectorized:>9.1f}x")
+
+    # Sortie identique : colonnes intermédiaires, tableau final et types non mappés
+    for column in ('CodeTypeAbsence', 'Classification', 'Duree'):
+        pd.testing.assert_series_equal(legacy.df_source[column], vectorized.df_source[column],
+                                       check_dtype=False, check_names=False)
+    pd.testing.assert_frame_equal(legacy.df_final, vectorized.df_final, check_dtype=False)
+    assert legacy.log['unmapped_types'] == vectorized.log['unmapped_types']
+    assert legacy.log['durations_calculated'] == vectorized.log['durations_calculated']
+    print("\n✅ Sorties identiques (tableau final, codes, classification, durées, types non mappés)")
+
+    # Méthodes de décompte désormais prises en compte
+    for method in ('Jours Ouvrés', 'Jours Ouvrables'):
+        adapter, _ = run_stages(AbsenceTableauAdapter, source, method)
+        print(f"   • {method}: total durées = {adapter.df_source['Duree'].sum():,.0f}")
+
+
+if __name__ == "__main__":
+    main()
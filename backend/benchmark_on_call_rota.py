@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+⏱️ BENCHMARK GÉNÉRATEUR DE PLANNING D'ASTREINTES
+Génère une année complète (12 mois) pour une population synthétique
+(100 employés par défaut) avec RotaSolver : absences aléatoires, quotas
+CCN66 par catégorie, poids d'équité variés. La charge et les quotas sont
+reportés d'un mois sur l'autre, comme en production.
+
+Vérifie qu'aucune contrainte n'est violée (absence, quota) et que deux
+exécutions avec la même graine produisent le même planning.
+
+Usage:
+    python benchmark_on_call_rota.py --employees 100 --mode day --iterations 2000
+"""
+
+import argparse
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from on_call_quotas import CCN66_ON_CALL_LIMITS
+from on_call_rota import DEFAULT_ITERATIONS, MODES, RotaSolver, build_slots, month_days
+
+
+def build_employees(count: int, year: int, seed: int = 42):
+    """Population synthétique : catégorie, poids d'équité, absences sur l'année"""
+    rng = random.Random(seed)
+    categories = list(CCN66_ON_CALL_LIMITS)
+    days = [day for month in range(1, 13) for day in month_days(year, month)]
+
+    employees = []
+    for i in range(count):
+        unavailable = set()
+        for _ in range(rng.randint(0, 4)):
+            start = rng.choice(days)
+            unavailable.update(start + timedelta(days=offset) for offset in range(rng.randint(1, 15)))
+        category = rng.choice(categories)
+        employees.append({
+            "id": f"emp-{i:04d}",
+            "category": category,
+            "load": 0,
+            "remaining": CCN66_ON_CALL_LIMITS[category],
+            "weight": rng.choice([0.5, 1.0, 1.0, 1.0, 1.5, 2.0]),
+            "unavailable": unavailable
+        })
+    return employees
+
+
+def run_year(employees, year: int, mode: str, seed: int, iterations: int):
+    """Planifie les 12 mois ; retourne (affectations, statistiques par mois)"""
+    employees = [dict(employee) for employee in employees]
+    schedule, months = [], []
+
+    for month in range(1, 13):
+        slots = build_slots(year, month, mode)
+        started = time.perf_counter()
+        solver = RotaSolver(slots, employees, seed=seed + month, iterations=iterations)
+        solution = solver.solve()
+        elapsed = time.perf_counter() - started
+
+        for slot, e in zip(slots, solution["assignment"]):
+            if e is None:
+                continue
+            employees[e]["load"] += len(slot)
+            employees[e]["remaining"] -= len(slot)
+            schedule.extend((employees[e]["id"], day) for day in slot)
+
+        months.append({"month": month, "elapsed": elapsed, "slots": len(slots), **solution})
+
+    return schedule, months, employees
+
+
+def check_constraints(schedule, employees):
+    """Aucune affectation pendant une absence ni au-delà du quota annuel"""
+    by_id = {employee["id"]: employee for employee in employees}
+    days_per_employee = {}
+    for employee_id, day in schedule:
+        assert day not in by_id[employee_id]["unavailable"], f"{employee_id} absent le {day}"
+        days_per_employee[employee_id] = days_per_employee.get(employee_id, 0) + 1
+    for employee_id, days in days_per_employee.items():
+        limit = CCN66_ON_CALL_LIMITS[by_id[employee_id]["category"]]
+        assert days <= limit, f"{employee_id}: {days} jours > {limit}"
+    assert len({day for _, day in schedule}) == len(schedule), "Un jour affecté deux fois"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark du générateur de planning d'astreintes")
+    parser.add_argument("--employees", type=int, default=100, help="Nombre d'employés synthétiques")
+    parser.add_argument("--year", type=int, default=2025, help="Année planifiée")
+    parser.add_argument("--mode", choices=list(MODES), default="day", help="Découpage des créneaux")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS, help="Itérations de recherche locale")
+    parser.add_argument("--seed", type=int, default=7, help="Graine du solveur")
+    args = parser.parse_args()
+
+    employees = build_employees(args.employees, args.year)
+    print(f"📊 {len(employees)} employés synthétiques, mode '{args.mode}', {args.iterations} itérations/mois")
+
+    schedule, months, final = run_year(employees, args.year, args.mode, args.seed, args.iterations)
+
+    print("\n" + "=" * 72)
+    print(f"{'Mois':<6}{'Créneaux':>10}{'Non pourvus':>13}{'Coût glouton':>15}{'Coût final':>14}{'Temps (ms)':>14}")
+    print("=" * 72)
+    for month in months:
+        print(f"{month['month']:<6}{month['slots']:>10}{month['unassigned']:>13}"
+              f"{month['greedy_cost']:>15.1f}{month['cost']:>14.1f}{month['elapsed'] * 1000:>14.1f}")
+    total = sum(month["elapsed"] for month in months)
+    print(f"{'TOTAL':<6}{sum(m['slots'] for m in months):>10}{sum(m['unassigned'] for m in months):>13}"
+          f"{'':>29}{total * 1000:>14.1f}")
+
+    # Équité : charge annuelle rapportée au poids
+    normalized = [employee["load"] / employee["weight"] for employee in final]
+    print(f"\n⚖️ Charge / poids : min {min(normalized):.1f}, max {max(normalized):.1f}, "
+          f"écart-type {statistics.pstdev(normalized):.2f}")
+
+    check_constraints(schedule, employees)
+    print("✅ Contraintes respectées (absences, quotas CCN66, un employé par jour)")
+
+    replay, _, _ = run_year(employees, args.year, args.mode, args.seed, args.iterations)
+    assert replay == schedule, "Planning différent pour la même graine"
+    print("✅ Planning identique pour la même graine")
+
+
+if __name__ == "__main__":
+    main()
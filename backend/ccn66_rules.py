@@ -1,11 +1,23 @@
 """
 Règles CCN66 pour le calcul des droits à congés
 Convention Collective Nationale 66 - Établissements et services pour personnes inadaptées et handicapées
+
+Moteur compilé : les mots-clés de catégorie sont précompilés en une seule
+expression régulière, le temps de travail et les dates d'embauche sont
+analysés une fois par valeur brute (cache), et les droits sont mémoïsés sur
+(catégorie, métier, date d'embauche, temps de travail, année).
+
+`calculate_rights_table` calcule les droits d'une table complète d'employés
+(DataFrame ou colonnes) pour l'initialisation annuelle et les simulations.
 """
 
+import re
 from datetime import datetime, date
-from typing import Dict, Optional
-import math
+from functools import lru_cache
+from typing import Dict, Mapping, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
 
 # Catégories bénéficiant de 18 jours de CT
 CATEGORY_A_KEYWORDS = [
@@ -22,12 +34,31 @@ LEAVE_TYPE_CODES = {
     "RTT": "RTT"
 }
 
+# Droits de base (temps plein)
+CA_BASE = 30.0
+CT_BASE = {"A": 18.0, "B": 9.0}
+
+# Congés d'ancienneté : (années minimum, jours) par tranche de 5 ans, plafond 6 jours
+ANCIENNETE_TIERS = ((15, 6), (10, 4), (5, 2))
+
+# Temps partiel sans précision : 80 %
+DEFAULT_PARTIAL_FRACTION = 0.8
+
+_CATEGORY_A_PATTERN = re.compile("|".join(re.escape(k) for k in CATEGORY_A_KEYWORDS))
+_NUMERIC_CHARS = re.compile(r"[^0-9.]")
 
+
+# ============================================================================
+# ANALYSE DES VALEURS BRUTES (CACHE PAR VALEUR)
+# ============================================================================
+
+@lru_cache(maxsize=1024)
 def is_category_a(categorie_employe: Optional[str], metier: Optional[str]) -> bool:
     """
     Détermine si un employé appartient à la catégorie A (18j CT)
     
-    Catégorie A : Éducateurs (tous types), Ouvriers qualifiés, Chefs de service
+    Catégorie A : Éducateurs (tous types), Ouvriers qualifiés, Chefs de service,
+                  ou catégorie saisie directement "A"
     Catégorie B : Autres (Cadres, Administratifs, etc.)
     
     Args:
@@ -37,13 +68,103 @@ def is_category_a(categorie_employe: Optional[str], metier: Optional[str]) -> bo
     Returns:
         bool: True si catégorie A (18j CT), False si catégorie B (9j CT)
     """
+    # Catégorie saisie directement
+    if str(categorie_employe or "").strip().upper() == "A":
+        return True
+    
     # Combiner les deux champs pour la recherche
     search_text = f"{categorie_employe or ''} {metier or ''}".lower()
+    return _CATEGORY_A_PATTERN.search(search_text) is not None
+
+
+@lru_cache(maxsize=256)
+def parse_temps_travail(temps_travail: Optional[str]) -> Optional[float]:
+    """
+    Fraction de temps de travail d'une description brute
     
-    # Vérifier si contient un mot-clé de catégorie A
-    return any(keyword in search_text for keyword in CATEGORY_A_KEYWORDS)
+    Args:
+        temps_travail: Description (ex: "Temps Plein", "Temps Partiel", "80%", "4/5",
+            ou pourcentage nu "80" / 80)
+    
+    Returns:
+        float: Fraction (ex: 0.8) pour un temps partiel, None pour un temps plein
+    """
+    if not temps_travail:
+        return None
+    
+    temps_travail = str(temps_travail)
+    temps_travail_lower = temps_travail.lower()
+    
+    # Temps plein
+    if "plein" in temps_travail_lower:
+        return None
+    
+    # Temps partiel avec pourcentage
+    if "%" in temps_travail:
+        try:
+            return float(_NUMERIC_CHARS.sub("", temps_travail)) / 100
+        except ValueError:
+            pass
+    
+    # Pourcentage nu (ex: "80", 80, "87.5") ; une valeur ≤ 1 est déjà une fraction
+    try:
+        value = float(temps_travail.replace(",", ".").strip())
+        if value > 0:
+            return value / 100 if value > 1 else value
+    except ValueError:
+        pass
+    
+    # Temps partiel avec fraction (ex: "80/100", "4/5")
+    if "/" in temps_travail:
+        parts = temps_travail.split("/")
+        if len(parts) == 2:
+            try:
+                return float(parts[0].strip()) / float(parts[1].strip())
+            except (ValueError, ZeroDivisionError):
+                pass
+    
+    # Si "temps partiel" sans précision, on considère 80% par défaut
+    if "partiel" in temps_travail_lower:
+        return DEFAULT_PARTIAL_FRACTION
+    
+    # Par défaut, temps plein
+    return None
 
 
+@lru_cache(maxsize=4096)
+def parse_hire_date(date_embauche) -> Optional[date]:
+    """Date d'embauche (DD/MM/YYYY, YYYY-MM-DD, date ou datetime) ; None si illisible"""
+    if isinstance(date_embauche, datetime):
+        return date_embauche.date()
+    if isinstance(date_embauche, date):
+        return date_embauche
+    if not date_embauche or not isinstance(date_embauche, str):
+        return None
+    
+    try:
+        # Format DD/MM/YYYY
+        if '/' in date_embauche:
+            parts = date_embauche.split('/')
+            if len(parts) == 3:
+                return date(int(parts[2]), int(parts[1]), int(parts[0]))
+            return None
+        # Format YYYY-MM-DD
+        if '-' in date_embauche:
+            return datetime.fromisoformat(date_embauche).date()
+    except ValueError:
+        pass
+    return None
+
+
+def anciennete_reference_date(reference_year: int) -> date:
+    """Date à laquelle l'ancienneté est appréciée pour une année de droits (31/12)"""
+    return date(reference_year, 12, 31)
+
+
+# ============================================================================
+# RÈGLES UNITAIRES
+# ============================================================================
+
 def calculate_anciennete_days(date_embauche: Optional[str], reference_date: Optional[date] = None) -> int:
     """
     Calcule les jours de congés d'ancienneté selon CCN66
@@ -57,47 +178,20 @@ def calculate_anciennete_days(date_embauche: Optional[str], reference_date: Opti
     Returns:
         int: Nombre de jours de congés d'ancienneté (0, 2, 4 ou 6)
     """
-    if not date_embauche:
+    hire_date = parse_hire_date(date_embauche)
+    if hire_date is None:
         return 0
     
     if reference_date is None:
         reference_date = date.today()
     
-    try:
-        # Parser la date d'embauche
-        if isinstance(date_embauche, (date, datetime)):
-            hire_date = date_embauche if isinstance(date_embauche, date) else date_embauche.date()
-        elif isinstance(date_embauche, str):
-            # Essayer format DD/MM/YYYY
-            if '/' in date_embauche:
-                parts = date_embauche.split('/')
-                if len(parts) == 3:
-                    hire_date = date(int(parts[2]), int(parts[1]), int(parts[0]))
-            # Essayer format YYYY-MM-DD
-            elif '-' in date_embauche:
-                hire_date = datetime.fromisoformat(date_embauche).date()
-            else:
-                return 0
-        else:
-            return 0
-        
-        # Calculer l'ancienneté en années
-        delta = reference_date - hire_date
-        years = delta.days / 365.25
-        
-        # Calculer les jours selon tranches de 5 ans
-        if years < 5:
-            return 0
-        elif years < 10:
-            return 2
-        elif years < 15:
-            return 4
-        else:
-            return 6  # Plafonné à 6 jours
-            
-    except Exception as e:
-        print(f"Erreur calcul ancienneté: {e}")
-        return 0
+    # Calculer l'ancienneté en années
+    years = (reference_date - hire_date).days / 365.25
+    
+    for min_years, days in ANCIENNETE_TIERS:
+        if years >= min_years:
+            return days
+    return 0
 
 
 def calculate_prorata(base_days: float, temps_travail: Optional[str]) -> float:
@@ -111,42 +205,37 @@ def calculate_prorata(base_days: float, temps_travail: Optional[str]) -> float:
     Returns:
         float: Nombre de jours proratisé
     """
-    if not temps_travail:
-        return base_days
-    
-    temps_travail_lower = temps_travail.lower()
-    
-    # Temps plein
-    if "temps plein" in temps_travail_lower or "plein" in temps_travail_lower:
+    fraction = parse_temps_travail(temps_travail)
+    if fraction is None:
         return base_days
-    
-    # Temps partiel avec pourcentage
-    if "%" in temps_travail:
-        try:
-            # Extraire le pourcentage
-            percentage_str = ''.join(filter(lambda x: x.isdigit() or x == '.', temps_travail))
-            percentage = float(percentage_str)
-            return round(base_days * (percentage / 100), 1)
-        except:
-            pass
-    
-    # Temps partiel avec fraction (ex: "80/100", "4/5")
-    if "/" in temps_travail:
-        try:
-            parts = temps_travail.split("/")
-            if len(parts) == 2:
-                numerator = float(parts[0].strip())
-                denominator = float(parts[1].strip())
-                return round(base_days * (numerator / denominator), 1)
-        except:
-            pass
-    
-    # Si "temps partiel" sans précision, on considère 80% par défaut
-    if "temps partiel" in temps_travail_lower or "partiel" in temps_travail_lower:
-        return round(base_days * 0.8, 1)
-    
-    # Par défaut, temps plein
-    return base_days
+    return round(base_days * fraction, 1)
+
+
+@lru_cache(maxsize=8192)
+def _employee_rights(categorie_employe, metier, date_embauche, temps_travail, reference_year: int) -> tuple:
+    """Droits mémoïsés (tuple immuable, converti en dict par l'appelant)"""
+    category = "A" if is_category_a(categorie_employe, metier) else "B"
+    fraction = parse_temps_travail(temps_travail)
+    
+    ca_base = CA_BASE
+    ct_base = CT_BASE[category]
+    cex_base = float(calculate_anciennete_days(date_embauche, anciennete_reference_date(reference_year)))
+    
+    return (
+        # Proratisation pour temps partiel
+        ("CA", calculate_prorata(ca_base, temps_travail)),
+        ("CT", calculate_prorata(ct_base, temps_travail)),
+        # CCN66: Congés d'ancienneté NON proratisés (maintien intégral)
+        ("CEX", cex_base),
+        ("REC", 0.0),  # Récupération (géré séparément)
+        ("RTT", 0.0),  # RTT (si applicable)
+        ("category", category),
+        ("temps_travail_percent", 100.0 if fraction is None else round(fraction * 100, 2)),
+        ("is_temps_plein", fraction is None or fraction >= 1),
+        ("ca_base", ca_base),
+        ("ct_base", ct_base),
+        ("cex_base", cex_base)
+    )
 
 
 def calculate_employee_rights(
@@ -164,7 +253,8 @@ def calculate_employee_rights(
         metier: Métier de l'employé
         date_embauche: Date d'embauche
         temps_travail: Description du temps de travail
-        reference_year: Année de référence (défaut: année actuelle)
+        reference_year: Année de référence (défaut: année actuelle) ;
+            l'ancienneté est appréciée au 31/12 de cette année
     
     Returns:
         Dict avec les droits calculés:
@@ -180,52 +270,93 @@ def calculate_employee_rights(
     if reference_year is None:
         reference_year = datetime.now().year
     
-    # Déterminer la catégorie
-    is_cat_a = is_category_a(categorie_employe, metier)
-    category = "A" if is_cat_a else "B"
-    
-    # Droits de base (temps plein)
-    ca_base = 30.0  # Congés Payés
-    ct_base = 18.0 if is_cat_a else 9.0  # Congés Trimestriels
-    cex_base = float(calculate_anciennete_days(date_embauche))  # Congés d'ancienneté
-    
-    # Déterminer si temps plein
-    is_temps_plein = True
-    temps_travail_percent = 100.0
-    
-    if temps_travail:
-        temps_travail_lower = temps_travail.lower()
-        if "partiel" in temps_travail_lower:
-            is_temps_plein = False
-            # Essayer d'extraire le pourcentage
-            if "%" in temps_travail:
-                try:
-                    percentage_str = ''.join(filter(lambda x: x.isdigit() or x == '.', temps_travail))
-                    temps_travail_percent = float(percentage_str)
-                except:
-                    temps_travail_percent = 80.0  # Défaut
-            else:
-                temps_travail_percent = 80.0  # Défaut pour temps partiel
-    
-    # Proratisation pour temps partiel
-    ca_final = calculate_prorata(ca_base, temps_travail)
-    ct_final = calculate_prorata(ct_base, temps_travail)
-    # CCN66: Congés d'ancienneté NON proratisés (maintien intégral)
-    cex_final = cex_base
-    
-    return {
-        "CA": ca_final,
-        "CT": ct_final,
-        "CEX": cex_final,
-        "REC": 0.0,  # Récupération (géré séparément)
-        "RTT": 0.0,  # RTT (si applicable)
-        "category": category,
-        "temps_travail_percent": temps_travail_percent,
-        "is_temps_plein": is_temps_plein,
-        "ca_base": ca_base,
-        "ct_base": ct_base,
-        "cex_base": cex_base
-    }
+    return dict(_employee_rights(categorie_employe, metier, date_embauche, temps_travail, reference_year))
+
+
+# ============================================================================
+# CALCUL VECTORISÉ (TABLE D'EMPLOYÉS)
+# ============================================================================
+
+RIGHTS_COLUMNS = [
+    "CA", "CT", "CEX", "REC", "RTT", "category",
+    "temps_travail_percent", "is_temps_plein", "ca_base", "ct_base", "cex_base"
+]
+
+
+def calculate_rights_table(
+    employees: Union[pd.DataFrame, Mapping[str, Sequence]],
+    reference_year: Optional[int] = None,
+    hire_date_column: str = "date_embauche"
+) -> pd.DataFrame:
+    """
+    Calcule les droits CCN66 d'une table d'employés
+    
+    Chaque valeur distincte (couple catégorie/métier, temps de travail,
+    date d'embauche) est analysée une seule fois ; l'ancienneté est
+    calculée par opérations vectorisées. Résultats identiques à
+    `calculate_employee_rights` ligne par ligne.
+    
+    Args:
+        employees: DataFrame ou colonnes (categorie_employe, metier,
+            temps_travail, date d'embauche) ; colonne absente = valeur vide
+        reference_year: Année de référence (défaut: année actuelle)
+        hire_date_column: Nom de la colonne de date d'embauche
+    
+    Returns:
+        DataFrame (même index) avec les colonnes RIGHTS_COLUMNS
+    """
+    if reference_year is None:
+        reference_year = datetime.now().year
+    
+    df = employees if isinstance(employees, pd.DataFrame) else pd.DataFrame(employees)
+    
+    def column(name: str) -> pd.Series:
+        if name not in df:
+            return pd.Series([None] * len(df), index=df.index, dtype=object)
+        return df[name].astype(object).where(df[name].notna(), None)
+    
+    categorie, metier, temps = column("categorie_employe"), column("metier"), column("temps_travail")
+    hire = column(hire_date_column)
+    
+    # 🏷️ Catégorie A/B par couple (catégorie, métier) distinct
+    pairs = pd.Series(list(zip(categorie, metier)), index=df.index)
+    is_a = pairs.map({p: is_category_a(*p) for p in pairs.unique()}).astype(bool).to_numpy()
+    
+    # ⏱️ Fraction de temps de travail par valeur distincte (NaN = temps plein)
+    fractions = temps.map({t: parse_temps_travail(t) for t in temps.unique()}).astype(float).to_numpy()
+    full_time = np.isnan(fractions)
+    
+    def prorata(base: float) -> np.ndarray:
+        values = {t: calculate_prorata(base, t) for t in temps.unique()}
+        return temps.map(values).astype(float).to_numpy()
+    
+    ct = np.where(is_a, prorata(CT_BASE["A"]), prorata(CT_BASE["B"]))
+    
+    # 📅 Ancienneté vectorisée (jours écoulés / 365.25, tranches de 5 ans)
+    hire_dates = hire.map({h: parse_hire_date(h) for h in hire.unique()})
+    hire_days = pd.to_datetime(hire_dates, errors="coerce").to_numpy(dtype="datetime64[D]")
+    reference = np.datetime64(anciennete_reference_date(reference_year), "D")
+    years = (reference - hire_days).astype("float64") / 365.25
+    cex = np.select(
+        [years >= min_years for min_years, _ in ANCIENNETE_TIERS],
+        [float(days) for _, days in ANCIENNETE_TIERS],
+        default=0.0
+    )
+    cex[np.isnat(hire_days)] = 0.0
+    
+    return pd.DataFrame({
+        "CA": prorata(CA_BASE),
+        "CT": ct,
+        "CEX": cex,
+        "REC": 0.0,
+        "RTT": 0.0,
+        "category": np.where(is_a, "A", "B"),
+        "temps_travail_percent": np.where(full_time, 100.0, np.round(fractions * 100, 2)),
+        "is_temps_plein": full_time | (fractions >= 1),
+        "ca_base": CA_BASE,
+        "ct_base": np.where(is_a, CT_BASE["A"], CT_BASE["B"]),
+        "cex_base": cex
+    }, index=df.index, columns=RIGHTS_COLUMNS)
 
 
 def format_rights_display(rights: Dict[str, float]) -> str:
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 """
 Cleanup old leave balance data and initialize using new System 2
+Balances are initialized with the shared CCN66 engine (leave_balance_init)
 """
 
 import asyncio
@@ -9,6 +10,8 @@ import sys
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 
+from leave_balance_init import LeaveBalanceInitializer
+
 # Load environment variables
 load_dotenv()
 
@@ -79,14 +82,18 @@ async def cleanup_and_initialize():
         print("  ✅ Created user_id_1_created_at_-1 index on transactions")
         print()
         
+        # Step 5: Initialize balances (CCN66 rights, System 2 schema)
+        print("🚀 Step 5: Initializing leave balances...")
+        result = await LeaveBalanceInitializer(db, schema="user").initialize_all()
+        print(f"  ✅ Initialized {result['initialized']} balances for fiscal year {result['year']}")
+        if result["errors"]:
+            print(f"  ⚠️  {result['errors']} errors: {result['error_details']}")
+        print()
+        
         print("=" * 70)
-        print("✅ CLEANUP COMPLETE")
+        print("✅ CLEANUP & INITIALIZATION COMPLETE")
         print("=" * 70)
         print()
-        print("💡 Next steps:")
-        print("  1. Use the API endpoint: POST /api/leave-balances/initialize-all")
-        print("  2. Or test individual initialization via POST /api/leave-balances/initialize")
-        print()
         
     except Exception as e:
         print(f"❌ Fatal error: {e}")
@@ -0,0 +1,546 @@
+"""
+Soldes des heures de délégation CSE avec report sur 12 mois
+MOZAIK RH - Crédit mensuel, déclarations, cessions données / reçues
+
+La collection `cse_monthly_balances` contient un document par délégué
+(`delegate_id` = user_id) et par mois (`period` YYYY-MM), maintenu
+incrémentalement à chaque écriture :
+
+- déclaration d'heures (`delegation_hours`)        → heures_declarees
+- prise de connaissance d'une déclaration          → heures_prises_en_compte
+- cession (`cse_cessions`, ou `hours_cessions`
+  une fois prise en compte)                        → heures_utilisees / heures_recues
+
+Toutes les lectures CSE (solde avec report, statistiques, contrôle du solde
+restant à la déclaration) se font sur cette collection par l'index
+(delegate_id, period) ; `rebuild()` la recalcule depuis l'historique. Les
+mois sont décomptés en arithmétique calendaire exacte.
+
+Une écriture incrémentale en échec marque les soldes périmés dans MongoDB
+(materialized_state) : le recalcul a lieu avant la lecture suivante, dans
+n'importe quel processus.
+
+Déclarations et cessions portent une date typée (`date_at`, `usage_at`)
+en plus de la chaîne YYYY-MM-DD : filtres par mois en plage indexée et
+sommes par mois calculées par `$group` côté serveur.
+"""
+
+import asyncio
+import logging
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from db_indexes import replace_collection
+import materialized_state
+
+logger = logging.getLogger(__name__)
+
+# Règle réglementaire : report des heures non utilisées sur 12 mois maximum
+REPORT_MONTHS = 12
+
+# Mois détaillés dans la réponse (les plus récents avec un solde positif)
+DETAIL_MONTHS = 3
+
+# Compteurs mensuels d'un document `cse_monthly_balances`
+COUNTER_FIELDS = ("heures_declarees", "heures_prises_en_compte", "heures_utilisees", "heures_recues")
+
+# Bénéficiaire hors base d'une cession (pas de solde)
+EXTERNAL_ID = "external"
+
+# Nom de la vue dans `materialized_state`
+STATE_NAME = "cse_monthly_balances"
+
+
+def calculer_heures_delegation_reglementaires(effectif: int, statut: str) -> int:
+    """
+    Calcule les heures de délégation mensuelles selon la réglementation française
+    Source: https://www.service-public.gouv.fr/particuliers/vosdroits/F34474
+
+    Args:
+        effectif: Nombre de salariés dans l'entreprise
+        statut: 'Titulaire' ou 'Suppléant'
+
+    Returns:
+        Nombre d'heures mensuelles réglementaires
+
+    Note: Les suppléants n'ont PAS d'heures de délégation (sauf remplacement)
+    """
+    # Suppléants n'ont pas d'heures de délégation
+    if statut and statut.lower() in ['suppléant', 'suppleant']:
+        return 0
+
+    # Titulaires selon effectif (règles légales)
+    if effectif < 50:
+        return 0  # Pas de CSE obligatoire
+    elif 50 <= effectif < 75:
+        return 18
+    elif 75 <= effectif < 100:
+        return 19
+    elif 100 <= effectif < 200:
+        return 21
+    elif 200 <= effectif < 500:
+        return 22
+    elif 500 <= effectif < 1500:
+        return 24
+    elif 1500 <= effectif < 3500:
+        return 26
+    elif 3500 <= effectif < 4000:
+        return 27
+    elif 4000 <= effectif < 5000:
+        return 28
+    elif 5000 <= effectif < 6750:
+        return 29
+    elif 6750 <= effectif < 7500:
+        return 30
+    elif 7500 <= effectif < 7750:
+        return 31
+    elif 7750 <= effectif < 9750:
+        return 32
+    else:  # 9750+
+        return 34
+
+
+def shift_month(year: int, month: int, delta: int) -> Tuple[int, int]:
+    """(année, mois) décalé de `delta` mois calendaires"""
+    index = year * 12 + (month - 1) + delta
+    return index // 12, index % 12 + 1
+
+
+def month_start(year: int, month: int) -> datetime:
+    return datetime(year, month, 1)
+
+
+def month_range(year: int, month: int) -> Dict:
+    """Filtre de plage [1er du mois, 1er du mois suivant) sur une date typée"""
+    return {"$gte": month_start(year, month), "$lt": month_start(*shift_month(year, month, 1))}
+
+
+def period_of(year: int, month: int) -> str:
+    return f"{year:04d}-{month:02d}"
+
+
+def parse_period(value) -> Optional[Tuple[int, int]]:
+    """(année, mois) d'une date ou d'un mois (YYYY-MM, YYYY-MM-DD ; None si illisible)"""
+    if isinstance(value, datetime):
+        return value.year, value.month
+    try:
+        parsed = datetime.strptime(str(value)[:7], "%Y-%m")
+    except (TypeError, ValueError):
+        return None
+    return parsed.year, parsed.month
+
+
+def parse_usage_date(value) -> Optional[datetime]:
+    """Date d'utilisation typée (YYYY-MM-DD ou ISO complet ; None si illisible)"""
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.strptime(str(value)[:10], "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+
+
+def build_cession_months_pipeline() -> List[Dict]:
+    """Heures cédées par (cédant, bénéficiaire, année, mois) sur tout l'historique"""
+    return [
+        {"$match": {"usage_at": {"$type": "date"}}},
+        {"$group": {
+            "_id": {
+                "from_id": "$from_id",
+                "to_id": "$to_id",
+                "year": {"$year": "$usage_at"},
+                "month": {"$month": "$usage_at"}
+            },
+            "hours": {"$sum": "$hours"}
+        }}
+    ]
+
+
+def build_declaration_months_pipeline() -> List[Dict]:
+    """Heures déclarées par (délégué CSE, statut, année, mois) sur tout l'historique"""
+    return [
+        {"$match": {"date_at": {"$type": "date"}}},
+        {"$group": {
+            "_id": {
+                "delegate_id": "$delegate_id",
+                "statut": "$statut",
+                "year": {"$year": "$date_at"},
+                "month": {"$month": "$date_at"}
+            },
+            "hours": {"$sum": "$heures_utilisees"},
+            "count": {"$sum": 1}
+        }}
+    ]
+
+
+class CSEBalanceService:
+    """Maintenance et lecture des soldes mensuels d'heures de délégation"""
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = db.cse_monthly_balances
+        # Un seul recalcul à la fois dans ce processus
+        self._rebuild_lock = asyncio.Lock()
+
+    # ========================================================================
+    # ÉCRITURE INCRÉMENTALE
+    # ========================================================================
+
+    async def record_declaration(self, declaration: Dict, delegate: Dict, sign: int = 1) -> int:
+        """Ajoute une déclaration d'heures au mois de son délégué"""
+        key = self._key(delegate.get("user_id"), declaration.get("date"))
+        hours = sign * float(declaration.get("heures_utilisees") or 0)
+        fields = {"heures_declarees": hours}
+        if declaration.get("statut") == "acknowledged":
+            fields["heures_prises_en_compte"] = hours
+        return await self._write({key: fields}, {delegate.get("user_id"): delegate})
+
+    async def record_acknowledgement(self, declaration: Dict) -> int:
+        """Passe les heures d'une déclaration en « prises en compte »"""
+        user_ids = await self._user_ids([declaration.get("delegate_id")])
+        key = self._key(user_ids.get(declaration.get("delegate_id")), declaration.get("date"))
+        return await self._write({key: {"heures_prises_en_compte": float(declaration.get("heures_utilisees") or 0)}})
+
+    async def record_cession(self, cession: Dict) -> int:
+        """Ajoute une cession `cse_cessions` (données au cédant, reçues au bénéficiaire)"""
+        deltas: Dict[Tuple, Dict[str, float]] = {}
+        when = cession.get("usage_at") or cession.get("usage_date")
+        self._add_cession(deltas, cession.get("from_id"), cession.get("to_id"), when, cession.get("hours"))
+        return await self._write(deltas)
+
+    async def record_hours_cession(self, cession: Dict) -> int:
+        """Ajoute une cession `hours_cessions` prise en compte (identifiants de délégués CSE)"""
+        user_ids = await self._user_ids([cession.get("cedant_id"), cession.get("beneficiaire_id")])
+        deltas: Dict[Tuple, Dict[str, float]] = {}
+        self._add_cession(deltas, user_ids.get(cession.get("cedant_id")),
+                          user_ids.get(cession.get("beneficiaire_id")),
+                          cession.get("mois"), cession.get("heures_cedees"))
+        return await self._write(deltas)
+
+    @staticmethod
+    def _key(user_id: Optional[str], when) -> Optional[Tuple[str, int, int]]:
+        period = parse_period(when)
+        if not user_id or user_id == EXTERNAL_ID or period is None:
+            return None
+        return (user_id, *period)
+
+    @classmethod
+    def _add_cession(cls, deltas: Dict, from_id, to_id, when, hours):
+        hours = float(hours or 0)
+        for user_id, field in ((from_id, "heures_utilisees"), (to_id, "heures_recues")):
+            key = cls._key(user_id, when)
+            if key is not None:
+                totals = deltas.setdefault(key, {})
+                totals[field] = totals.get(field, 0.0) + hours
+
+    async def _write(self, deltas: Dict[Optional[Tuple], Dict[str, float]],
+                     delegates: Optional[Dict[str, Dict]] = None) -> int:
+        """
+        Écrit des deltas par (délégué, année, mois) en un seul bulk_write
+
+        En cas d'erreur, le mouvement (déjà enregistré) n'est pas perdu : les
+        soldes sont marqués périmés dans MongoDB et recalculés par `$group`
+        depuis l'historique avant la lecture suivante (`_ensure_fresh`), de
+        sorte que le contrôle du solde restant ne s'appuie jamais sur un
+        compteur incomplet. Une écriture concurrente d'un recalcul (écrasée
+        par le renommage) marque aussi les soldes périmés.
+        """
+        try:
+            written = await self._write_deltas(deltas, delegates)
+            await materialized_state.mark_stale_if_rebuilding(self.db, STATE_NAME)
+            return written
+        except Exception as e:
+            logger.error(f"❌ Erreur mise à jour soldes CSE, recalcul à la prochaine lecture: {str(e)}")
+            await materialized_state.mark_stale(self.db, STATE_NAME)
+            return 0
+
+    async def _ensure_fresh(self):
+        """Recalcule les soldes marqués périmés (l'erreur remonte si le recalcul échoue)"""
+        if not await materialized_state.stale_token(self.db, STATE_NAME):
+            return
+        async with self._rebuild_lock:
+            if await materialized_state.stale_token(self.db, STATE_NAME):
+                await self.rebuild()
+
+    async def _write_deltas(self, deltas: Dict[Optional[Tuple], Dict[str, float]],
+                            delegates: Optional[Dict[str, Dict]] = None) -> int:
+        deltas = {key: fields for key, fields in deltas.items() if key is not None and any(fields.values())}
+        if not deltas:
+            return 0
+
+        delegates = dict(delegates or {})
+        missing = {key[0] for key in deltas} - set(delegates)
+        if missing:
+            delegates.update(await self._load_delegates(missing))
+
+        now = datetime.utcnow()
+        operations = []
+        for (user_id, year, month), fields in deltas.items():
+            delegate = delegates.get(user_id, {})
+            update = {
+                "$inc": {field: round(value, 4) for field, value in fields.items()},
+                "$set": {"updated_at": now},
+                "$setOnInsert": {"id": str(uuid.uuid4()), "year": year, "month": month, "created_at": now}
+            }
+            if delegate:
+                update["$set"]["delegate_name"] = delegate.get("user_name")
+                update["$set"]["credit_mensuel"] = delegate.get("heures_mensuelles", 0)
+            operations.append(UpdateOne(
+                {"delegate_id": user_id, "period": period_of(year, month)}, update, upsert=True
+            ))
+
+        await self.collection.bulk_write(operations, ordered=False)
+        return len(operations)
+
+    async def _documents(self, deltas: Dict[Optional[Tuple], Dict[str, float]]) -> List[Dict]:
+        """Documents complets d'une reconstruction (mêmes champs que les upserts incrémentaux)"""
+        deltas = {key: fields for key, fields in deltas.items() if key is not None and any(fields.values())}
+        delegates = await self._load_delegates({key[0] for key in deltas})
+        now = datetime.utcnow()
+        documents = []
+        for (user_id, year, month), fields in deltas.items():
+            document = {
+                "id": str(uuid.uuid4()), "delegate_id": user_id, "period": period_of(year, month),
+                "year": year, "month": month, "created_at": now, "updated_at": now,
+                **{field: round(value, 4) for field, value in fields.items()}
+            }
+            delegate = delegates.get(user_id)
+            if delegate:
+                document["delegate_name"] = delegate.get("user_name")
+                document["credit_mensuel"] = delegate.get("heures_mensuelles", 0)
+            documents.append(document)
+        return documents
+
+    async def _load_delegates(self, user_ids: Iterable[str]) -> Dict[str, Dict]:
+        """Nom et crédit des délégués concernés (une seule requête)"""
+        ids = [i for i in user_ids if i]
+        delegates = await self.db.cse_delegates.find(
+            {"user_id": {"$in": ids}}, {"_id": 0, "user_id": 1, "user_name": 1, "heures_mensuelles": 1}
+        ).to_list(None)
+        return {d["user_id"]: d for d in delegates}
+
+    async def _user_ids(self, delegate_ids: Iterable[str]) -> Dict[str, str]:
+        """Identifiants de délégués CSE (`cse_delegates.id`) → user_id"""
+        ids = [i for i in delegate_ids if i]
+        delegates = await self.db.cse_delegates.find(
+            {"id": {"$in": ids}}, {"_id": 0, "id": 1, "user_id": 1}
+        ).to_list(None)
+        return {d["id"]: d["user_id"] for d in delegates}
+
+    # ========================================================================
+    # RECONSTRUCTION
+    # ========================================================================
+
+    async def rebuild(self) -> Dict:
+        """
+        Recalcule entièrement `cse_monthly_balances` depuis les déclarations et cessions
+
+        Les soldes sont écrits dans une collection temporaire renommée à la
+        place de la collection servie : les lectures concurrentes ne voient
+        jamais de soldes vides. Les soldes redeviennent à jour si aucune
+        écriture n'a échoué ou n'a eu lieu pendant le recalcul.
+
+        Returns:
+            {"declarations": int, "cessions": int, "balances": int}
+        """
+        lease = await materialized_state.begin_rebuild(self.db, STATE_NAME)
+        try:
+            result = await self._rebuild()
+        except Exception:
+            await materialized_state.end_rebuild(self.db, STATE_NAME, lease, succeeded=False)
+            raise
+        await materialized_state.end_rebuild(self.db, STATE_NAME, lease)
+        return result
+
+    async def _rebuild(self) -> Dict:
+        deltas: Dict[Tuple, Dict[str, float]] = {}
+        counts = {"declarations": 0, "cessions": 0}
+
+        async for row in self.db.cse_cessions.aggregate(build_cession_months_pipeline()):
+            key = row["_id"]
+            self._add_cession(deltas, key.get("from_id"), key.get("to_id"),
+                              period_of(key["year"], key["month"]), row["hours"])
+
+        declarations = await self.db.delegation_hours.aggregate(build_declaration_months_pipeline()).to_list(None)
+        hours_cessions = await self.db.hours_cessions.aggregate([
+            {"$match": {"statut": "acknowledged"}},
+            {"$group": {"_id": {"cedant_id": "$cedant_id", "beneficiaire_id": "$beneficiaire_id", "mois": "$mois"},
+                        "hours": {"$sum": "$heures_cedees"}, "count": {"$sum": 1}}}
+        ]).to_list(None)
+
+        user_ids = await self._user_ids(
+            {row["_id"].get("delegate_id") for row in declarations}
+            | {row["_id"].get(side) for row in hours_cessions for side in ("cedant_id", "beneficiaire_id")}
+        )
+
+        for row in declarations:
+            key = self._key(user_ids.get(row["_id"].get("delegate_id")),
+                            period_of(row["_id"]["year"], row["_id"]["month"]))
+            if key is None:
+                continue
+            totals = deltas.setdefault(key, {})
+            totals["heures_declarees"] = totals.get("heures_declarees", 0.0) + (row["hours"] or 0.0)
+            if row["_id"].get("statut") == "acknowledged":
+                totals["heures_prises_en_compte"] = totals.get("heures_prises_en_compte", 0.0) + (row["hours"] or 0.0)
+            counts["declarations"] += row["count"]
+
+        for row in hours_cessions:
+            key = row["_id"]
+            self._add_cession(deltas, user_ids.get(key.get("cedant_id")), user_ids.get(key.get("beneficiaire_id")),
+                              key.get("mois"), row["hours"])
+        counts["cessions"] = (await self.db.cse_cessions.count_documents({"usage_at": {"$type": "date"}})
+                              + sum(row["count"] for row in hours_cessions))
+
+        balances = await replace_collection(self.db, self.collection.name, await self._documents(deltas))
+        logger.info(f"🔁 Soldes CSE reconstruits: {counts['declarations']} déclarations, "
+                    f"{counts['cessions']} cessions → {balances} soldes mensuels")
+        return {**counts, "balances": balances}
+
+    async def has_balances(self) -> bool:
+        """True si les soldes mensuels ont été alimentés"""
+        return await self.collection.find_one({}, {"_id": 1}) is not None
+
+    async def has_history(self) -> bool:
+        """True s'il existe des déclarations ou cessions à matérialiser"""
+        for source in (self.db.delegation_hours, self.db.cse_cessions, self.db.hours_cessions):
+            if await source.find_one({}, {"_id": 1}):
+                return True
+        return False
+
+    async def apply_regulatory_credits(self, effectif: int) -> Dict:
+        """
+        Applique les heures réglementaires de l'effectif à tous les délégués
+
+        Returns:
+            {"delegates": int, "updated": [{"user_name", "statut", "before", "after"}]}
+        """
+        delegates = await self.db.cse_delegates.find(
+            {}, {"_id": 0, "id": 1, "user_name": 1, "statut": 1, "heures_mensuelles": 1}
+        ).to_list(None)
+
+        operations, updated = [], []
+        for delegate in delegates:
+            statut = delegate.get("statut") or "Titulaire"
+            heures = calculer_heures_delegation_reglementaires(effectif, statut)
+            if delegate.get("heures_mensuelles") != heures:
+                operations.append(UpdateOne({"id": delegate["id"]}, {"$set": {"heures_mensuelles": heures}}))
+                updated.append({"user_name": delegate.get("user_name"), "statut": statut,
+                                "before": delegate.get("heures_mensuelles", 0), "after": heures})
+
+        if operations:
+            await self.db.cse_delegates.bulk_write(operations, ordered=False)
+        return {"delegates": len(delegates), "updated": updated}
+
+    async def backfill_usage_dates(self) -> int:
+        """
+        Renseigne les dates typées manquantes (idempotent) :
+        `usage_at` des cessions, `date_at` des déclarations d'heures
+        """
+        typed = 0
+        for collection, source, target, label in (
+            (self.db.cse_cessions, "usage_date", "usage_at", "Cessions CSE"),
+            (self.db.delegation_hours, "date", "date_at", "Déclarations d'heures CSE")
+        ):
+            operations = []
+            async for document in collection.find({target: {"$exists": False}}, {"_id": 1, source: 1}):
+                value = parse_usage_date(document.get(source))
+                if value is not None:
+                    operations.append(UpdateOne({"_id": document["_id"]}, {"$set": {target: value}}))
+
+            if operations:
+                await collection.bulk_write(operations, ordered=False)
+                logger.info(f"🗓️ {label} : {len(operations)} dates typées")
+            typed += len(operations)
+        return typed
+
+    # ========================================================================
+    # LECTURE
+    # ========================================================================
+
+    async def month(self, user_id: str, year: int, month: int) -> Dict:
+        """Compteurs d'un délégué pour un mois (zéros si aucun mouvement)"""
+        await self._ensure_fresh()
+        document = await self.collection.find_one(
+            {"delegate_id": user_id, "period": period_of(year, month)}, {"_id": 0}
+        )
+        return {field: (document or {}).get(field, 0.0) for field in COUNTER_FIELDS}
+
+    async def remaining_hours(self, delegate: Dict, year: int, month: int) -> float:
+        """Crédit du mois moins les heures déjà déclarées (contrôle avant déclaration / cession)"""
+        counters = await self.month(delegate["user_id"], year, month)
+        return delegate.get("heures_mensuelles", 0) - counters["heures_declarees"]
+
+    async def month_totals(self, year: int, month: int) -> Dict:
+        """Compteurs cumulés de tous les délégués pour un mois (une agrégation)"""
+        await self._ensure_fresh()
+        rows = await self.collection.aggregate([
+            {"$match": {"period": period_of(year, month)}},
+            {"$group": {"_id": None, **{field: {"$sum": f"${field}"} for field in COUNTER_FIELDS}}}
+        ]).to_list(1)
+        return {field: (rows[0] if rows else {}).get(field, 0.0) for field in COUNTER_FIELDS}
+
+    async def balances(self, delegates: List[Dict], year: int, month: int) -> List[Dict]:
+        """
+        Soldes de plusieurs délégués pour un mois, en une lecture indexée
+
+        Args:
+            delegates: Documents `cse_delegates` (user_id, user_name, heures_mensuelles)
+            year, month: Mois du solde
+
+        Returns:
+            Un solde par délégué (même format que /cse/balance/{delegate_id})
+        """
+        if not delegates:
+            return []
+        await self._ensure_fresh()
+
+        # (délégué, année, mois) → [heures données, heures reçues]
+        movements: Dict[Tuple[str, int, int], Tuple[float, float]] = {}
+        cursor = self.collection.find({
+            "delegate_id": {"$in": [d["user_id"] for d in delegates]},
+            "period": {"$gte": period_of(*shift_month(year, month, -REPORT_MONTHS)), "$lte": period_of(year, month)}
+        }, {"_id": 0, "delegate_id": 1, "year": 1, "month": 1, "heures_utilisees": 1, "heures_recues": 1})
+        async for document in cursor:
+            movements[(document["delegate_id"], document["year"], document["month"])] = (
+                document.get("heures_utilisees", 0.0), document.get("heures_recues", 0.0)
+            )
+
+        return [self._balance(delegate, year, month, movements) for delegate in delegates]
+
+    async def balance(self, delegate: Dict, year: int, month: int) -> Dict:
+        return (await self.balances([delegate], year, month))[0]
+
+    @staticmethod
+    def _balance(delegate: Dict, year: int, month: int, movements: Dict) -> Dict:
+        delegate_id = delegate["user_id"]
+        credit_mensuel = delegate.get("heures_mensuelles", 0)
+
+        # Report des 12 mois précédents (du plus récent au plus ancien)
+        report_total = 0.0
+        mois_avec_report = []
+        for offset in range(1, REPORT_MONTHS + 1):
+            y, m = shift_month(year, month, -offset)
+            donnees, recues = movements.get((delegate_id, y, m), (0.0, 0.0))
+            solde_mois = credit_mensuel - donnees + recues
+            if solde_mois > 0:
+                report_total += solde_mois
+                mois_avec_report.append({"year": y, "month": m, "solde": solde_mois})
+
+        donnees_current, recues_current = movements.get((delegate_id, year, month), (0.0, 0.0))
+
+        return {
+            "delegate_id": delegate_id,
+            "delegate_name": delegate.get("user_name"),
+            "year": year,
+            "month": month,
+            "credit_mensuel": credit_mensuel,
+            "report_12_mois": report_total,
+            "heures_donnees_mois": donnees_current,
+            "heures_recues_mois": recues_current,
+            # Solde total = crédit mois + report + reçues - données
+            "solde_disponible": credit_mensuel + report_total + recues_current - donnees_current,
+            "detail_report": mois_avec_report[:DETAIL_MONTHS]
+        }
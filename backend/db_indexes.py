@@ -0,0 +1,178 @@
+"""
+Index MongoDB de l'application
+MOZAIK RH - Création idempotente des index au démarrage
+
+Chaque collection déclare ici les index dont dépendent ses requêtes
+(upserts par clé métier, filtres par période, etc.).
+"""
+
+import logging
+import uuid
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================================================
+# DÉCLARATION DES INDEX
+# ============================================================================
+
+# (collection, clés, options)
+INDEXES = [
+    # Heures importées : une seule ligne par employé et par jour (upsert idempotent)
+    ("work_hours", [("employee_id", ASCENDING), ("date", ASCENDING)],
+     {"unique": True, "name": "employee_id_1_date_1"}),
+    # Liste paginée filtrée par période
+    ("work_hours", [("date", DESCENDING)], {"name": "date_-1"}),
+    # Heures supplémentaires : un mouvement par id ; validation par (employé, date,
+    # type, validé) et historique paginé d'un employé trié par date
+    ("overtime", [("id", ASCENDING)],
+     {"unique": True, "name": "id_1", "partialFilterExpression": {"id": {"$exists": True}}}),
+    ("overtime", [("employee_id", ASCENDING), ("date", DESCENDING), ("type", ASCENDING), ("validated", ASCENDING)],
+     {"name": "employee_id_1_date_-1_type_1_validated_1"}),
+    # Rollups heures supplémentaires : un document par employé et par mois + cumul
+    # (upserts $inc), synthèse d'un mois pour tous les employés
+    ("overtime_rollups", [("employee_id", ASCENDING), ("period", ASCENDING)],
+     {"unique": True, "name": "employee_id_1_period_1"}),
+    ("overtime_rollups", [("period", ASCENDING)], {"name": "period_1"}),
+    # Astreintes : une seule par employé et par jour (création en lot non ordonnée,
+    # doublons rejetés par l'index, doublons antérieurs supprimés avant sa
+    # création), planning d'un employé par mois ; planning de tous les employés
+    # par plage de dates
+    ("on_call_schedules", [("employee_id", ASCENDING), ("date", ASCENDING)],
+     {"unique": True, "name": "employee_id_1_date_1"}),
+    ("on_call_schedules", [("date", ASCENDING)], {"name": "date_1"}),
+    # $lookup absences → users (KPI par département)
+    ("users", [("id", ASCENDING)], {"name": "id_1"}),
+    # Rollups analytics : un document par combinaison de clés (upserts $inc)
+    ("absence_rollups", [("granularity", ASCENDING), ("period", ASCENDING), ("tenant", ASCENDING),
+                         ("department", ASCENDING), ("site", ASCENDING), ("motif", ASCENDING),
+                         ("categorie_employe", ASCENDING), ("employee_id", ASCENDING),
+                         ("status", ASCENDING)],
+     {"unique": True, "name": "rollup_key"}),
+    # Grand livre des congés : relecture des mouvements postérieurs à un snapshot
+    ("leave_transactions", [("employee_id", ASCENDING), ("year", ASCENDING), ("seq", ASCENDING)],
+     {"name": "employee_id_1_year_1_seq_1"}),
+    # Dernier snapshot d'un compteur
+    ("leave_balance_snapshots", [("employee_id", ASCENDING), ("year", ASCENDING), ("seq", DESCENDING)],
+     {"unique": True, "name": "employee_id_1_year_1_seq_-1"}),
+    # Soldes schéma employee_id / year : un seul compteur par employé et par an
+    # (les upserts concurrents ne créent pas de doublon)
+    ("leave_balances", [("employee_id", ASCENDING), ("year", ASCENDING)],
+     {"unique": True, "name": "employee_id_1_year_1",
+      "partialFilterExpression": {"employee_id": {"$exists": True}}}),
+    # Soldes projetés : $lookup users → soldes (schéma user_id / fiscal_year),
+    # demandes (par nom d'employé) et absences en attente
+    ("leave_balances", [("user_id", ASCENDING), ("fiscal_year", ASCENDING)],
+     {"name": "user_id_1_fiscal_year_1"}),
+    ("absence_requests", [("employee", ASCENDING), ("status", ASCENDING)], {"name": "employee_1_status_1"}),
+    ("absences", [("employee_id", ASCENDING), ("status", ASCENDING)], {"name": "employee_id_1_status_1"}),
+    # Soldes CSE : cessions données / reçues par date d'utilisation typée
+    ("cse_cessions", [("from_id", ASCENDING), ("usage_at", ASCENDING)], {"name": "from_id_1_usage_at_1"}),
+    ("cse_cessions", [("to_id", ASCENDING), ("usage_at", ASCENDING)], {"name": "to_id_1_usage_at_1"}),
+    # Déclarations d'heures de délégation : liste par délégué et par mois (date typée),
+    # liste de tous les délégués par mois
+    ("delegation_hours", [("delegate_id", ASCENDING), ("date_at", DESCENDING)],
+     {"name": "delegate_id_1_date_at_-1"}),
+    ("delegation_hours", [("date_at", DESCENDING)], {"name": "date_at_-1"}),
+    # Soldes CSE matérialisés : un document par délégué et par mois (upserts $inc),
+    # lecture du mois courant et des 12 mois de report ; totaux mensuels (statistiques)
+    ("cse_monthly_balances", [("delegate_id", ASCENDING), ("period", ASCENDING)],
+     {"unique": True, "name": "delegate_id_1_period_1"}),
+    ("cse_monthly_balances", [("period", ASCENDING)], {"name": "period_1"}),
+]
+
+# Index uniques dont les doublons existants sont supprimés avant création
+# (la plus ancienne ligne est conservée) : sans l'index, les écritures de ces
+# collections ne sont plus protégées contre les doublons
+DEDUPLICATED_INDEXES = {
+    ("on_call_schedules", "employee_id_1_date_1"),
+}
+
+
+async def remove_duplicates(db, collection_name: str, keys) -> int:
+    """
+    Supprime les doublons d'une clé d'index unique (le premier document inséré est conservé)
+
+    Returns:
+        Nombre de documents supprimés
+    """
+    pipeline = [
+        {"$sort": {"_id": 1}},
+        {"$group": {"_id": {field: f"${field}" for field, _ in keys},
+                    "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+    duplicate_ids = []
+    async for group in db[collection_name].aggregate(pipeline, allowDiskUse=True):
+        duplicate_ids.extend(group["ids"][1:])
+    if not duplicate_ids:
+        return 0
+    result = await db[collection_name].delete_many({"_id": {"$in": duplicate_ids}})
+    logger.warning(f"🧹 {result.deleted_count} doublon(s) supprimé(s) dans {collection_name} "
+                   f"avant création de l'index unique")
+    return result.deleted_count
+
+
+async def replace_collection(db, collection_name: str, documents) -> int:
+    """
+    Remplace le contenu d'une collection matérialisée sans fenêtre vide
+
+    Les documents sont écrits dans une collection temporaire, indexée comme
+    la collection servie (INDEXES), puis renommée à sa place (remplacement
+    atomique pour les lecteurs).
+
+    Returns:
+        Nombre de documents écrits
+    """
+    if not documents:
+        await db[collection_name].delete_many({})
+        return 0
+    staging = db[f"{collection_name}_rebuild_{uuid.uuid4().hex[:8]}"]
+    try:
+        for name, keys, options in INDEXES:
+            if name == collection_name:
+                await staging.create_index(keys, **options)
+        await staging.insert_many(documents, ordered=False)
+        await staging.rename(collection_name, dropTarget=True)
+    except Exception:
+        await staging.drop()
+        raise
+    return len(documents)
+
+
+async def ensure_indexes(db) -> dict:
+    """
+    Crée les index déclarés dans INDEXES (opération idempotente)
+
+    Les index de DEDUPLICATED_INDEXES absents de la base sont précédés de
+    la suppression des doublons existants. Un autre index qui ne peut pas
+    être créé (doublons existants, conflit de nom) est journalisé sans
+    bloquer le démarrage du serveur.
+
+    Args:
+        db: Base MongoDB (motor)
+
+    Returns:
+        {"created": [...], "failed": [{"index": str, "error": str}]}
+    """
+    created = []
+    failed = []
+
+    for collection_name, keys, options in INDEXES:
+        try:
+            if (collection_name, options.get("name")) in DEDUPLICATED_INDEXES:
+                existing = await db[collection_name].index_information()
+                if options["name"] not in existing:
+                    await remove_duplicates(db, collection_name, keys)
+            name = await db[collection_name].create_index(keys, **options)
+            created.append(f"{collection_name}.{name}")
+        except OperationFailure as e:
+            index_name = options.get("name", str(keys))
+            failed.append({"index": f"{collection_name}.{index_name}", "error": str(e)})
+            logger.warning(f"⚠️ Index {collection_name}.{index_name} non créé: {e}")
+
+    logger.info(f"🗂️ Index MongoDB vérifiés: {len(created)} OK, {len(failed)} en échec")
+    return {"created": created, "failed": failed}
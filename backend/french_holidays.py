@@ -0,0 +1,92 @@
+"""
+Jours fériés français et décompte des jours ouvrés
+MOZAIK RH - Calendrier légal (métropole)
+
+Les 11 jours fériés légaux : 8 à date fixe et 3 mobiles calculés depuis
+Pâques (lundi de Pâques, Ascension, lundi de Pentecôte). Le décompte des
+jours ouvrés (lundi à vendredi, hors fériés) d'une période se fait en
+forme close : nombre de jours de semaine par arithmétique sur les ordinaux,
+puis retrait des fériés tombant en semaine dans la période (recherche
+dichotomique), sans parcourir les jours un par un.
+"""
+
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Tuple
+
+# Jours fériés à date fixe (mois, jour)
+FIXED_HOLIDAYS = (
+    (1, 1),    # Jour de l'an
+    (5, 1),    # Fête du travail
+    (5, 8),    # Victoire 1945
+    (7, 14),   # Fête nationale
+    (8, 15),   # Assomption
+    (11, 1),   # Toussaint
+    (11, 11),  # Armistice
+    (12, 25),  # Noël
+)
+
+# Jours fériés mobiles (décalage depuis le dimanche de Pâques)
+EASTER_OFFSETS = (
+    1,   # Lundi de Pâques
+    39,  # Ascension
+    50,  # Lundi de Pentecôte
+)
+
+
+def easter_sunday(year: int) -> date:
+    """Dimanche de Pâques (calendrier grégorien, algorithme de Meeus/Jones/Butcher)"""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+@lru_cache(maxsize=64)
+def french_holidays(year: int) -> Tuple[date, ...]:
+    """Jours fériés d'une année, triés"""
+    easter = easter_sunday(year)
+    holidays = {date(year, month, day) for month, day in FIXED_HOLIDAYS}
+    holidays.update(easter + timedelta(days=offset) for offset in EASTER_OFFSETS)
+    return tuple(sorted(holidays))
+
+
+@lru_cache(maxsize=64)
+def _weekday_holidays(year: int) -> Tuple[date, ...]:
+    return tuple(d for d in french_holidays(year) if d.weekday() < 5)
+
+
+def is_holiday(day: date) -> bool:
+    return day in french_holidays(day.year)
+
+
+def _weekdays_through(day: date) -> int:
+    """Jours de semaine du 01/01/0001 (un lundi) au jour donné inclus"""
+    weeks, rest = divmod(day.toordinal(), 7)
+    return weeks * 5 + min(rest, 5)
+
+
+def weekdays_between(start: date, end: date) -> int:
+    """Jours du lundi au vendredi entre deux dates incluses"""
+    if end < start:
+        return 0
+    return _weekdays_through(end) - _weekdays_through(start - timedelta(days=1))
+
+
+def working_days_between(start: date, end: date) -> int:
+    """Jours ouvrés (lundi à vendredi, hors fériés) entre deux dates incluses"""
+    if end < start:
+        return 0
+    count = weekdays_between(start, end)
+    for year in range(start.year, end.year + 1):
+        holidays = _weekday_holidays(year)
+        count -= bisect_right(holidays, end) - bisect_left(holidays, start)
+    return count
@@ -0,0 +1,254 @@
+"""
+Initialisation en masse des soldes de congés - Moteur CCN66
+MOZAIK RH - Début d'année / première installation
+
+Les employés sont lus en flux (projection limitée aux champs utiles) par
+lots ; pour chaque lot, les soldes existants sont préchargés en une seule
+requête `$in`, les droits CCN66 sont calculés en bloc (ccn66_rules) puis
+écrits en un seul `bulk_write` non ordonné d'upserts.
+
+Deux schémas de soldes coexistent dans `leave_balances` :
+
+- "employee" : employee_id / year (server.py, DataSyncService)
+- "user"     : user_id / fiscal_year (api_leave_balance, LeaveBalanceService)
+
+Le consommé (pris, en attente, réintégré) d'un solde existant est conservé
+lors d'un recalcul (`force_recalculate`) : seuls les droits et soldes sont
+recalculés. Pour le schéma "employee", les droits sont écrits comme
+mouvements du grand livre (leave_ledger), projetés dans `leave_balances`.
+"""
+
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import pandas as pd
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from ccn66_rules import calculate_rights_table
+from leave_ledger import LeaveLedger
+import leave_projection
+
+logger = logging.getLogger(__name__)
+
+# Champs employé lus pour le calcul des droits
+USER_PROJECTION = {
+    "_id": 0, "id": 1, "name": 1, "prenom": 1, "nom": 1, "email": 1,
+    "categorie_employe": 1, "metier": 1, "temps_travail": 1,
+    "date_debut_contrat": 1, "hire_date": 1, "date_embauche": 1
+}
+
+# Schéma → (champ employé, champ année, RTT initial par défaut)
+SCHEMAS = {
+    "employee": ("employee_id", "year", 0.0),   # RTT : 0 par défaut en CCN66
+    "user": ("user_id", "fiscal_year", 12.0)    # RTT : 12 jours (LeaveBalanceService)
+}
+
+
+def employees_rights(users: List[Dict], year: int) -> List[Dict]:
+    """Droits CCN66 d'un lot d'employés pour l'année de référence (calcul vectorisé)"""
+    table = pd.DataFrame({
+        "categorie_employe": [u.get("categorie_employe") for u in users],
+        "metier": [u.get("metier") for u in users],
+        "temps_travail": [u.get("temps_travail") for u in users],
+        "date_embauche": [
+            u.get("date_debut_contrat") or u.get("hire_date") or u.get("date_embauche") for u in users
+        ]
+    })
+    return calculate_rights_table(table, year).to_dict("records")
+
+
+def employee_display_name(user: Dict) -> str:
+    return user.get("name") or f"{user.get('prenom', '')} {user.get('nom', '')}".strip()
+
+
+class LeaveBalanceInitializer:
+    """Calcul et écriture en masse des soldes CCN66 de tous les employés"""
+
+    def __init__(self, db, schema: str = "employee", batch_size: int = 1000):
+        if schema not in SCHEMAS:
+            raise ValueError(f"Schéma de solde inconnu: {schema}")
+        self.db = db
+        self.schema = schema
+        self.employee_field, self.year_field, self.rtt_initial = SCHEMAS[schema]
+        self.batch_size = batch_size
+        self.ledger = LeaveLedger(db)
+
+    # ========================================================================
+    # CONSTRUCTION DES DOCUMENTS
+    # ========================================================================
+
+    def _employee_entry(self, user: Dict, rights: Dict, existing: Optional[Dict], year: int) -> Dict:
+        """
+        Solde schéma "employee" : mouvement "rights" du grand livre
+
+        Les droits initiaux (et les soldes) varient de l'écart entre droits
+        recalculés et droits actuels ; le consommé existant n'est pas touché.
+        """
+        prev = existing or {}
+        deltas = {}
+        for code, right in (("ca", rights["CA"]), ("ct", rights["CT"]),
+                            ("cex", rights["CEX"]), ("rtt", self.rtt_initial)):
+            change = right - (prev.get(f"{code}_initial") or 0.0)
+            deltas[f"{code}_initial"] = change
+            deltas[f"{code}_balance"] = change
+
+        return {
+            "employee_id": user["id"],
+            "year": year,
+            "operation": "rights",
+            "deltas": deltas,
+            "fields": {
+                "employee_name": employee_display_name(user),
+                "reason": f"Droits CCN66 {year} (catégorie {rights['category']})"
+            },
+            "projection_set": {
+                "employee_name": employee_display_name(user),
+                # Métadonnées CCN66
+                "ccn66_category": rights["category"],
+                "temps_travail_percent": rights["temps_travail_percent"],
+                "is_temps_plein": rights["is_temps_plein"]
+            }
+        }
+
+    def _user_update(self, user: Dict, rights: Dict, existing: Optional[Dict], year: int, now: str) -> Dict:
+        """Solde schéma "user" : droits + soldes, compteurs créés à zéro"""
+        prev = existing or {}
+        initials = {
+            "ca": rights["CA"], "rtt": self.rtt_initial, "rec": 0.0,
+            "ct": rights["CT"], "cp": 0.0, "cex": rights["CEX"]
+        }
+        fields = {
+            "employee_name": employee_display_name(user),
+            "employee_email": user.get("email", ""),
+            "ccn66_category": rights["category"],
+            "last_updated": now
+        }
+        on_insert = {"id": f"lb_{user['id']}_{year}", "created_at": now}
+        for code, initial in initials.items():
+            fields[f"{code}_initial"] = initial
+            fields[f"{code}_balance"] = (
+                initial - prev.get(f"{code}_taken", 0.0) + prev.get(f"{code}_reintegrated", 0.0)
+            )
+            if existing is None:
+                on_insert[f"{code}_taken"] = 0.0
+                on_insert[f"{code}_reintegrated"] = 0.0
+        return {"$set": fields, "$setOnInsert": on_insert}
+
+    # ========================================================================
+    # INITIALISATION
+    # ========================================================================
+
+    async def initialize_all(self, year: Optional[int] = None, force_recalculate: bool = False) -> Dict:
+        """
+        Initialise (ou recalcule) les soldes de tous les employés
+
+        Args:
+            year: Année de référence (défaut : année en cours)
+            force_recalculate: Recalculer les soldes existants (sinon ignorés)
+
+        Returns:
+            {"year", "initialized", "updated", "skipped", "total_employees",
+             "total_processed", "errors", "error_details"}
+        """
+        if year is None:
+            year = datetime.now().year
+
+        stats = {"initialized": 0, "updated": 0, "skipped": 0, "total_employees": 0, "error_details": []}
+
+        batch = []
+        cursor = self.db.users.find({}, USER_PROJECTION).batch_size(self.batch_size)
+        async for user in cursor:
+            stats["total_employees"] += 1
+            if not user.get("id"):
+                continue
+            batch.append(user)
+            if len(batch) >= self.batch_size:
+                await self._process_batch(batch, year, force_recalculate, stats)
+                batch = []
+        if batch:
+            await self._process_batch(batch, year, force_recalculate, stats)
+
+        stats["total_processed"] = stats["initialized"] + stats["updated"]
+        stats["errors"] = len(stats["error_details"])
+        logger.info(
+            f"✅ CCN66 initialization complete ({year}): {stats['initialized']} created, "
+            f"{stats['updated']} updated, {stats['skipped']} skipped, {stats['errors']} errors"
+        )
+        return {"year": year, **stats}
+
+    async def _process_batch(self, users: List[Dict], year: int, force_recalculate: bool, stats: Dict):
+        """Un lot d'employés : préchargement $in, calcul des droits, bulk_write"""
+        existing_by_id = {}
+        cursor = self.db.leave_balances.find(
+            {self.employee_field: {"$in": [u["id"] for u in users]}, self.year_field: year},
+            {"_id": 0}
+        )
+        async for balance in cursor:
+            existing_by_id[balance[self.employee_field]] = balance
+
+        now = datetime.now(timezone.utc).isoformat()
+
+        pending = []
+        for user in users:
+            existing = existing_by_id.get(user["id"])
+            if existing and not force_recalculate:
+                stats["skipped"] += 1
+                continue
+            pending.append((user, existing))
+
+        if not pending:
+            return
+
+        rights_list = employees_rights([u for u, _ in pending], year)
+        for (user, existing), rights in zip(pending, rights_list):
+            logger.debug(
+                f"CCN66 {employee_display_name(user)} - Cat {rights['category']}: "
+                f"CA={rights['CA']}j, CT={rights['CT']}j, CEX={rights['CEX']}j"
+            )
+
+        if self.schema == "employee":
+            await self._write_ledger(pending, rights_list, year, stats)
+        else:
+            await self._write_balances(pending, rights_list, year, now, stats)
+
+    async def _write_ledger(self, pending: List, rights_list: List[Dict], year: int, stats: Dict):
+        """Schéma "employee" : mouvements "rights" du grand livre (un upsert par solde, un insert_many)"""
+        entries = [self._employee_entry(user, rights, existing, year)
+                   for (user, existing), rights in zip(pending, rights_list)]
+        try:
+            await self.ledger.append_many(entries)
+        except Exception as e:
+            for user, _ in pending:
+                stats["error_details"].append({"user_id": user["id"], "error": str(e)})
+            logger.error(f"❌ Soldes non écrits ({len(pending)} employés): {str(e)}")
+            return
+
+        stats["initialized"] += sum(1 for _, existing in pending if existing is None)
+        stats["updated"] += sum(1 for _, existing in pending if existing is not None)
+
+    async def _write_balances(self, pending: List, rights_list: List[Dict], year: int, now: str, stats: Dict):
+        """Schéma "user" : un bulk_write non ordonné d'upserts"""
+        operations, targets = [], []
+        for (user, existing), rights in zip(pending, rights_list):
+            operations.append(UpdateOne(
+                {self.employee_field: user["id"], self.year_field: year},
+                self._user_update(user, rights, existing, year, now),
+                upsert=True
+            ))
+            targets.append(user["id"])
+
+        try:
+            result = await self.db.leave_balances.bulk_write(operations, ordered=False)
+            stats["initialized"] += result.upserted_count
+            stats["updated"] += result.matched_count
+        except BulkWriteError as e:
+            details = e.details
+            stats["initialized"] += details.get("nUpserted", 0)
+            stats["updated"] += details.get("nMatched", 0)
+            for error in details.get("writeErrors", []):
+                stats["error_details"].append({"user_id": targets[error["index"]], "error": error.get("errmsg")})
+                logger.error(f"❌ Solde non écrit pour {targets[error['index']]}: {error.get('errmsg')}")
+        finally:
+            await leave_projection.invalidate(self.db)
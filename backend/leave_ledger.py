@@ -0,0 +1,499 @@
+"""
+Grand livre des congés - Source de vérité des compteurs
+MOZAIK RH - Transactions, projections et snapshots
+
+Chaque mouvement de compteur (pose, réintégration, attribution, annulation,
+droits CCN66) est une écriture de `leave_transactions` portant :
+
+- employee_id / year : compteur concerné
+- seq                : numéro de séquence du compteur, strictement croissant
+- operation          : nature du mouvement
+- deltas             : variations additives des champs de compteur
+                       (ex: {"ca_taken": 2.0, "ca_balance": -2.0})
+
+`leave_balances` (schéma employee_id / year) devient une projection :
+chaque écriture y applique les mêmes deltas, en un upsert atomique par
+solde (création avec valeurs par défaut ou incrément) qui attribue aussi
+les séquences des mouvements (`ledger_seq`). La projection à la séquence N
+contient donc exactement les mouvements 1..N, y compris ceux dont la
+transaction est encore en cours d'insertion : un snapshot pris sur elle
+ne peut pas en omettre.
+
+Lecture : les soldes sont lus sur la projection `leave_balances` (GET
+/leave-balance, DataSyncService, clôture annuelle), un document par
+compteur. Le grand livre sert à l'audit et à la reconstruction : il se
+relit comme dernier snapshot + mouvements suivants. Les snapshots sont
+écrits par l'écriture elle-même, dès que `snapshot_every` séquences suivent
+le précédent (`snapshot_seq` sur la projection, avancé dans le même upsert) :
+une relecture porte au plus sur `snapshot_every` mouvements.
+
+`rebuild()` recalcule toutes les projections et snapshots depuis le grand
+livre en une seule agrégation ; `audit()` compare projection et grand livre.
+"""
+
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import DESCENDING, ReturnDocument, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Champs de compteur du schéma employee_id / year
+COUNTER_FIELDS = (
+    "ca_initial", "ca_taken", "ca_pending", "ca_reintegrated", "ca_balance",
+    "ct_initial", "ct_taken", "ct_pending", "ct_reintegrated", "ct_balance",
+    "rtt_initial", "rtt_taken", "rtt_pending", "rtt_reintegrated", "rtt_balance",
+    "cex_initial", "cex_taken", "cex_balance",
+    "rec_accumulated", "rec_taken", "rec_reintegrated", "rec_balance"
+)
+
+DEFAULT_SNAPSHOT_EVERY = 50
+PRECISION = 4
+
+
+def clean_deltas(deltas: Dict[str, float]) -> Dict[str, float]:
+    """Deltas non nuls, arrondis (les champs inconnus sont refusés)"""
+    unknown = set(deltas) - set(COUNTER_FIELDS)
+    if unknown:
+        raise ValueError(f"Champs de compteur inconnus: {sorted(unknown)}")
+    return {f: round(float(v), PRECISION) for f, v in deltas.items() if v and round(float(v), PRECISION) != 0}
+
+
+def sum_deltas(entries: Iterable[Dict], base: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+    """Cumule les deltas d'une suite d'écritures (à partir de `base`)"""
+    counters = {f: 0.0 for f in COUNTER_FIELDS}
+    counters.update(base or {})
+    for entry in entries:
+        for field, value in (entry.get("deltas") or {}).items():
+            counters[field] = counters.get(field, 0.0) + value
+    return {f: round(v, PRECISION) for f, v in counters.items()}
+
+
+class LeaveLedger:
+    """Écriture et lecture du grand livre des congés"""
+
+    def __init__(self, db, snapshot_every: int = DEFAULT_SNAPSHOT_EVERY):
+        self.db = db
+        self.snapshot_every = snapshot_every
+        self.transactions = db.leave_transactions
+        self.balances = db.leave_balances
+        self.snapshots = db.leave_balance_snapshots
+
+    # ========================================================================
+    # ÉCRITURE
+    # ========================================================================
+
+    async def append(
+        self,
+        employee_id: str,
+        year: int,
+        operation: str,
+        deltas: Dict[str, float],
+        fields: Optional[Dict] = None,
+        projection_set: Optional[Dict] = None,
+        projection_on_insert: Optional[Dict] = None,
+        defaults: Optional[Dict[str, float]] = None
+    ) -> Optional[Dict]:
+        """
+        Enregistre un mouvement et l'applique à la projection
+
+        Args:
+            deltas: Variations des champs de compteur
+            fields: Champs additionnels de la transaction (motif, absence, auteur...)
+            projection_set: Champs non-compteurs à mettre à jour sur le solde ($set)
+            projection_on_insert: Champs non-compteurs d'un solde créé
+            defaults: Compteurs d'un solde créé par ce mouvement
+
+        Returns:
+            La transaction enregistrée (None si aucun delta)
+        """
+        written = await self.append_many([{
+            "employee_id": employee_id,
+            "year": year,
+            "operation": operation,
+            "deltas": deltas,
+            "fields": fields,
+            "projection_set": projection_set,
+            "projection_on_insert": projection_on_insert,
+            "defaults": defaults
+        }])
+        return written[-1] if written else None
+
+    async def append_many(self, entries: List[Dict]) -> List[Dict]:
+        """
+        Enregistre un lot de mouvements
+
+        Chaque compteur touché reçoit un seul upsert atomique (pipeline de
+        mise à jour, `find_one_and_update`) qui applique les deltas, crée le
+        solde s'il n'existe pas encore et avance sa séquence `ledger_seq` ;
+        les transactions sont ensuite insérées en un `insert_many` avec les
+        séquences attribuées par cet upsert. Soit deux allers-retours, les
+        upserts de plusieurs compteurs étant envoyés en parallèle.
+
+        Un solde créé avec `defaults`, ou un solde antérieur au grand livre
+        (sans `ledger_seq`), reçoit d'abord un mouvement "opening" : ses
+        valeurs par défaut, ou ses compteurs lus dans le même upsert.
+
+        Args:
+            entries: Dicts {employee_id, year, operation, deltas, fields?,
+                projection_set?, projection_on_insert?, defaults?}.
+                Un mouvement sans delta ne fait qu'ouvrir le compteur.
+
+        Returns:
+            Transactions enregistrées
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        prepared = [dict(e, deltas=clean_deltas(e.get("deltas") or {})) for e in entries]
+
+        # Cumul par compteur (employee_id, year)
+        merged: Dict[Tuple[str, int], Dict] = {}
+        for entry in prepared:
+            key = (entry["employee_id"], entry["year"])
+            target = merged.setdefault(key, {
+                "deltas": {}, "set": {}, "on_insert": {}, "defaults": None, "entries": []
+            })
+            for field, value in entry["deltas"].items():
+                target["deltas"][field] = target["deltas"].get(field, 0.0) + value
+            target["set"].update(entry.get("projection_set") or {})
+            target["on_insert"].update(entry.get("projection_on_insert") or {})
+            if entry.get("defaults") and target["defaults"] is None:
+                target["defaults"] = clean_deltas(entry["defaults"])
+            if entry["deltas"]:
+                target["entries"].append(entry)
+
+        # 📊 Un upsert par compteur : état précédent (ReturnDocument.BEFORE) → séquences
+        keys = list(merged)
+        befores = await asyncio.gather(*(
+            self.balances.find_one_and_update(
+                {"employee_id": key[0], "year": key[1]},
+                self._projection_update(merged[key], now, self.snapshot_every),
+                projection={"_id": 0},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+            for key in keys
+        ))
+
+        transactions, snapshots = [], []
+        for key, before in zip(keys, befores):
+            target = merged[key]
+            seq = (before or {}).get("ledger_seq") or 0
+            written = len(transactions)
+            if before is None or before.get("ledger_seq") is None:
+                # Séquence réservée à l'ouverture par l'upsert (utilisée ou non)
+                seq += 1
+                opening = self._opening(key, target, before)
+                if opening is not None:
+                    transactions.append(self._transaction(opening, seq, now))
+            for entry in target["entries"]:
+                seq += 1
+                transactions.append(self._transaction(entry, seq, now))
+
+            # 📸 Même règle que l'upsert : snapshot de l'état qu'il a produit
+            if seq - ((before or {}).get("snapshot_seq") or 0) >= self.snapshot_every:
+                snapshots.append(self._write_snapshot(key[0], key[1], {
+                    "seq": seq,
+                    "entries": ((before or {}).get("ledger_entries") or 0) + len(transactions) - written,
+                    "counters": self._after(target, before)
+                }))
+
+        await asyncio.gather(self._insert(transactions), *snapshots)
+        return transactions
+
+    @staticmethod
+    def _after(target: Dict, before: Optional[Dict]) -> Dict[str, float]:
+        """Compteurs produits par l'upsert (état précédent ou valeurs par défaut, plus les deltas)"""
+        defaults = target["defaults"] or {}
+        counters = {}
+        for field in COUNTER_FIELDS:
+            value = (before or {}).get(field)
+            if value is None:
+                value = defaults.get(field, 0.0)
+            counters[field] = round(float(value) + target["deltas"].get(field, 0.0), PRECISION)
+        return counters
+
+    @staticmethod
+    def _opening(key: Tuple[str, int], target: Dict, before: Optional[Dict]) -> Optional[Dict]:
+        """Mouvement d'ouverture d'un solde créé (valeurs par défaut) ou antérieur au grand livre"""
+        if before is None:
+            if not target["defaults"]:
+                return None
+            deltas = target["defaults"]
+            reason = "Compteur par défaut"
+        else:
+            deltas = clean_deltas({f: before[f] for f in COUNTER_FIELDS if isinstance(before.get(f), (int, float))})
+            reason = "Reprise du solde existant"
+        return {
+            "employee_id": key[0],
+            "year": key[1],
+            "operation": "opening",
+            "deltas": deltas,
+            "fields": {
+                "employee_name": (before or {}).get("employee_name") or target["on_insert"].get("employee_name")
+                or target["set"].get("employee_name", ""),
+                "reason": reason
+            }
+        }
+
+    @staticmethod
+    def _transaction(entry: Dict, seq: int, now: str) -> Dict:
+        transaction = {
+            **(entry.get("fields") or {}),
+            "employee_id": entry["employee_id"],
+            "year": entry["year"],
+            "seq": seq,
+            "operation": entry["operation"],
+            "deltas": entry["deltas"]
+        }
+        transaction.setdefault("id", str(uuid.uuid4()))
+        transaction.setdefault("created_at", now)
+        return transaction
+
+    async def _insert(self, transactions: List[Dict]):
+        if not transactions:
+            return
+        await self.transactions.insert_many(transactions, ordered=False)
+        # insert_many ajoute _id aux documents
+        for transaction in transactions:
+            transaction.pop("_id", None)
+
+    @staticmethod
+    def _projection_update(target: Dict, now: str, snapshot_every: int) -> List[Dict]:
+        """
+        Pipeline de mise à jour d'un solde (création ou incrément en une opération)
+
+        Un champ absent prend sa valeur par défaut avant application du delta :
+        un même champ peut ainsi être initialisé et incrémenté, ce que
+        $setOnInsert + $inc ne permettent pas. `ledger_seq` avance du nombre
+        de mouvements, plus un pour l'ouverture d'un solde qui n'en avait pas ;
+        `snapshot_seq` le rejoint tous les `snapshot_every` (snapshot à écrire).
+        """
+        defaults = target["defaults"] or {}
+        stage = {}
+        for field in COUNTER_FIELDS:
+            current = {"$ifNull": [f"${field}", defaults.get(field, 0.0)]}
+            stage[field] = {"$add": [current, target["deltas"][field]]} if field in target["deltas"] else current
+
+        for field, value in {"id": str(uuid.uuid4()), "created_at": now, **target["on_insert"]}.items():
+            stage[field] = {"$ifNull": [f"${field}", {"$literal": value}]}
+        for field, value in {**target["set"], "last_updated": now}.items():
+            stage[field] = {"$literal": value}
+
+        # Pas encore de séquence : solde créé par cet upsert ou antérieur au grand livre
+        unopened = {"$eq": [{"$ifNull": ["$ledger_seq", None]}, None]}
+        existing = {"$ne": [{"$ifNull": ["$id", None]}, None]}
+        opening = {"$and": [unopened, {"$or": [existing, bool(target["defaults"])]}]}
+        count = len(target["entries"])
+        seq = {"$add": [{"$ifNull": ["$ledger_seq", 0]}, count, {"$cond": [unopened, 1, 0]}]}
+        snapshot_seq = {"$ifNull": ["$snapshot_seq", 0]}
+        stage["ledger_seq"] = seq
+        stage["ledger_entries"] = {"$add": [{"$ifNull": ["$ledger_entries", 0]}, count, {"$cond": [opening, 1, 0]}]}
+        stage["snapshot_seq"] = {"$cond": [
+            {"$gte": [{"$subtract": [seq, snapshot_seq]}, snapshot_every]}, seq, snapshot_seq
+        ]}
+        return [{"$set": stage}]
+
+    # ========================================================================
+    # SNAPSHOTS
+    # ========================================================================
+
+    async def _write_snapshot(self, employee_id: str, year: int, state: Dict) -> Dict:
+        snapshot = {
+            "employee_id": employee_id,
+            "year": year,
+            "seq": state["seq"],
+            "entries": state["entries"],
+            "counters": state["counters"],
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }
+        await self.snapshots.update_one(
+            {"employee_id": employee_id, "year": year, "seq": state["seq"]},
+            {"$set": snapshot},
+            upsert=True
+        )
+        return snapshot
+
+    async def snapshot(self, employee_id: str, year: int) -> Optional[Dict]:
+        """
+        Écrit le snapshot courant d'un compteur
+
+        L'état est lu sur la projection, mise à jour atomiquement avec sa
+        séquence : il contient tous les mouvements jusqu'à `ledger_seq`, même
+        ceux dont la transaction n'est pas encore insérée.
+
+        Returns:
+            Le snapshot écrit (None si le compteur n'est pas au grand livre)
+        """
+        projection = await self.balances.find_one({"employee_id": employee_id, "year": year}, {"_id": 0})
+        if not projection or projection.get("ledger_seq") is None:
+            return None
+        return await self._write_snapshot(employee_id, year, {
+            "seq": projection["ledger_seq"],
+            "entries": projection.get("ledger_entries", 0),
+            "counters": {f: round(float(projection.get(f) or 0.0), PRECISION) for f in COUNTER_FIELDS}
+        })
+
+    # ========================================================================
+    # LECTURE
+    # ========================================================================
+
+    async def _replay(self, employee_id: str, year: int) -> Dict:
+        """Dernier snapshot + mouvements postérieurs"""
+        snapshot = await self.snapshots.find_one(
+            {"employee_id": employee_id, "year": year}, {"_id": 0}, sort=[("seq", DESCENDING)]
+        ) or {}
+        tail = await self.transactions.find(
+            {"employee_id": employee_id, "year": year, "seq": {"$gt": snapshot.get("seq", 0)}},
+            {"_id": 0, "seq": 1, "deltas": 1}
+        ).sort("seq", 1).to_list(None)
+
+        return {
+            "seq": tail[-1]["seq"] if tail else snapshot.get("seq", 0),
+            "entries": snapshot.get("entries", 0) + len(tail),
+            "counters": sum_deltas(tail, snapshot.get("counters")),
+            "tail": len(tail)
+        }
+
+    async def balance(self, employee_id: str, year: int) -> Dict[str, float]:
+        """
+        Compteurs d'un employé relus depuis le grand livre (snapshot + tail)
+
+        Contrôle et audit uniquement : les lectures métier se font sur la
+        projection `leave_balances`.
+        """
+        return (await self._replay(employee_id, year))["counters"]
+
+    async def audit(self, employee_id: str, year: int) -> Dict:
+        """
+        Compare la projection `leave_balances` au grand livre
+
+        Returns:
+            {"ledger": {...}, "projection": {...}, "drift": {champ: écart}, "seq", "tail"}
+        """
+        state = await self._replay(employee_id, year)
+        projection = await self.balances.find_one({"employee_id": employee_id, "year": year}, {"_id": 0}) or {}
+        drift = {}
+        for field in COUNTER_FIELDS:
+            delta = round(float(projection.get(field) or 0.0) - state["counters"][field], PRECISION)
+            if delta:
+                drift[field] = delta
+        return {
+            "ledger": state["counters"],
+            "projection": {f: projection.get(f, 0.0) for f in COUNTER_FIELDS},
+            "drift": drift,
+            "seq": state["seq"],
+            "tail": state["tail"]
+        }
+
+    # ========================================================================
+    # RECONSTRUCTION
+    # ========================================================================
+
+    @staticmethod
+    def build_recompute_pipeline(year: Optional[int] = None) -> List[Dict]:
+        """Agrégation unique : compteurs, dernière séquence et nombre de mouvements par employé et année"""
+        match = {"deltas": {"$exists": True}, "seq": {"$exists": True}}
+        if year is not None:
+            match["year"] = year
+        # Un mouvement → un document par champ ; `first` marque un seul de ses
+        # documents (ou le mouvement sans delta) pour compter les mouvements
+        first = {"$cond": [{"$eq": [{"$ifNull": ["$i", 0]}, 0]}, 1, 0]}
+        return [
+            {"$match": match},
+            {"$project": {"employee_id": 1, "year": 1, "seq": 1, "kv": {"$objectToArray": "$deltas"}}},
+            {"$unwind": {"path": "$kv", "includeArrayIndex": "i", "preserveNullAndEmptyArrays": True}},
+            {"$group": {
+                "_id": {"employee_id": "$employee_id", "year": "$year", "field": "$kv.k"},
+                "value": {"$sum": "$kv.v"},
+                "seq": {"$max": "$seq"},
+                "entries": {"$sum": first}
+            }},
+            {"$group": {
+                "_id": {"employee_id": "$_id.employee_id", "year": "$_id.year"},
+                "counters": {"$push": {"k": "$_id.field", "v": "$value"}},
+                "seq": {"$max": "$seq"},
+                "entries": {"$sum": "$entries"}
+            }},
+            {"$project": {
+                "_id": 0,
+                "employee_id": "$_id.employee_id",
+                "year": "$_id.year",
+                "seq": 1,
+                "entries": 1,
+                "counters": {"$arrayToObject": {"$filter": {
+                    "input": "$counters", "as": "c", "cond": {"$ne": ["$$c.k", None]}
+                }}}
+            }}
+        ]
+
+    async def rebuild(self, year: Optional[int] = None) -> Dict:
+        """
+        Recalcule projections et snapshots depuis le grand livre
+
+        Returns:
+            {"employees": int, "entries": int, "corrected": int}
+        """
+        results = await self.transactions.aggregate(self.build_recompute_pipeline(year)).to_list(None)
+        now = datetime.now(timezone.utc).isoformat()
+
+        operations, snapshots = [], []
+        for result in results:
+            counters = {f: round(result["counters"].get(f, 0.0), PRECISION) for f in COUNTER_FIELDS}
+            operations.append(UpdateOne(
+                {"employee_id": result["employee_id"], "year": result["year"]},
+                {
+                    "$set": {**counters, "ledger_seq": result["seq"], "ledger_entries": result["entries"],
+                             "snapshot_seq": result["seq"]},
+                    "$setOnInsert": {"id": str(uuid.uuid4()), "created_at": now, "last_updated": now}
+                },
+                upsert=True
+            ))
+            snapshots.append({
+                "employee_id": result["employee_id"],
+                "year": result["year"],
+                "seq": result["seq"],
+                "entries": result["entries"],
+                "counters": counters,
+                "created_at": now
+            })
+
+        corrected = 0
+        if operations:
+            write = await self.balances.bulk_write(operations, ordered=False)
+            corrected = write.modified_count + write.upserted_count
+
+        await self.snapshots.delete_many({} if year is None else {"year": year})
+        if snapshots:
+            await self.snapshots.insert_many(snapshots, ordered=False)
+
+        entries = sum(r["entries"] for r in results)
+        logger.info(f"📒 Grand livre congés: {len(results)} compteurs recalculés ({entries} mouvements, {corrected} corrigés)")
+        return {"employees": len(results), "entries": entries, "corrected": corrected}
+
+    async def adopt_legacy_balances(self) -> int:
+        """
+        Reprise des soldes antérieurs au grand livre
+
+        Chaque solde employee_id / year sans `ledger_seq` reçoit une écriture
+        d'ouverture égale à ses compteurs, lus dans l'upsert qui lui attribue
+        sa séquence (la projection n'est pas modifiée). Opération idempotente.
+
+        Returns:
+            Nombre de soldes repris
+        """
+        entries = []
+        cursor = self.balances.find(
+            {"employee_id": {"$exists": True}, "year": {"$exists": True}, "ledger_seq": {"$exists": False}},
+            {"_id": 0, "employee_id": 1, "year": 1}
+        )
+        async for balance in cursor:
+            entries.append({"employee_id": balance["employee_id"], "year": balance["year"],
+                            "operation": "opening", "deltas": {}})
+
+        if entries:
+            await self.append_many(entries)
+            logger.info(f"📒 Grand livre congés: {len(entries)} soldes existants repris")
+        return len(entries)
@@ -0,0 +1,220 @@
+"""
+Soldes projetés - Solde actuel, demandes en attente et solde après approbation
+MOZAIK RH - Aide à la décision des managers
+
+Pour chaque employé (ou un service), une seule agrégation sur `users`
+joint le solde de l'année (`leave_balances`, schéma user_id / fiscal_year),
+les demandes en attente (`absence_requests`) et les absences en attente de
+validation (`absences`). Chaque jointure est un `$lookup` let/pipeline qui
+filtre côté serveur (année, statut, dates de l'année) : seuls les documents
+utiles sont ramenés. Aucune écriture : un employé sans solde est projeté
+sur le solde par défaut, sans création de document.
+
+Le résultat est mis en cache par (année, service) jusqu'à la prochaine
+modification de l'une des trois collections (`invalidate()`, appelé par les
+chemins d'écriture). La version est stockée dans MongoDB
+(materialized_state) : une écriture dans un processus invalide le cache de
+tous les autres ; une durée de vie maximale couvre les écritures faites
+hors de ces chemins (scripts, accès direct à la base).
+"""
+
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import materialized_state
+from models_leave_balance import BALANCE_TYPES, DEFAULT_BALANCE
+
+logger = logging.getLogger(__name__)
+
+# Libellés de types d'absence → type de solde
+LEAVE_TYPE_CODES = {
+    "CA": "CA", "CP": "CA", "Congés Annuels": "CA", "Congés Payés": "CA",
+    "RTT": "RTT",
+    "CT": "CT", "Congés Trimestriels": "CT",
+    "REC": "REC", "Récupération": "REC"
+}
+
+# Statuts « en attente » de chaque source
+PENDING_REQUEST_STATUSES = ["pending"]
+PENDING_ABSENCE_STATUSES = ["pending", "validated_by_manager"]
+
+HOURS_PER_DAY = 7.0
+CACHE_TTL_SECONDS = 300
+
+# Nom de la version dans `materialized_state`
+STATE_NAME = "leave_projection"
+
+_cache: Dict[tuple, tuple] = {}
+
+
+async def invalidate(db):
+    """À appeler après toute écriture sur leave_balances, absence_requests ou absences"""
+    try:
+        await materialized_state.bump_version(db, STATE_NAME)
+    except Exception as e:
+        logger.error(f"❌ Erreur invalidation des soldes projetés: {str(e)}")
+
+
+def leave_type_code(label: Optional[str]) -> Optional[str]:
+    """Type de solde d'un libellé d'absence (None si non soumis à solde)"""
+    return LEAVE_TYPE_CODES.get((label or "").strip())
+
+
+def parse_days(value, unit: Optional[str] = "jours", hours: Optional[float] = None) -> float:
+    """Durée en jours ("3", "2.5 jours", 1.5 ; heures converties à 7h/jour)"""
+    if unit == "heures":
+        if hours is not None:
+            return float(hours) / HOURS_PER_DAY
+        return parse_days(value) / HOURS_PER_DAY
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).split()[0].replace(",", "."))
+    except (ValueError, IndexError):
+        return 0.0
+
+
+def date_year(value: Optional[str]) -> Optional[int]:
+    """Année d'une date DD/MM/YYYY ou YYYY-MM-DD (None si illisible)"""
+    for fmt in ("%Y-%m-%d", "%d/%m/%Y"):
+        try:
+            return datetime.strptime((value or "")[:10], fmt).year
+        except ValueError:
+            continue
+    return None
+
+
+def year_window(field: str, fiscal_year: int) -> Dict:
+    """Date dans l'année (YYYY-MM-DD[...] ou DD/MM/YYYY) ; une date absente est gardée"""
+    return {"$or": [
+        {field: {"$regex": f"^{fiscal_year}-"}},
+        {field: {"$regex": f"^\\d{{2}}/\\d{{2}}/{fiscal_year}"}},
+        {field: {"$in": [None, ""]}}
+    ]}
+
+
+def build_projection_pipeline(fiscal_year: int, department: Optional[str] = None) -> List[Dict]:
+    """Agrégation users → solde de l'année + demandes et absences en attente de l'année"""
+    match = {"id": {"$exists": True}}
+    if department:
+        match["department"] = department
+
+    def lookup(source: str, foreign_field: str, local: str, conditions: Dict, fields: Dict) -> Dict:
+        # Jointure filtrée côté serveur : seuls les documents de l'employé
+        # qui remplissent les conditions sont ramenés (index foreign_field + status)
+        return {"$lookup": {
+            "from": source,
+            "let": {"key": f"${local}"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": [f"${foreign_field}", "$$key"]}, **conditions}},
+                {"$project": {"_id": 0, **{name: f"${field}" for name, field in fields.items()}}}
+            ],
+            "as": source
+        }}
+
+    return [
+        {"$match": match},
+        {"$project": {"_id": 0, "id": 1, "name": 1, "department": 1}},
+        lookup("leave_balances", "user_id", "id", {"fiscal_year": fiscal_year}, {
+            field: field for field in (f"{t.lower()}_balance" for t in BALANCE_TYPES)
+        }),
+        lookup("absence_requests", "employee", "name", {
+            "status": {"$in": PENDING_REQUEST_STATUSES}, **year_window("startDate", fiscal_year)
+        }, {
+            "id": "id", "type": "type", "start": "startDate", "end": "endDate",
+            "duration": "duration", "unit": "absence_unit", "hours": "hours_amount"
+        }),
+        lookup("absences", "employee_id", "id", {
+            "status": {"$in": PENDING_ABSENCE_STATUSES}, **year_window("date_debut", fiscal_year)
+        }, {
+            "id": "id", "type": "motif_absence", "start": "date_debut", "end": "date_fin",
+            "duration": "jours_absence", "unit": "absence_unit", "hours": "hours_amount"
+        }),
+        {"$project": {
+            "id": 1, "name": 1, "department": 1,
+            "balance": {"$arrayElemAt": ["$leave_balances", 0]},
+            "requests": "$absence_requests",
+            "absences": "$absences"
+        }}
+    ]
+
+
+class LeaveProjectionService:
+    """Soldes projetés (lecture seule, mis en cache)"""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def get_projection(self, fiscal_year: Optional[int] = None,
+                             department: Optional[str] = None) -> Dict:
+        """
+        Solde actuel, demandes en attente et solde projeté par type de congé
+
+        Returns:
+            {"fiscal_year", "department", "employees": [...], "at_risk", "cached"}
+        """
+        if fiscal_year is None:
+            fiscal_year = datetime.now().year
+
+        key = (fiscal_year, department)
+        version = await materialized_state.current_version(self.db, STATE_NAME)
+        cached = _cache.get(key)
+        if cached and cached[0] == version and time.monotonic() - cached[1] < CACHE_TTL_SECONDS:
+            return {**cached[2], "cached": True}
+
+        rows = await self.db.users.aggregate(build_projection_pipeline(fiscal_year, department)).to_list(None)
+        employees = [self._project_employee(row, fiscal_year) for row in rows]
+        employees.sort(key=lambda e: e["employee_name"] or "")
+
+        result = {
+            "fiscal_year": fiscal_year,
+            "department": department,
+            "employees": employees,
+            "at_risk": sum(1 for e in employees if e["negative_types"])
+        }
+        _cache[key] = (version, time.monotonic(), result)
+        logger.info(f"📈 Soldes projetés {fiscal_year} ({department or 'tous services'}): "
+                    f"{len(employees)} employés, {result['at_risk']} en dépassement")
+        return {**result, "cached": False}
+
+    @staticmethod
+    def _project_employee(row: Dict, fiscal_year: int) -> Dict:
+        balance = row.get("balance")
+        types = {}
+        for leave_type in BALANCE_TYPES:
+            field = f"{leave_type.lower()}_balance"
+            current = (balance or {}).get(field)
+            if current is None:
+                current = DEFAULT_BALANCE[field]
+            types[leave_type] = {"current": current, "pending_days": 0.0, "projected": current, "pending": []}
+
+        for source, items in (("absence_request", row.get("requests") or []),
+                              ("absence", row.get("absences") or [])):
+            for item in items:
+                leave_type = leave_type_code(item.get("type"))
+                year = date_year(item.get("start"))
+                if leave_type is None or (year is not None and year != fiscal_year):
+                    continue
+                days = parse_days(item.get("duration"), item.get("unit"), item.get("hours"))
+                entry = types[leave_type]
+                entry["pending_days"] += days
+                entry["projected"] -= days
+                entry["pending"].append({
+                    "source": source, "id": item.get("id"), "type": item.get("type"),
+                    "start": item.get("start"), "end": item.get("end"), "days": days
+                })
+
+        for entry in types.values():
+            entry["pending_days"] = round(entry["pending_days"], 2)
+            entry["projected"] = round(entry["projected"], 2)
+
+        return {
+            "employee_id": row["id"],
+            "employee_name": row.get("name"),
+            "department": row.get("department"),
+            "has_balance": balance is not None,
+            "balances": types,
+            "negative_types": [t for t, e in types.items() if e["projected"] < 0]
+        }
@@ -0,0 +1,210 @@
+"""
+Clôture annuelle des soldes de congés - Report et ouverture de l'année suivante
+MOZAIK RH - Passage d'année (schéma employee_id / year)
+
+Pour chaque employé, les soldes de l'année N+1 sont ouverts avec :
+
+- les droits CCN66 de N+1 (calcul en bloc, ccn66_rules) ;
+- le report du solde de N selon la règle du type de congé (REPORT_RULES).
+
+Les mouvements "rollover" sont écrits dans le grand livre (leave_ledger) en
+une seule passe par base : un upsert par solde (envoyés en parallèle) puis
+un `insert_many` de transactions. Un solde N+1 déjà créé (à la
+volée par une absence de début janvier, ou par une exécution précédente)
+est corrigé par l'écart entre droits cibles et droits déjà attribués :
+compteur `*_initial` courant moins les mouvements du grand livre qui ne
+fixent pas les droits (attributions, récupérations acquises en janvier).
+Ces derniers sont ainsi conservés, un solde ouvert hors grand livre (sans
+mouvement d'ouverture) est corrigé depuis sa valeur réelle, et une
+nouvelle exécution n'écrit rien. Le mode `dry_run` calcule le même rapport
+sans écrire.
+"""
+
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from leave_balance_init import SCHEMAS, USER_PROJECTION, employee_display_name, employees_rights
+from leave_ledger import LeaveLedger
+
+logger = logging.getLogger(__name__)
+
+# Règle de report par type : (champ des droits, report du solde, plafond en jours)
+REPORT_RULES = {
+    "ca": ("ca_initial", True, None),       # Congés annuels : solde restant reporté
+    "ct": ("ct_initial", False, None),      # Congés trimestriels : non reportables
+    "cex": ("cex_initial", False, None),    # Congés d'ancienneté : non reportables
+    "rtt": ("rtt_initial", False, None),    # RTT : perdus en fin d'année
+    "rec": ("rec_accumulated", True, None)  # Récupérations : reportées
+}
+
+# Mouvements du grand livre qui fixent les droits d'une année (les autres
+# s'ajoutent aux droits et sont déduits du compteur avant calcul de l'écart)
+RIGHTS_OPERATIONS = ("opening", "rights", "rollover")
+
+# Nombre d'employés détaillés dans le rapport
+REPORT_SAMPLE_SIZE = 20
+
+
+def carry_over(code: str, closing_balance: Optional[float]) -> float:
+    """Jours reportés d'un solde de clôture (jamais négatif, plafonné selon la règle)"""
+    _, carried, cap = REPORT_RULES[code]
+    if not carried or not closing_balance or closing_balance <= 0:
+        return 0.0
+    return float(min(closing_balance, cap) if cap is not None else closing_balance)
+
+
+def build_other_grants_pipeline(employee_ids: List[str], year: int) -> List[Dict]:
+    """Attributions hors droits annuels (grant, récupérations...) par employé et par champ `*_initial`"""
+    initial_fields = [initial_field for initial_field, _, _ in REPORT_RULES.values()]
+    return [
+        {"$match": {"employee_id": {"$in": employee_ids}, "year": year,
+                    "operation": {"$nin": list(RIGHTS_OPERATIONS)}}},
+        {"$project": {"employee_id": 1, "kv": {"$objectToArray": "$deltas"}}},
+        {"$unwind": "$kv"},
+        {"$match": {"kv.k": {"$in": initial_fields}}},
+        {"$group": {"_id": {"employee_id": "$employee_id", "field": "$kv.k"}, "value": {"$sum": "$kv.v"}}}
+    ]
+
+
+class LeaveRolloverService:
+    """Passage d'année des soldes de congés d'une base"""
+
+    def __init__(self, db, batch_size: int = 1000):
+        self.db = db
+        self.batch_size = batch_size
+        self.ledger = LeaveLedger(db)
+        self.rtt_initial = SCHEMAS["employee"][2]
+
+    async def rollover(self, from_year: Optional[int] = None, dry_run: bool = True) -> Dict:
+        """
+        Ouvre les soldes de `from_year + 1` (défaut : clôture de l'année passée)
+
+        Args:
+            from_year: Année clôturée
+            dry_run: Calculer le rapport sans rien écrire
+
+        Returns:
+            {"from_year", "to_year", "dry_run", "total_employees", "opened",
+             "adjusted", "unchanged", "carried", "expired", "entries", "sample"}
+        """
+        if from_year is None:
+            from_year = datetime.now().year - 1
+        to_year = from_year + 1
+
+        report = {
+            "from_year": from_year,
+            "to_year": to_year,
+            "dry_run": dry_run,
+            "total_employees": 0,
+            "opened": 0,
+            "adjusted": 0,
+            "unchanged": 0,
+            "carried": {code: 0.0 for code in REPORT_RULES},
+            "expired": {code: 0.0 for code in REPORT_RULES},
+            "sample": []
+        }
+
+        entries = []
+        batch = []
+        cursor = self.db.users.find({"id": {"$exists": True}}, USER_PROJECTION).batch_size(self.batch_size)
+        async for user in cursor:
+            batch.append(user)
+            if len(batch) >= self.batch_size:
+                entries.extend(await self._plan_batch(batch, from_year, to_year, report))
+                batch = []
+        if batch:
+            entries.extend(await self._plan_batch(batch, from_year, to_year, report))
+
+        report["entries"] = len(entries)
+        for totals in (report["carried"], report["expired"]):
+            for code in totals:
+                totals[code] = round(totals[code], 2)
+
+        if not dry_run and entries:
+            # Une passe : upserts des soldes (en parallèle) + insert_many (grand livre)
+            await self.ledger.append_many(entries)
+
+        logger.info(
+            f"📆 Clôture {from_year} → {to_year}{' (simulation)' if dry_run else ''}: "
+            f"{report['opened']} ouverts, {report['adjusted']} ajustés, {report['unchanged']} inchangés"
+        )
+        return report
+
+    async def _plan_batch(self, users: List[Dict], from_year: int, to_year: int, report: Dict) -> List[Dict]:
+        """Un lot : soldes N et N+1 préchargés en une requête, droits N+1 en bloc"""
+        balances = {from_year: {}, to_year: {}}
+        cursor = self.db.leave_balances.find(
+            {"employee_id": {"$in": [u["id"] for u in users]}, "year": {"$in": [from_year, to_year]}},
+            {"_id": 0}
+        )
+        async for balance in cursor:
+            balances[balance["year"]][balance["employee_id"]] = balance
+
+        # Attributions N+1 hors droits annuels : retirées du compteur courant
+        grants: Dict[str, Dict[str, float]] = {}
+        pipeline = build_other_grants_pipeline([u["id"] for u in users], to_year)
+        async for row in self.db.leave_transactions.aggregate(pipeline):
+            grants.setdefault(row["_id"]["employee_id"], {})[row["_id"]["field"]] = row["value"]
+
+        now = datetime.now(timezone.utc).isoformat()
+        entries = []
+        for user, rights in zip(users, employees_rights(users, to_year)):
+            report["total_employees"] += 1
+            closing = balances[from_year].get(user["id"]) or {}
+            current = balances[to_year].get(user["id"])
+
+            rights_by_code = {"ca": rights["CA"], "ct": rights["CT"], "cex": rights["CEX"],
+                              "rtt": self.rtt_initial, "rec": 0.0}
+            deltas, carried = {}, {}
+            for code, (initial_field, _, _) in REPORT_RULES.items():
+                closing_balance = closing.get(f"{code}_balance")
+                carried[code] = carry_over(code, closing_balance)
+                report["carried"][code] += carried[code]
+                report["expired"][code] += max(0.0, (closing_balance or 0.0) - carried[code])
+
+                # Droits déjà attribués : compteur courant (avec ou sans ouverture au
+                # grand livre) moins les attributions hors droits annuels
+                already = 0.0
+                if current is not None:
+                    already = (current.get(initial_field) or 0.0) - grants.get(user["id"], {}).get(initial_field, 0.0)
+                change = rights_by_code[code] + carried[code] - already
+                deltas[initial_field] = change
+                deltas[f"{code}_balance"] = change
+
+            if current is not None and not any(round(v, 4) for v in deltas.values()):
+                report["unchanged"] += 1
+                continue
+            report["adjusted" if current is not None else "opened"] += 1
+
+            name = employee_display_name(user)
+            entries.append({
+                "employee_id": user["id"],
+                "year": to_year,
+                "operation": "rollover",
+                "deltas": deltas,
+                "fields": {
+                    "employee_name": name,
+                    "reason": f"Ouverture {to_year} : droits CCN66 (catégorie {rights['category']}) "
+                              f"+ report {from_year}"
+                },
+                "projection_set": {
+                    "employee_name": name,
+                    "ccn66_category": rights["category"],
+                    "temps_travail_percent": rights["temps_travail_percent"],
+                    "is_temps_plein": rights["is_temps_plein"],
+                    "carried_over": {code: days for code, days in carried.items() if days},
+                    "rollover_from": from_year,
+                    "rollover_at": now
+                }
+            })
+            if len(report["sample"]) < REPORT_SAMPLE_SIZE:
+                report["sample"].append({
+                    "employee_id": user["id"],
+                    "employee_name": name,
+                    "status": "adjusted" if current is not None else "opened",
+                    "rights": {code: rights_by_code[code] for code in REPORT_RULES},
+                    "carried": {code: days for code, days in carried.items() if days}
+                })
+
+        return entries
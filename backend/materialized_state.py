@@ -0,0 +1,85 @@
+"""
+État partagé des vues matérialisées
+MOZAIK RH - Périmé / recalcul en cours / version, stockés dans MongoDB
+
+Les collections maintenues incrémentalement (soldes CSE, heures
+supplémentaires...) partagent leur état entre les processus (workers
+uvicorn, scripts) via la collection `materialized_state`, un document par
+vue (`_id` = nom de la vue) :
+
+- `stale` : écritures incrémentales en échec, ou concurrentes d'un
+  recalcul ; la vue est recalculée avant la lecture suivante, quel que soit
+  le processus qui la sert.
+- `rebuilding_until` : bail du recalcul en cours (expire si le processus
+  qui recalcule s'arrête).
+- `version` : incrémentée à chaque écriture, invalide les caches de lecture
+  de tous les processus.
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+# Durée maximale d'un recalcul (au-delà, le bail expire)
+REBUILD_LEASE = timedelta(minutes=10)
+
+
+async def mark_stale(db, name: str):
+    """Marque la vue comme périmée (recalcul avant la prochaine lecture)"""
+    await db.materialized_state.update_one({"_id": name}, {"$inc": {"stale": 1}}, upsert=True)
+
+
+async def mark_stale_if_rebuilding(db, name: str):
+    """Après une écriture incrémentale : périmée si un recalcul est en cours (écriture écrasée par le renommage)"""
+    await db.materialized_state.update_one(
+        {"_id": name, "rebuilding_until": {"$gt": datetime.utcnow()}}, {"$inc": {"stale": 1}}
+    )
+
+
+async def stale_token(db, name: str) -> int:
+    """Compteur d'écritures en échec (0 : vue à jour)"""
+    state = await db.materialized_state.find_one({"_id": name}, {"stale": 1})
+    return (state or {}).get("stale", 0)
+
+
+async def begin_rebuild(db, name: str):
+    """
+    Ouvre le bail d'un recalcul
+
+    Returns:
+        (jeton périmé lu avant le recalcul, fin du bail) à passer à `end_rebuild`
+    """
+    until = datetime.utcnow() + REBUILD_LEASE
+    state = await db.materialized_state.find_one_and_update(
+        {"_id": name}, {"$max": {"rebuilding_until": until}}, upsert=True
+    )
+    return (state or {}).get("stale", 0), until
+
+
+async def end_rebuild(db, name: str, lease, succeeded: bool = True):
+    """
+    Ferme le bail d'un recalcul ; la vue redevient à jour si aucune
+    écriture n'a échoué (ou n'a été écrasée) pendant le recalcul
+    """
+    token, until = lease
+    if succeeded and token:
+        await db.materialized_state.update_one({"_id": name, "stale": token}, {"$set": {"stale": 0}})
+    await db.materialized_state.update_one({"_id": name, "rebuilding_until": until},
+                                           {"$unset": {"rebuilding_until": ""}})
+
+
+async def bump_version(db, name: str) -> int:
+    """Incrémente la version de la vue (invalide les caches de tous les processus)"""
+    state = await db.materialized_state.find_one_and_update(
+        {"_id": name}, {"$inc": {"version": 1}}, projection={"version": 1}, upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return state["version"]
+
+
+async def current_version(db, name: str) -> int:
+    state = await db.materialized_state.find_one({"_id": name}, {"version": 1})
+    return (state or {}).get("version", 0)
@@ -5,11 +5,23 @@ Adapté pour utiliser UUID au lieu d'ObjectId
 """
 
 from pydantic import BaseModel, Field
-from typing import Optional, Literal
+from typing import List, Optional, Literal
 from datetime import datetime
 import uuid
 
 
+# Types de congé soumis à un solde
+BALANCE_TYPES = ("CA", "RTT", "CT", "REC")
+
+# Solde d'un employé sans document pour l'année
+DEFAULT_BALANCE = {
+    "ca_balance": 25.0,   # Défaut : 25 jours CA
+    "rtt_balance": 12.0,  # Défaut : 12 jours RTT
+    "ct_balance": 0.0,    # Défaut : 0 (dépend catégorie)
+    "rec_balance": 0.0    # Défaut : 0
+}
+
+
 # ============================================================================
 # MODÈLE : Solde de congés d'un employé
 # ============================================================================
@@ -169,6 +181,20 @@ class ValidateLeaveRequest(BaseModel):
     fiscal_year: int
 
 
+class ValidateLeaveBatchItem(BaseModel):
+    """Une demande candidate d'un plan d'équipe"""
+    user_id: str
+    leave_type: str = Field(..., description="Type de congé (CA/RTT/CT/REC ; autres types non soumis à solde)")
+    amount: float = Field(..., gt=0, description="Nombre de jours demandés")
+    reference: Optional[str] = Field(None, description="Identifiant libre renvoyé avec le verdict")
+
+
+class ValidateLeaveBatchRequest(BaseModel):
+    """Requête API : valider un lot de demandes candidates"""
+    fiscal_year: Optional[int] = None
+    requests: List[ValidateLeaveBatchItem] = Field(..., max_length=1000)
+
+
 class InitializeBalanceRequest(BaseModel):
     """Requête API : initialiser un solde"""
     user_id: str
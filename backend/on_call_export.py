@@ -0,0 +1,208 @@
+"""
+Astreintes - Export mensuel pour l'entreprise de sécurité
+MOZAIK RH - Planning réel en CSV ou XLSX
+
+Les astreintes du mois sont lues par plage d'index sur `date` (cache par
+mois d'api_on_call, invalidé à chaque écriture), les numéros de téléphone
+en une requête `$in` sur `users`. Les jours consécutifs d'un même employé
+et d'un même type sont regroupés en une période.
+
+Le fichier est un artefact adressé par son contenu : la clé SHA-256 couvre
+le mois, les lignes exportées et le format. Tant que le planning du mois
+ne change pas (version du mois d'api_on_call), le fichier est resservi sans
+aucune requête ; une nouvelle version remplace les fichiers précédents du
+mois, supprimés seulement après STALE_GRACE_SECONDS sans être servis (un
+téléchargement en cours n'est pas coupé).
+"""
+
+import asyncio
+import csv
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from api_on_call import CACHE_TTL_SECONDS, get_month_schedules, month_version
+
+logger = logging.getLogger(__name__)
+
+# À incrémenter quand le format du fichier généré change (invalide le cache)
+EXPORT_FORMAT_VERSION = 1
+
+MEDIA_TYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+}
+
+# Colonnes du fichier → clé de la ligne exportée
+COLUMNS = [
+    ("Début", "startDate"),
+    ("Fin", "endDate"),
+    ("Employé", "employeeName"),
+    ("Téléphone", "employeePhone"),
+    ("Contact d'urgence", "emergencyContact"),
+    ("Type", "type"),
+    ("Notes", "notes")
+]
+
+DEFAULT_CACHE_DIR = Path(__file__).parent / "out" / "on_call_exports"
+
+# Délai avant suppression d'une version précédente (date du dernier service)
+STALE_GRACE_SECONDS = 600
+
+
+def mark_served(path: Path) -> bool:
+    """Date de dernier service d'un export (mtime) ; False si le fichier a été supprimé"""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def group_periods(schedules: List[Dict], phones: Dict[str, str]) -> List[Dict]:
+    """Regroupe les jours consécutifs d'un employé (même type, mêmes notes) en périodes"""
+    periods = []
+    current = None
+    for schedule in sorted(schedules, key=lambda s: (s.get("employee_id"), s.get("type"), s.get("date"))):
+        day = date.fromisoformat(schedule["date"])
+        if (current and current["employee_id"] == schedule.get("employee_id")
+                and current["type"] == schedule.get("type")
+                and current["notes"] == (schedule.get("notes") or "")
+                and current["end"] + timedelta(days=1) == day):
+            current["end"] = day
+            continue
+        current = {
+            "employee_id": schedule.get("employee_id"),
+            "employee_name": schedule.get("employee_name", ""),
+            "type": schedule.get("type"),
+            "notes": schedule.get("notes") or "",
+            "start": day,
+            "end": day
+        }
+        periods.append(current)
+
+    return [{
+        "startDate": period["start"].isoformat(),
+        "endDate": period["end"].isoformat(),
+        "employeeName": period["employee_name"],
+        "employeePhone": phones.get(period["employee_id"], ""),
+        "emergencyContact": "",
+        "type": period["type"],
+        "notes": period["notes"]
+    } for period in sorted(periods, key=lambda p: (p["start"], p["employee_name"]))]
+
+
+def write_export(rows: List[Dict], output_path: str, output_format: str, title: str):
+    """Écrit le fichier ligne par ligne (CSV, ou classeur openpyxl en écriture seule)"""
+    if output_format == 'csv':
+        # BOM UTF-8 : accents lisibles à l'ouverture dans Excel
+        with open(output_path, 'w', newline='', encoding='utf-8-sig') as handle:
+            writer = csv.writer(handle, delimiter=';')
+            writer.writerow([label for label, _ in COLUMNS])
+            for row in rows:
+                writer.writerow([row[key] for _, key in COLUMNS])
+        return
+
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=title)
+    sheet.append([label for label, _ in COLUMNS])
+    for row in rows:
+        sheet.append([row[key] for _, key in COLUMNS])
+    workbook.save(output_path)
+
+
+class OnCallExportService:
+    """Export mensuel des astreintes et cache des fichiers générés"""
+
+    def __init__(self, db, cache_dir: Optional[Path] = None):
+        self.db = db
+        self.cache_dir = Path(cache_dir or os.environ.get("ON_CALL_EXPORT_DIR", DEFAULT_CACHE_DIR))
+        # (année, mois, format) → (version du mois, horodatage, fichier)
+        self._served: Dict[tuple, tuple] = {}
+
+    async def rows(self, year: int, month: int) -> List[Dict]:
+        """Périodes d'astreinte du mois avec le téléphone de chaque employé"""
+        schedules = await get_month_schedules(self.db, year, month)
+        employee_ids = sorted({s["employee_id"] for s in schedules if s.get("employee_id")})
+        users = await self.db.users.find(
+            {"id": {"$in": employee_ids}}, {"_id": 0, "id": 1, "phone": 1, "telephone": 1}
+        ).to_list(length=None)
+        phones = {user["id"]: user.get("phone") or user.get("telephone") or "" for user in users}
+        return group_periods(schedules, phones)
+
+    @staticmethod
+    def cache_key(year: int, month: int, rows: List[Dict], output_format: str) -> str:
+        """Empreinte SHA-256 de l'export (mois + lignes + format)"""
+        digest = hashlib.sha256()
+        digest.update(json.dumps({
+            "period": f"{year:04d}-{month:02d}",
+            "output_format": output_format,
+            "format": EXPORT_FORMAT_VERSION,
+            "rows": rows
+        }, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    async def get_or_generate(self, year: int, month: int, output_format: str = 'csv') -> Tuple[Path, bool]:
+        """
+        Retourne le fichier d'export du mois, généré seulement si le planning a changé
+
+        Returns:
+            (chemin du fichier, True si servi depuis le cache)
+
+        Raises:
+            ValueError: format non supporté
+        """
+        if output_format not in MEDIA_TYPES:
+            raise ValueError(f"Format non supporté: {output_format} ({', '.join(MEDIA_TYPES)})")
+
+        served_key = (year, month, output_format)
+        version = await month_version(self.db, year, month)
+        served = self._served.get(served_key)
+        if (served and served[0] == version and time.monotonic() - served[1] < CACHE_TTL_SECONDS
+                and mark_served(served[2])):
+            return served[2], True
+
+        rows = await self.rows(year, month)
+        prefix = f"astreintes_{year:04d}_{month:02d}_"
+        key = self.cache_key(year, month, rows, output_format)
+        artifact = self.cache_dir / f"{prefix}{key[:16]}.{output_format}"
+        if mark_served(artifact):
+            logger.info(f"📦 Export astreintes {month:02d}/{year} servi depuis le cache ({key[:12]})")
+            self._served[served_key] = (version, time.monotonic(), artifact)
+            return artifact, True
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # Fichier temporaire unique puis renommage atomique : pas d'écrasement concurrent
+        tmp_path = self.cache_dir / f"{prefix}{uuid.uuid4().hex}.tmp.{output_format}"
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(
+                None, write_export, rows, str(tmp_path), output_format, f"Astreintes {month:02d}-{year}"
+            )
+            os.replace(tmp_path, artifact)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+        # Versions précédentes du mois : supprimées une fois le délai de grâce écoulé
+        now = time.time()
+        for stale in self.cache_dir.glob(f"{prefix}*.{output_format}"):
+            if stale == artifact or ".tmp." in stale.name:
+                continue
+            try:
+                if now - stale.stat().st_mtime > STALE_GRACE_SECONDS:
+                    stale.unlink(missing_ok=True)
+            except FileNotFoundError:
+                continue
+
+        self._served[served_key] = (version, time.monotonic(), artifact)
+        logger.info(f"📊 Export astreintes {month:02d}/{year} généré ({len(rows)} périodes, clé {key[:12]})")
+        return artifact, False
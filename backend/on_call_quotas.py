@@ -0,0 +1,204 @@
+"""
+Astreintes - Contrôle des quotas annuels CCN66
+MOZAIK RH - Validation d'une astreinte ou d'un planning mensuel complet
+
+Les jours d'astreinte déjà planifiés sont lus dans `on_call_schedules`
+(un document par employé et par jour, date YYYY-MM-DD) : une seule
+agrégation `$group` par (employé, année), sur une plage de l'index
+(employee_id, date), quel que soit le nombre d'employés contrôlés. Les
+jours proposés qui figurent déjà au planning ne sont pas comptés deux fois.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Jours d'astreinte maximum par an et par catégorie (CCN66)
+CCN66_ON_CALL_LIMITS = {
+    "management": 60,
+    "administrative": 45,
+    "specialized_educators": 50,
+    "technical_educators": 50
+}
+
+# Catégorie appliquée quand le service de l'employé n'en est pas une
+DEFAULT_CATEGORY = "administrative"
+
+# Seuil d'alerte (part de la limite annuelle)
+WARNING_RATIO = 0.9
+
+USER_PROJECTION = {"_id": 0, "id": 1, "name": 1, "department": 1}
+
+
+def employee_category(user: Dict) -> str:
+    """Catégorie d'astreinte d'un employé (déduite de son service)"""
+    return (user.get("department") or DEFAULT_CATEGORY).lower().replace(" ", "_")
+
+
+def category_limit(category: str) -> int:
+    """Limite annuelle CCN66 d'une catégorie"""
+    return CCN66_ON_CALL_LIMITS.get(category, CCN66_ON_CALL_LIMITS[DEFAULT_CATEGORY])
+
+
+def parse_day(value: str) -> date:
+    """Date YYYY-MM-DD ou ISO datetime (ValueError si illisible)"""
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00")).date()
+
+
+def expand_days(start: str, end: str) -> List[date]:
+    """Jours d'une période (bornes incluses)"""
+    first, last = parse_day(start), parse_day(end)
+    if last < first:
+        raise ValueError(f"Période invalide: {start} > {end}")
+    return [first + timedelta(days=offset) for offset in range((last - first).days + 1)]
+
+
+def build_yearly_days_pipeline(employee_ids: List[str], years: Iterable[int]) -> List[Dict]:
+    """Jours d'astreinte planifiés par (employé, année)"""
+    years = sorted(set(years))
+    return [
+        {"$match": {
+            "employee_id": {"$in": employee_ids},
+            "date": {"$gte": f"{years[0]:04d}-01-01", "$lt": f"{years[-1] + 1:04d}-01-01"}
+        }},
+        {"$group": {
+            "_id": {"employee_id": "$employee_id", "year": {"$substr": ["$date", 0, 4]}},
+            "days": {"$sum": 1}
+        }}
+    ]
+
+
+class OnCallQuotaService:
+    """Quotas annuels d'astreinte (lecture seule)"""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def yearly_days(self, employee_ids: List[str], years: Iterable[int]) -> Dict[Tuple[str, int], int]:
+        """
+        Jours déjà planifiés, en une agrégation
+
+        Returns:
+            {(employee_id, année): jours}
+        """
+        if not employee_ids:
+            return {}
+        totals = {}
+        async for row in self.db.on_call_schedules.aggregate(build_yearly_days_pipeline(employee_ids, years)):
+            totals[(row["_id"]["employee_id"], int(row["_id"]["year"]))] = row["days"]
+        return totals
+
+    async def quotas(self, employee_ids: List[str], year: int) -> Dict[str, Dict]:
+        """
+        Quota de l'année pour chaque employé connu
+
+        Returns:
+            {employee_id: {"name", "category", "maxDays", "currentDays"}}
+        """
+        users = await self.db.users.find({"id": {"$in": employee_ids}}, USER_PROJECTION).to_list(length=None)
+        current = await self.yearly_days([user["id"] for user in users], [year])
+        result = {}
+        for user in users:
+            category = employee_category(user)
+            result[user["id"]] = {
+                "name": user.get("name"),
+                "category": category,
+                "maxDays": category_limit(category),
+                "currentDays": current.get((user["id"], year), 0)
+            }
+        return result
+
+    async def _scheduled_days(self, proposed: Dict[str, Set[date]]) -> Set[Tuple[str, str]]:
+        """(employé, jour) proposés qui figurent déjà au planning"""
+        days = [day for employee_days in proposed.values() for day in employee_days]
+        if not days:
+            return set()
+        existing = await self.db.on_call_schedules.find(
+            {"employee_id": {"$in": list(proposed)},
+             "date": {"$gte": min(days).isoformat(), "$lte": max(days).isoformat()}},
+            {"_id": 0, "employee_id": 1, "date": 1}
+        ).to_list(length=None)
+        return {(doc["employee_id"], doc["date"]) for doc in existing}
+
+    async def validate(self, assignments: List[Dict]) -> Dict:
+        """
+        Contrôle des limites CCN66 pour un ensemble d'astreintes proposées
+
+        Args:
+            assignments: [{"employeeId", "startDate", "endDate"}]
+
+        Returns:
+            {"isValid", "errors", "warnings", "employees": [{"employeeId",
+             "isValid", "errors", "warnings", "stats"}]}
+
+        Raises:
+            ValueError: date illisible ou période inversée
+        """
+        proposed: Dict[str, Set[date]] = defaultdict(set)
+        for assignment in assignments:
+            proposed[assignment["employeeId"]].update(expand_days(assignment["startDate"], assignment["endDate"]))
+
+        employee_ids = list(proposed)
+        years = {day.year for days in proposed.values() for day in days}
+        users = await self.db.users.find({"id": {"$in": employee_ids}}, USER_PROJECTION).to_list(length=None)
+        users = {user["id"]: user for user in users}
+        current = await self.yearly_days(list(users), years) if years else {}
+        scheduled = await self._scheduled_days({eid: days for eid, days in proposed.items() if eid in users})
+
+        employees = []
+        for employee_id, days in proposed.items():
+            user = users.get(employee_id)
+            if not user:
+                employees.append({"employeeId": employee_id, "isValid": False,
+                                  "errors": ["Employé non trouvé"], "warnings": [], "stats": None})
+                continue
+
+            new_days = defaultdict(int)
+            for day in days:
+                if (employee_id, day.isoformat()) not in scheduled:
+                    new_days[day.year] += 1
+            for year in sorted({day.year for day in days}):
+                employees.append(self._check(user, year, current.get((employee_id, year), 0), new_days[year]))
+
+        errors = [error for employee in employees for error in employee["errors"]]
+        warnings = [warning for employee in employees for warning in employee["warnings"]]
+        return {"isValid": not errors, "errors": errors, "warnings": warnings, "employees": employees}
+
+    @staticmethod
+    def _check(user: Dict, year: int, current_days: int, new_days: int) -> Dict:
+        """Limite annuelle d'un employé après ajout des jours proposés"""
+        category = employee_category(user)
+        max_days = category_limit(category)
+        total_after = current_days + new_days
+        errors, warnings = [], []
+
+        if total_after > max_days:
+            errors.append(
+                f"⚠️ LIMITE CCN66 DÉPASSÉE: {user['name']} dépasserait sa limite annuelle {year} "
+                f"({max_days} jours max, actuellement {current_days} + {new_days} = {total_after})"
+            )
+        elif total_after > max_days * WARNING_RATIO:
+            warnings.append(
+                f"⚡ ATTENTION: {user['name']} s'approche de sa limite annuelle {year} "
+                f"({round((total_after / max_days) * 100)}%)"
+            )
+
+        return {
+            "employeeId": user["id"],
+            "isValid": not errors,
+            "errors": errors,
+            "warnings": warnings,
+            "stats": {
+                "employeeName": user["name"],
+                "category": category,
+                "year": year,
+                "currentDays": current_days,
+                "newDays": new_days,
+                "totalAfter": total_after,
+                "maxDays": max_days,
+                "percentageUsed": round((total_after / max_days) * 100, 1)
+            }
+        }
@@ -0,0 +1,357 @@
+"""
+Astreintes - Génération automatique du planning mensuel
+MOZAIK RH - Affectation gloutonne puis recherche locale
+
+Le mois est découpé en créneaux : semaines dimanche → samedi (comme la
+saisie « Astreinte semaine » du planning) ou jours isolés. Les jours déjà
+couverts par une astreinte sont laissés tels quels.
+
+Contraintes : un employé n'est jamais affecté pendant une absence approuvée
+ni au-delà de son quota annuel CCN66 (voir on_call_quotas). Objectif :
+répartir la charge de l'année proportionnellement aux poids d'équité
+(coût Σ charge² / poids) en évitant deux créneaux consécutifs pour le même
+employé. Le résultat est déterministe pour une graine donnée.
+"""
+
+import logging
+import random
+import time
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Sequence, Set
+
+from absenteeism_engine import absence_span, build_start_years_filter
+from api_on_call import OnCallScheduleCreate, insert_schedules, month_range
+from on_call_quotas import OnCallQuotaService
+
+logger = logging.getLogger(__name__)
+
+# Mode de découpage → type d'astreinte enregistré
+MODES = {"week": "Astreinte semaine", "day": "Astreinte jour"}
+
+# Itérations de recherche locale par défaut
+DEFAULT_ITERATIONS = 2000
+
+# Pénalité de deux créneaux consécutifs confiés au même employé
+CONSECUTIVE_PENALTY = 50.0
+
+GENERATED_NOTE = "Planning généré"
+
+
+def month_days(year: int, month: int) -> List[date]:
+    """Jours calendaires d'un mois"""
+    first = date(year, month, 1)
+    following = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return [first + timedelta(days=offset) for offset in range((following - first).days)]
+
+
+def build_slots(year: int, month: int, mode: str = "week", covered: Optional[Set[date]] = None) -> List[List[date]]:
+    """
+    Créneaux à pourvoir, dans l'ordre chronologique
+
+    En mode "week", une semaine dimanche → samedi tronquée aux bornes du mois ;
+    les jours de `covered` (déjà planifiés) sont retirés.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Mode must be one of {list(MODES)}")
+    covered = covered or set()
+
+    slots, current = [], []
+    for day in month_days(year, month):
+        # isoweekday : dimanche = 7, début d'une nouvelle semaine d'astreinte
+        if current and (mode == "day" or day.isoweekday() == 7):
+            slots.append(current)
+            current = []
+        if day not in covered:
+            current.append(day)
+        elif current:
+            slots.append(current)
+            current = []
+    if current:
+        slots.append(current)
+    return slots
+
+
+class RotaSolver:
+    """
+    Affectation des créneaux d'astreinte (glouton puis recherche locale)
+
+    employees : [{"id", "load" (jours déjà faits dans l'année), "remaining"
+    (jours restants au quota), "weight" (poids d'équité > 0), "unavailable"
+    (jours d'absence)}]
+    """
+
+    def __init__(self, slots: Sequence[List[date]], employees: Sequence[Dict], seed: int = 0,
+                 iterations: int = DEFAULT_ITERATIONS, consecutive_penalty: float = CONSECUTIVE_PENALTY):
+        self.slots = list(slots)
+        self.employees = list(employees)
+        self.rng = random.Random(seed)
+        self.iterations = iterations
+        self.penalty = consecutive_penalty
+
+        # Créneau i et i + 1 contigus (le lendemain)
+        self.contiguous = [
+            self.slots[i + 1][0] - self.slots[i][-1] == timedelta(days=1)
+            for i in range(len(self.slots) - 1)
+        ]
+        # Employés disponibles pour chaque créneau (aucune absence sur ses jours)
+        self.candidates = [
+            [e for e, employee in enumerate(self.employees)
+             if not employee.get("unavailable") or not any(day in employee["unavailable"] for day in slot)]
+            for slot in self.slots
+        ]
+        self.available = [set(candidates) for candidates in self.candidates]
+
+        self.assignment: List[Optional[int]] = [None] * len(self.slots)
+        self.load = [float(employee.get("load", 0)) for employee in self.employees]
+        self.used = [0] * len(self.employees)
+
+    # ------------------------------------------------------------------
+    # Coût
+    # ------------------------------------------------------------------
+
+    def _load_cost(self, e: int, load: float) -> float:
+        return load * load / self.employees[e]["weight"]
+
+    def _fits(self, e: int, extra_days: int) -> bool:
+        return self.used[e] + extra_days <= self.employees[e]["remaining"]
+
+    def _edges(self, *indexes: int) -> Set[int]:
+        """Paires contiguës (i, i + 1) touchant les créneaux donnés"""
+        edges = set()
+        for i in indexes:
+            for edge in (i - 1, i):
+                if 0 <= edge < len(self.contiguous) and self.contiguous[edge]:
+                    edges.add(edge)
+        return edges
+
+    def _penalty(self, edges: Set[int]) -> float:
+        return self.penalty * sum(
+            1 for i in edges
+            if self.assignment[i] is not None and self.assignment[i] == self.assignment[i + 1]
+        )
+
+    def cost(self) -> float:
+        """Coût total : équité de la charge annuelle + créneaux consécutifs"""
+        fairness = sum(self._load_cost(e, load) for e, load in enumerate(self.load))
+        return fairness + self._penalty(set(range(len(self.contiguous))))
+
+    def _assign(self, s: int, e: Optional[int]):
+        previous = self.assignment[s]
+        days = len(self.slots[s])
+        if previous is not None:
+            self.load[previous] -= days
+            self.used[previous] -= days
+        if e is not None:
+            self.load[e] += days
+            self.used[e] += days
+        self.assignment[s] = e
+
+    # ------------------------------------------------------------------
+    # Résolution
+    # ------------------------------------------------------------------
+
+    def _greedy(self):
+        """Créneaux les plus contraints d'abord, employé de moindre surcoût"""
+        order = sorted(range(len(self.slots)), key=lambda s: (len(self.candidates[s]), s))
+        for s in order:
+            days = len(self.slots[s])
+            best, best_key = None, None
+            for e in self.candidates[s]:
+                if not self._fits(e, days):
+                    continue
+                delta = self._load_cost(e, self.load[e] + days) - self._load_cost(e, self.load[e])
+                delta += self.penalty * sum(
+                    1 for neighbour in (s - 1, s + 1)
+                    if 0 <= neighbour < len(self.slots) and self.assignment[neighbour] == e
+                    and self.contiguous[min(s, neighbour)]
+                )
+                key = (delta, self.rng.random())
+                if best_key is None or key < best_key:
+                    best, best_key = e, key
+            if best is not None:
+                self._assign(s, best)
+
+    def _try(self, changes: Dict[int, Optional[int]]) -> bool:
+        """Applique des réaffectations si elles respectent les quotas et baissent le coût"""
+        touched = {e for e in changes.values() if e is not None}
+        touched |= {self.assignment[s] for s in changes if self.assignment[s] is not None}
+        edges = self._edges(*changes)
+        before = sum(self._load_cost(e, self.load[e]) for e in touched) + self._penalty(edges)
+        unfilled_before = sum(1 for s in changes if self.assignment[s] is None)
+
+        previous = {s: self.assignment[s] for s in changes}
+        for s, e in changes.items():
+            self._assign(s, e)
+
+        feasible = all(self.used[e] <= self.employees[e]["remaining"] for e in touched)
+        after = sum(self._load_cost(e, self.load[e]) for e in touched) + self._penalty(edges)
+        unfilled_after = sum(1 for s in changes if self.assignment[s] is None)
+
+        if feasible and (unfilled_after, after) < (unfilled_before, before - 1e-9):
+            return True
+        for s, e in previous.items():
+            self._assign(s, e)
+        return False
+
+    def _local_search(self) -> int:
+        """Déplacements (un créneau change d'employé) et échanges entre deux créneaux"""
+        improvements = 0
+        if not self.slots:
+            return improvements
+        for _ in range(self.iterations):
+            s = self.rng.randrange(len(self.slots))
+            if not self.candidates[s]:
+                continue
+            if self.assignment[s] is None or self.rng.random() < 0.5:
+                e = self.rng.choice(self.candidates[s])
+                if e != self.assignment[s] and self._try({s: e}):
+                    improvements += 1
+            else:
+                t = self.rng.randrange(len(self.slots))
+                a, b = self.assignment[s], self.assignment[t]
+                if s == t or b is None or a == b or a not in self.available[t] or b not in self.available[s]:
+                    continue
+                if self._try({s: b, t: a}):
+                    improvements += 1
+        return improvements
+
+    def solve(self) -> Dict:
+        """
+        Returns:
+            {"assignment": [index employé ou None par créneau], "cost", "greedy_cost",
+             "improvements", "unassigned"}
+        """
+        self._greedy()
+        greedy_cost = self.cost()
+        improvements = self._local_search()
+        return {
+            "assignment": list(self.assignment),
+            "cost": round(self.cost(), 2),
+            "greedy_cost": round(greedy_cost, 2),
+            "improvements": improvements,
+            "unassigned": sum(1 for e in self.assignment if e is None)
+        }
+
+
+class OnCallRotaService:
+    """Génération et enregistrement d'un planning d'astreintes mensuel"""
+
+    def __init__(self, db):
+        self.db = db
+        self.quotas = OnCallQuotaService(db)
+
+    async def _unavailable_days(self, employee_ids: List[str], year: int, month: int) -> Dict[str, Set[date]]:
+        """
+        Jours d'absence approuvée de chaque employé dans le mois
+
+        Seules les absences commencées depuis le 1er janvier de l'année
+        précédente (arrêts longs inclus, voir absenteeism_engine.LOOKBACK_YEARS)
+        sont lues, pas tout l'historique des employés.
+        """
+        days = month_days(year, month)
+        first, last = days[0], days[-1]
+        unavailable: Dict[str, Set[date]] = {}
+        cursor = self.db.absences.find(
+            {"employee_id": {"$in": employee_ids}, "status": "approved",
+             **build_start_years_filter(first, last)},
+            {"_id": 0, "employee_id": 1, "date_debut": 1, "date_fin": 1, "jours_absence": 1}
+        )
+        async for absence in cursor:
+            span = absence_span(absence)
+            if not span or span[1] < first or span[0] > last:
+                continue
+            start, end = max(span[0], first), min(span[1], last)
+            unavailable.setdefault(absence["employee_id"], set()).update(
+                start + timedelta(days=offset) for offset in range((end - start).days + 1)
+            )
+        return unavailable
+
+    async def generate(self, year: int, month: int, mode: str = "week", weights: Optional[Dict[str, float]] = None,
+                       seed: int = 0, employee_ids: Optional[List[str]] = None,
+                       iterations: int = DEFAULT_ITERATIONS) -> Dict:
+        """
+        Planning proposé pour le mois (aucune écriture)
+
+        Args:
+            weights: poids d'équité par employé (1 par défaut, 0 = exclu)
+            employee_ids: restreint les employés éligibles (tous les actifs par défaut)
+
+        Returns:
+            {"year", "month", "mode", "seed", "schedules": [...], "unassigned": [dates],
+             "stats": {...}}
+        """
+        if mode not in MODES:
+            raise ValueError(f"Mode must be one of {list(MODES)}")
+        if not 1 <= month <= 12:
+            raise ValueError("Month must be between 1 and 12")
+        started = time.perf_counter()
+        weights = weights or {}
+
+        # Employés éligibles : mêmes critères que /on-call/employees
+        query = {"is_active": True}
+        if employee_ids:
+            query["id"] = {"$in": employee_ids}
+        users = await self.db.users.find(query, {"_id": 0, "id": 1, "name": 1}).to_list(length=None)
+        users = [user for user in users if weights.get(user["id"], 1.0) > 0]
+        ids = [user["id"] for user in users]
+
+        quotas = await self.quotas.quotas(ids, year) if ids else {}
+        unavailable = await self._unavailable_days(ids, year, month) if ids else {}
+        scheduled = await self.db.on_call_schedules.find(
+            {"date": month_range(year, month)}, {"_id": 0, "date": 1}
+        ).to_list(length=None)
+        covered = {date.fromisoformat(doc["date"]) for doc in scheduled}
+
+        employees = []
+        for user in users:
+            quota = quotas.get(user["id"], {})
+            employees.append({
+                "id": user["id"],
+                "name": user.get("name") or quota.get("name"),
+                "load": quota.get("currentDays", 0),
+                "remaining": max(quota.get("maxDays", 0) - quota.get("currentDays", 0), 0),
+                "weight": float(weights.get(user["id"], 1.0)),
+                "unavailable": unavailable.get(user["id"], set())
+            })
+
+        slots = build_slots(year, month, mode, covered)
+        solver = RotaSolver(slots, employees, seed=seed, iterations=iterations)
+        solution = solver.solve()
+
+        schedules, unassigned = [], []
+        for slot, e in zip(slots, solution["assignment"]):
+            if e is None:
+                unassigned.extend(day.isoformat() for day in slot)
+                continue
+            schedules.extend({
+                "employee_id": employees[e]["id"],
+                "employee_name": employees[e]["name"],
+                "date": day.isoformat(),
+                "type": MODES[mode],
+                "notes": GENERATED_NOTE
+            } for day in slot)
+
+        elapsed = time.perf_counter() - started
+        logger.info(f"🗓️ Planning astreintes {month:02d}/{year} généré: {len(schedules)} jours, "
+                    f"{len(unassigned)} non pourvus, {elapsed:.2f}s")
+        return {
+            "year": year,
+            "month": month,
+            "mode": mode,
+            "seed": seed,
+            "schedules": schedules,
+            "unassigned": unassigned,
+            "stats": {
+                "employees": len(employees),
+                "slots": len(slots),
+                "alreadyScheduledDays": len(covered),
+                "cost": solution["cost"],
+                "greedyCost": solution["greedy_cost"],
+                "improvements": solution["improvements"],
+                "elapsedMs": round(elapsed * 1000, 1)
+            }
+        }
+
+    async def apply(self, schedules: List[Dict], created_by: str) -> List[Dict]:
+        """Enregistre un planning généré par le chemin de création en lot"""
+        return await insert_schedules(self.db, [OnCallScheduleCreate(**schedule) for schedule in schedules], created_by)
@@ -0,0 +1,446 @@
+"""
+Grand livre des heures supplémentaires - Mouvements et rollups mensuels
+MOZAIK RH - Accumulation, récupération (REC) et validation managériale
+
+Les mouvements restent dans `overtime` (un document par mouvement, `id`
+unique) et portent leur mois (`period`, YYYY-MM). Les heures importées
+(`work_hours`, une ligne par employé et par jour) comptent comme heures
+accumulées pré-validées.
+
+`overtime_rollups` contient, par employé, un document par mois et un
+document de cumul (`period` = "total") :
+
+- accumulated : heures accumulées saisies (`overtime`, type "accumulated")
+- imported    : heures importées (`work_hours`)
+- recovered   : heures récupérées (REC approuvés)
+- unvalidated : heures accumulées en attente de validation managériale
+
+Chaque accumulation, récupération ou validation applique un `$inc` sur le
+mois et sur le cumul ; un import (ou une suppression) d'heures réécrit la
+part importée (valeurs absolues) des seuls employés concernés. Le solde d'un employé se lit
+dans un seul document ; `rebuild()` recalcule tout depuis l'historique.
+
+Une écriture de rollup en échec marque les rollups périmés dans MongoDB
+(materialized_state) : ils sont recalculés avant la lecture suivante (solde,
+contrôle d'un REC, synthèse), dans n'importe quel processus.
+"""
+
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateMany, UpdateOne
+
+from db_indexes import replace_collection
+import materialized_state
+
+logger = logging.getLogger(__name__)
+
+# Compteurs d'un document de rollup
+COUNTERS = ("accumulated", "imported", "recovered", "unvalidated")
+
+# Période du document de cumul d'un employé
+TOTAL_PERIOD = "total"
+
+# Nom de la vue dans `materialized_state`
+STATE_NAME = "overtime_rollups"
+
+
+def period_of(value) -> Optional[str]:
+    """Mois YYYY-MM d'une date (YYYY-MM-DD, ISO complet ou DD/MM/YYYY ; None si illisible)"""
+    text = str(value or "")
+    for fmt, length in (("%Y-%m-%d", 10), ("%d/%m/%Y", 10)):
+        try:
+            return datetime.strptime(text[:length], fmt).strftime("%Y-%m")
+        except ValueError:
+            continue
+    return None
+
+
+def period_expression(field: str) -> Dict:
+    """Mois YYYY-MM calculé côté serveur d'un champ date (YYYY-MM-DD ou DD/MM/YYYY)"""
+    return {"$cond": [
+        {"$eq": [{"$substr": [field, 4, 1]}, "-"]},
+        {"$substr": [field, 0, 7]},
+        {"$concat": [{"$substr": [field, 6, 4]}, "-", {"$substr": [field, 3, 2]}]}
+    ]}
+
+
+def movement_deltas(record_type: Optional[str], hours: float, validated: bool) -> Dict[str, float]:
+    """Compteurs modifiés par un mouvement `overtime`"""
+    record_type = record_type or "accumulated"
+    if record_type == "accumulated":
+        return {"accumulated": hours, "unvalidated": 0.0 if validated else hours}
+    if record_type == "recovered":
+        return {"recovered": hours}
+    return {}
+
+
+class OvertimeLedger:
+    """Mouvements d'heures supplémentaires et rollups par employé"""
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = db.overtime_rollups
+        # Un seul recalcul à la fois dans ce processus
+        self._rebuild_lock = asyncio.Lock()
+
+    # ========================================================================
+    # MOUVEMENTS
+    # ========================================================================
+
+    async def accumulate(self, employee: Dict, date: str, hours: float, reason: str = "",
+                         validated: bool = False, created_by: Optional[str] = None) -> Dict:
+        """Enregistre des heures accumulées (en attente de validation sauf si `validated`)"""
+        return await self._record(employee, {
+            "date": date,
+            "hours": hours,
+            "type": "accumulated",
+            "reason": reason,
+            "validated": validated,
+            "created_by": created_by
+        })
+
+    async def recover(self, employee: Dict, date: str, hours: float, reason: str,
+                      validated_by: Optional[str] = None, validated_at: Optional[str] = None) -> Dict:
+        """Enregistre une récupération (REC approuvé) : déduite du solde"""
+        return await self._record(employee, {
+            "date": date,
+            "hours": hours,
+            "type": "recovered",
+            "reason": reason,
+            "validated": True,
+            "validated_by": validated_by,
+            "validated_at": validated_at
+        })
+
+    async def _record(self, employee: Dict, movement: Dict) -> Dict:
+        now = datetime.now(timezone.utc).isoformat()
+        entry = {
+            "id": str(uuid.uuid4()),
+            "employee_id": employee.get("id") or "unknown",
+            "employee_name": employee.get("name"),
+            "department": employee.get("department") or "N/A",
+            "period": period_of(movement.get("date")),
+            **movement,
+            "created_at": movement.get("validated_at") or now
+        }
+        await self.db.overtime.insert_one(entry)
+        entry.pop("_id", None)
+
+        await self._write({
+            (entry["employee_id"], entry["period"]): movement_deltas(entry["type"], entry["hours"], entry["validated"])
+        }, {entry["employee_id"]: entry})
+        return entry
+
+    async def validate(self, employee_id: str, date: str, validator: Dict) -> Dict:
+        """
+        Valide les heures accumulées d'un employé pour une date
+
+        Chaque mouvement est basculé individuellement (find_one_and_update sur
+        validated=False) : une double validation concurrente ne décompte pas
+        deux fois les heures.
+
+        Returns:
+            {"records": int, "hours": float, "work_hours": int}
+        """
+        stamp = {
+            "validated": True,
+            "validated_by": validator.get("id"),
+            "validated_by_name": validator.get("name"),
+            "validated_at": datetime.now(timezone.utc).isoformat()
+        }
+
+        deltas: Dict[Tuple, Dict[str, float]] = {}
+        records, hours = 0, 0.0
+        while True:
+            entry = await self.db.overtime.find_one_and_update(
+                {"employee_id": employee_id, "date": date, "type": "accumulated", "validated": False},
+                {"$set": stamp},
+                projection={"_id": 0, "hours": 1, "period": 1, "date": 1}
+            )
+            if entry is None:
+                break
+            records += 1
+            hours += entry.get("hours", 0)
+            key = (employee_id, entry.get("period") or period_of(entry.get("date")))
+            totals = deltas.setdefault(key, {"unvalidated": 0.0})
+            totals["unvalidated"] -= entry.get("hours", 0)
+
+        # Heures importées : pré-validées, seul le marquage est mis à jour
+        work_hours = await self.db.work_hours.update_many(
+            {"employee_id": employee_id, "date": date},
+            {"$set": stamp}
+        )
+
+        await self._write(deltas)
+        return {"records": records, "hours": hours, "work_hours": work_hours.modified_count}
+
+    async def refresh_imported(self, employee_ids: Iterable[str]) -> int:
+        """
+        Recalcule la part importée (`work_hours`) des employés donnés
+
+        Appelé après un import ou une suppression d'heures : les valeurs
+        absolues issues de l'agrégation sont écrites (`$set`) sur chaque mois
+        et sur le cumul, les mois sans heure importée sont remis à zéro. Deux
+        rafraîchissements concurrents écrivent ainsi des valeurs complètes,
+        sans cumuler d'écarts.
+        """
+        ids = sorted({i for i in employee_ids if i})
+        if not ids:
+            return 0
+
+        try:
+            imported = await self._imported_hours({"employee_id": {"$in": ids}})
+            now = datetime.utcnow().isoformat()
+
+            totals = {employee_id: 0.0 for employee_id in ids}
+            periods = {employee_id: [] for employee_id in ids}
+            names: Dict[str, str] = {}
+            operations = []
+            for (employee_id, period), row in imported.items():
+                totals[employee_id] += row["imported"]
+                if row["employee_name"]:
+                    names.setdefault(employee_id, row["employee_name"])
+                if period:
+                    periods[employee_id].append(period)
+                    operations.append(UpdateOne(
+                        {"employee_id": employee_id, "period": period},
+                        {"$set": self._imported_set(round(row["imported"], 4), names.get(employee_id), now)},
+                        upsert=True
+                    ))
+
+            for employee_id in ids:
+                # Mois dont toutes les heures importées ont été supprimées
+                operations.append(UpdateMany(
+                    {"employee_id": employee_id, "period": {"$nin": [TOTAL_PERIOD, *periods[employee_id]]},
+                     "imported": {"$ne": 0.0}},
+                    {"$set": {"imported": 0.0, "updated_at": now}}
+                ))
+                operations.append(UpdateOne(
+                    {"employee_id": employee_id, "period": TOTAL_PERIOD},
+                    {"$set": self._imported_set(round(totals[employee_id], 4), names.get(employee_id), now)},
+                    upsert=bool(totals[employee_id])
+                ))
+
+            await self.collection.bulk_write(operations, ordered=False)
+            await materialized_state.mark_stale_if_rebuilding(self.db, STATE_NAME)
+            return len(operations)
+        except Exception as e:
+            logger.error(f"❌ Erreur mise à jour rollups heures importées, recalcul à la prochaine lecture: {str(e)}")
+            await materialized_state.mark_stale(self.db, STATE_NAME)
+            return 0
+
+    @staticmethod
+    def _imported_set(hours: float, employee_name: Optional[str], now: str) -> Dict:
+        fields = {"imported": hours, "updated_at": now}
+        if employee_name:
+            fields["employee_name"] = employee_name
+        return fields
+
+    async def _imported_hours(self, match: Dict) -> Dict[Tuple, Dict]:
+        """Heures importées par (employé, mois), sommées côté serveur"""
+        pipeline = [
+            {"$match": match},
+            {"$group": {
+                "_id": {"employee_id": "$employee_id", "period": period_expression("$date")},
+                "hours": {"$sum": "$heures_travaillees"},
+                "employee_name": {"$first": "$employee_name"}
+            }}
+        ]
+        return {
+            (row["_id"]["employee_id"], row["_id"]["period"]): {
+                "imported": row["hours"] or 0.0, "employee_name": row.get("employee_name")
+            }
+            async for row in self.db.work_hours.aggregate(pipeline)
+        }
+
+    # ========================================================================
+    # ÉCRITURE DES ROLLUPS
+    # ========================================================================
+
+    async def _write(self, deltas: Dict[Tuple, Dict[str, float]], profiles: Optional[Dict] = None) -> int:
+        """
+        Applique des deltas par (employé, mois) au mois et au cumul
+
+        Une erreur ne fait pas échouer l'opération métier (le mouvement est
+        enregistré) : les rollups sont marqués périmés dans MongoDB et
+        recalculés avant la lecture suivante (`ensure_fresh`). Une écriture
+        concurrente d'un recalcul (écrasée par le renommage) les marque aussi
+        périmés.
+        """
+        try:
+            written = await self._write_deltas(deltas, profiles)
+            await materialized_state.mark_stale_if_rebuilding(self.db, STATE_NAME)
+            return written
+        except Exception as e:
+            logger.error(f"❌ Erreur mise à jour rollups heures supplémentaires, recalcul à la prochaine lecture: {str(e)}")
+            await materialized_state.mark_stale(self.db, STATE_NAME)
+            return 0
+
+    async def ensure_fresh(self):
+        """Recalcule les rollups marqués périmés (l'erreur remonte si le recalcul échoue)"""
+        if not await materialized_state.stale_token(self.db, STATE_NAME):
+            return
+        async with self._rebuild_lock:
+            if await materialized_state.stale_token(self.db, STATE_NAME):
+                await self.rebuild()
+
+    @staticmethod
+    def _merge(deltas: Dict[Tuple, Dict[str, float]]) -> Dict[Tuple, Dict[str, float]]:
+        """Chaque mois contribue aussi au document de cumul de l'employé"""
+        merged: Dict[Tuple, Dict[str, float]] = {}
+        for (employee_id, period), fields in deltas.items():
+            keys = [(employee_id, TOTAL_PERIOD)] + ([(employee_id, period)] if period else [])
+            for key in keys:
+                totals = merged.setdefault(key, {})
+                for field, value in fields.items():
+                    totals[field] = totals.get(field, 0.0) + value
+        return merged
+
+    async def _write_deltas(self, deltas: Dict[Tuple, Dict[str, float]], profiles: Optional[Dict] = None) -> int:
+        now = datetime.utcnow().isoformat()
+        operations = []
+        for (employee_id, period), fields in self._merge(deltas).items():
+            increments = {field: round(value, 4) for field, value in fields.items() if round(value, 4)}
+            if not increments:
+                continue
+            update = {"$inc": increments, "$set": {"updated_at": now}}
+            profile = (profiles or {}).get(employee_id) or {}
+            for field in ("employee_name", "department"):
+                if profile.get(field):
+                    update["$set"][field] = profile[field]
+            operations.append(UpdateOne({"employee_id": employee_id, "period": period}, update, upsert=True))
+
+        if operations:
+            await self.collection.bulk_write(operations, ordered=False)
+        return len(operations)
+
+    @classmethod
+    def _documents(cls, deltas: Dict[Tuple, Dict[str, float]], profiles: Dict[str, Dict]) -> List[Dict]:
+        """Documents complets d'une reconstruction (mois et cumul, mêmes champs que les upserts)"""
+        now = datetime.utcnow().isoformat()
+        documents = []
+        for (employee_id, period), fields in cls._merge(deltas).items():
+            counters = {field: round(value, 4) for field, value in fields.items() if round(value, 4)}
+            if not counters:
+                continue
+            document = {"employee_id": employee_id, "period": period, **counters, "updated_at": now}
+            profile = profiles.get(employee_id) or {}
+            for field in ("employee_name", "department"):
+                if profile.get(field):
+                    document[field] = profile[field]
+            documents.append(document)
+        return documents
+
+    # ========================================================================
+    # RECONSTRUCTION
+    # ========================================================================
+
+    async def backfill_periods(self) -> int:
+        """Renseigne `period` sur les mouvements qui n'en ont pas (idempotent)"""
+        operations = []
+        async for entry in self.db.overtime.find({"period": {"$exists": False}}, {"_id": 1, "date": 1}):
+            operations.append(UpdateOne({"_id": entry["_id"]}, {"$set": {"period": period_of(entry.get("date"))}}))
+        if operations:
+            await self.db.overtime.bulk_write(operations, ordered=False)
+            logger.info(f"🗓️ Heures supplémentaires : {len(operations)} mouvements rattachés à leur mois")
+        return len(operations)
+
+    async def rebuild(self) -> Dict:
+        """
+        Recalcule entièrement `overtime_rollups` depuis `overtime` et `work_hours`
+
+        Les rollups sont écrits dans une collection temporaire renommée à la
+        place de la collection servie : les lectures concurrentes ne voient
+        jamais de soldes vides. Les rollups redeviennent à jour si aucune
+        écriture n'a échoué ou n'a eu lieu pendant le recalcul.
+
+        Returns:
+            {"movements": int, "rollups": int}
+        """
+        lease = await materialized_state.begin_rebuild(self.db, STATE_NAME)
+        try:
+            result = await self._rebuild()
+        except Exception:
+            await materialized_state.end_rebuild(self.db, STATE_NAME, lease, succeeded=False)
+            raise
+        await materialized_state.end_rebuild(self.db, STATE_NAME, lease)
+        return result
+
+    async def _rebuild(self) -> Dict:
+        await self.backfill_periods()
+
+        deltas: Dict[Tuple, Dict[str, float]] = {}
+        profiles: Dict[str, Dict] = {}
+        movements = 0
+
+        pipeline = [{"$group": {
+            "_id": {
+                "employee_id": "$employee_id",
+                "period": "$period",
+                "type": {"$ifNull": ["$type", "accumulated"]},
+                "validated": {"$ifNull": ["$validated", False]}
+            },
+            "hours": {"$sum": "$hours"},
+            "count": {"$sum": 1},
+            "employee_name": {"$first": "$employee_name"},
+            "department": {"$first": "$department"}
+        }}]
+        async for row in self.db.overtime.aggregate(pipeline):
+            key = row["_id"]
+            movements += row["count"]
+            totals = deltas.setdefault((key["employee_id"], key.get("period")), {})
+            for field, value in movement_deltas(key["type"], row["hours"] or 0.0, key["validated"]).items():
+                totals[field] = totals.get(field, 0.0) + value
+            profiles.setdefault(key["employee_id"], {"employee_name": row.get("employee_name"),
+                                                     "department": row.get("department")})
+
+        for (employee_id, period), row in (await self._imported_hours({})).items():
+            totals = deltas.setdefault((employee_id, period), {})
+            totals["imported"] = totals.get("imported", 0.0) + row["imported"]
+            profiles.setdefault(employee_id, {"employee_name": row["employee_name"]})
+        movements += await self.db.work_hours.count_documents({})
+
+        rollups = await replace_collection(self.db, self.collection.name, self._documents(deltas, profiles))
+        logger.info(f"⏰ Rollups heures supplémentaires reconstruits: {movements} mouvements → {rollups} documents")
+        return {"movements": movements, "rollups": rollups}
+
+    async def has_rollups(self) -> bool:
+        """True si les rollups ont été alimentés"""
+        return await self.collection.find_one({}, {"_id": 1}) is not None
+
+    async def has_history(self) -> bool:
+        """True s'il existe des mouvements ou des heures importées"""
+        for source in (self.db.overtime, self.db.work_hours):
+            if await source.find_one({}, {"_id": 1}):
+                return True
+        return False
+
+    async def rename_employee(self, employee_id: str, new_name: str) -> int:
+        result = await self.collection.update_many(
+            {"employee_id": employee_id}, {"$set": {"employee_name": new_name}}
+        )
+        return result.modified_count
+
+    # ========================================================================
+    # LECTURE
+    # ========================================================================
+
+    async def balance(self, employee_id: str) -> Dict:
+        """Cumul d'un employé (un document) : accumulées, récupérées, solde, en attente"""
+        await self.ensure_fresh()
+        rollup = await self.collection.find_one(
+            {"employee_id": employee_id, "period": TOTAL_PERIOD}, {"_id": 0}
+        ) or {}
+        counters = {field: rollup.get(field, 0.0) for field in COUNTERS}
+        earned = counters["accumulated"] + counters["imported"]
+        return {
+            "employee_id": employee_id,
+            "accumulated": earned,
+            "recovered": counters["recovered"],
+            "balance": earned - counters["recovered"],
+            "unvalidated": counters["unvalidated"]
+        }
@@ -0,0 +1,169 @@
+"""
+Heures supplémentaires - Synthèse par employé et historique paginé
+MOZAIK RH - Accumulées, récupérées, solde et heures du mois
+
+Deux sources alimentent les heures supplémentaires :
+
+- `overtime`   : heures saisies (type "accumulated") et récupérations
+                 validées (type "recovered", créées à l'approbation d'un REC)
+- `work_hours` : heures importées, comptées comme accumulées et pré-validées
+
+La synthèse lit les rollups du grand livre (`overtime_rollups`, voir
+overtime_ledger) en une agrégation : document de cumul et document du mois
+de chaque employé, `$group` par employé puis `$lookup` sur `users`
+(service, catégorie, métier). La mémoire dépend du nombre d'employés, pas
+de l'historique. Le détail des mouvements d'un employé est servi page par
+page depuis les deux sources.
+"""
+
+import heapq
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from ccn66_rules import is_category_a
+from overtime_ledger import TOTAL_PERIOD, OvertimeLedger
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEPARTMENT = "N/A"
+
+# Taille de page maximale du détail des mouvements
+MAX_PAGE_SIZE = 200
+
+# Sources des mouvements affichés dans l'historique
+SOURCES = ("overtime", "work_hours")
+
+# Fiche employé jointe à la synthèse
+USER_FIELDS = ("name", "department", "categorie_employe", "metier")
+
+
+def build_rollup_summary_pipeline(period: str) -> List[Dict]:
+    """Cumul et heures accumulées du mois par employé, depuis les rollups"""
+    def earned(when):
+        return {"$sum": {"$cond": [
+            when, {"$add": [{"$ifNull": ["$accumulated", 0]}, {"$ifNull": ["$imported", 0]}]}, 0
+        ]}}
+
+    is_total = {"$eq": ["$period", TOTAL_PERIOD]}
+    return [
+        {"$match": {"period": {"$in": [TOTAL_PERIOD, period]}}},
+        {"$group": {
+            "_id": "$employee_id",
+            "name": {"$max": "$employee_name"},
+            "department": {"$max": "$department"},
+            "accumulated": earned(is_total),
+            "recovered": {"$sum": {"$cond": [is_total, {"$ifNull": ["$recovered", 0]}, 0]}},
+            "this_month": earned({"$eq": ["$period", period]})
+        }},
+        {"$lookup": {"from": "users", "localField": "_id", "foreignField": "id", "as": "user"}},
+        {"$project": {
+            "name": 1, "department": 1, "accumulated": 1, "recovered": 1, "this_month": 1,
+            "user": {"$arrayElemAt": ["$user", 0]}
+        }},
+        {"$project": {
+            "name": 1, "department": 1, "accumulated": 1, "recovered": 1, "this_month": 1,
+            **{f"user.{field}": 1 for field in USER_FIELDS}
+        }}
+    ]
+
+
+def detail_entry(source: str, record: Dict) -> Dict:
+    """Mouvement affiché dans l'historique d'un employé"""
+    if source == "work_hours":
+        return {
+            "date": record.get("date"),
+            "hours": record.get("heures_travaillees", 0),
+            "type": "accumulated",
+            "reason": "Heures importées",
+            "validated": True  # Imported hours are pre-validated
+        }
+    record_type = record.get("type", "accumulated")
+    hours = record.get("hours", 0)
+    return {
+        "date": record.get("date"),
+        "hours": hours if record_type == "accumulated" else -hours,
+        "type": record_type,
+        "reason": record.get("reason", ""),
+        "validated": record.get("validated", False)
+    }
+
+
+class OvertimeSummaryService:
+    """Synthèse des heures supplémentaires (lecture seule)"""
+
+    def __init__(self, db):
+        self.db = db
+        self.ledger = OvertimeLedger(db)
+
+    async def summaries(self, year: Optional[int] = None, month: Optional[int] = None) -> List[Dict]:
+        """
+        Une ligne par employé : accumulées, récupérées, solde, heures du mois
+
+        Returns:
+            [{"id", "name", "department", "accumulated", "recovered", "balance",
+              "thisMonth", "is_educational_sector", "categorie_employe", "metier"}]
+        """
+        now = datetime.now()
+        period = f"{year or now.year:04d}-{month or now.month:02d}"
+
+        await self.ledger.ensure_fresh()
+        result = []
+        async for row in self.db.overtime_rollups.aggregate(build_rollup_summary_pipeline(period)):
+            user = row.get("user") or {}
+            department = row.get("department")
+            employee = {
+                "id": row["_id"],
+                "name": row.get("name") or user.get("name"),
+                "department": (department if department != DEFAULT_DEPARTMENT else None)
+                              or user.get("department") or DEFAULT_DEPARTMENT,
+                "accumulated": row.get("accumulated") or 0,
+                "recovered": row.get("recovered") or 0,
+                "thisMonth": row.get("this_month") or 0
+            }
+            employee["balance"] = employee["accumulated"] - employee["recovered"]
+            # Validation managériale des heures du secteur éducatif (CCN66 catégorie A)
+            employee["is_educational_sector"] = bool(user) and is_category_a(
+                user.get("categorie_employe"), user.get("metier")
+            )
+            employee["categorie_employe"] = user.get("categorie_employe", "N/A") if user else "N/A"
+            employee["metier"] = user.get("metier", "N/A") if user else "N/A"
+            result.append(employee)
+
+        return result
+
+    async def details(self, employee_id: str, page: int = 1, page_size: int = 50) -> Dict:
+        """
+        Mouvements d'un employé (les deux sources), du plus récent au plus ancien
+
+        Chaque source est lue triée par date et limitée aux `page * page_size`
+        premiers mouvements, puis les deux flux sont fusionnés.
+
+        Returns:
+            {"employee_id", "items", "total", "page", "page_size", "pages"}
+        """
+        page = max(page, 1)
+        page_size = min(max(page_size, 1), MAX_PAGE_SIZE)
+        window = page * page_size
+
+        streams, total = [], 0
+        for source in SOURCES:
+            query = {"employee_id": employee_id}
+            total += await self.db[source].count_documents(query)
+            records = await self.db[source].find(query, {"_id": 0}) \
+                .sort("date", -1) \
+                .limit(window) \
+                .to_list(length=window)
+            streams.append([detail_entry(source, record) for record in records])
+
+        merged = heapq.merge(*streams, key=lambda entry: entry.get("date") or "", reverse=True)
+        items = list(merged)[(page - 1) * page_size:window]
+
+        return {
+            "employee_id": employee_id,
+            "items": items,
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "pages": (total + page_size - 1) // page_size
+        }
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Script to backfill / rebuild the absence analytics rollups in MOZAIK RH
+Recomputes the `absence_rollups` collection from the full absence history
+"""
+
+import asyncio
+import os
+import sys
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+
+from absence_rollups import AbsenceRollupService
+from db_indexes import ensure_indexes
+
+# Load environment variables
+load_dotenv()
+
+# MongoDB connection
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.getenv("DB_NAME", "test_database")
+
+
+async def rebuild_rollups():
+    """Rebuild absence rollups for the configured database"""
+    client = AsyncIOMotorClient(MONGO_URL)
+    db = client[DB_NAME]
+
+    try:
+        print(f"🔁 Rebuilding absence rollups for database '{DB_NAME}'...")
+        await ensure_indexes(db)
+
+        result = await AbsenceRollupService(db).rebuild()
+
+        print(f"📊 Absences processed: {result['absences']}")
+        print(f"💾 Rollup documents: {result['rollups']}")
+        print("🎉 Absence rollups rebuilt successfully!")
+
+    except Exception as e:
+        print(f"❌ Fatal error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(rebuild_rollups())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Script to rebuild the CSE delegation hour balances in MOZAIK RH
+Replaces the former recalculer_heures_cse.py:
+
+1. Applies the regulatory monthly hours (company headcount) to every delegate,
+   unless a company agreement (accord_entreprise_heures_cse) sets them
+2. Recomputes the `cse_monthly_balances` collection from the declarations
+   (`delegation_hours`) and cessions (`cse_cessions`, acknowledged `hours_cessions`)
+
+Usage:
+    python rebuild_cse_balances.py
+    python rebuild_cse_balances.py --effectif 320       # headcount when no company settings exist
+    python rebuild_cse_balances.py --keep-credits       # balances only
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+
+from cse_balances import CSEBalanceService
+from db_indexes import ensure_indexes
+
+# Load environment variables
+load_dotenv()
+
+# MongoDB connection
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.getenv("DB_NAME", "test_database")
+DEFAULT_EFFECTIF = 250
+
+
+async def recalculate_credits(db, service, effectif_override=None):
+    """Apply the regulatory monthly hours for the company headcount"""
+    settings = await db.company_settings.find_one({})
+
+    if not settings:
+        effectif = effectif_override or DEFAULT_EFFECTIF
+        await db.company_settings.insert_one({
+            "effectif": effectif,
+            "nom_entreprise": "MOZAIK RH",
+            "accord_entreprise_heures_cse": False
+        })
+        print(f"⚙️ No company settings found, created with headcount: {effectif}")
+    elif settings.get("accord_entreprise_heures_cse"):
+        print("📜 Company agreement on CSE hours: monthly credits left unchanged")
+        return
+    else:
+        effectif = effectif_override or settings.get("effectif", DEFAULT_EFFECTIF)
+        print(f"✅ Company headcount: {effectif}")
+
+    result = await service.apply_regulatory_credits(effectif)
+    for change in result["updated"]:
+        print(f"   🔄 {change['user_name']} ({change['statut']}): {change['before']}h → {change['after']}h/month")
+    print(f"👥 Delegates: {result['delegates']}, updated: {len(result['updated'])}")
+    print("📄 Source: https://www.service-public.gouv.fr/particuliers/vosdroits/F34474")
+
+
+async def rebuild_cse_balances(effectif=None, keep_credits=False):
+    """Rebuild CSE monthly balances for the configured database"""
+    client = AsyncIOMotorClient(MONGO_URL)
+    db = client[DB_NAME]
+
+    try:
+        print(f"🔁 Rebuilding CSE delegation balances for database '{DB_NAME}'...")
+        await ensure_indexes(db)
+        service = CSEBalanceService(db)
+
+        if not keep_credits:
+            await recalculate_credits(db, service, effectif)
+
+        typed = await service.backfill_usage_dates()
+        if typed:
+            print(f"🗓️ Cessions with typed usage date: {typed}")
+
+        result = await service.rebuild()
+        print(f"📝 Declarations: {result['declarations']}")
+        print(f"🤝 Cessions: {result['cessions']}")
+        print(f"💾 Monthly balances: {result['balances']}")
+        print("🎉 CSE balances rebuilt successfully!")
+
+    except Exception as e:
+        print(f"❌ Fatal error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild MOZAIK RH CSE delegation hour balances")
+    parser.add_argument("--effectif", type=int, help="Company headcount when no settings exist (or to override)")
+    parser.add_argument("--keep-credits", action="store_true", help="Do not recalculate delegates' monthly hours")
+    args = parser.parse_args()
+    asyncio.run(rebuild_cse_balances(args.effectif, args.keep_credits))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Script to rebuild the leave balances of MOZAIK RH from the leave ledger
+Recomputes `leave_balances` and their snapshots from `leave_transactions`
+in a single aggregation (balances created before the ledger are adopted first)
+
+Usage:
+    python rebuild_leave_balances.py            # all years
+    python rebuild_leave_balances.py --year 2025
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+
+from db_indexes import ensure_indexes
+from leave_ledger import LeaveLedger
+
+# Load environment variables
+load_dotenv()
+
+# MongoDB connection
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.getenv("DB_NAME", "test_database")
+
+
+async def rebuild_balances(year=None):
+    """Rebuild leave balances for the configured database"""
+    client = AsyncIOMotorClient(MONGO_URL)
+    db = client[DB_NAME]
+
+    try:
+        print(f"📒 Rebuilding leave balances from the ledger for database '{DB_NAME}'...")
+        await ensure_indexes(db)
+
+        ledger = LeaveLedger(db)
+        adopted = await ledger.adopt_legacy_balances()
+        print(f"📥 Legacy balances adopted: {adopted}")
+
+        result = await ledger.rebuild(year)
+
+        print(f"👥 Balances recomputed: {result['employees']}")
+        print(f"🧾 Ledger entries replayed: {result['entries']}")
+        print(f"🔧 Balances corrected: {result['corrected']}")
+        print("🎉 Leave balances rebuilt successfully!")
+
+    except Exception as e:
+        print(f"❌ Fatal error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild leave balances from the leave ledger")
+    parser.add_argument("--year", type=int, default=None, help="Year to rebuild (default: all)")
+    args = parser.parse_args()
+    asyncio.run(rebuild_balances(args.year))
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Script to backfill / rebuild the overtime rollups in MOZAIK RH
+Recomputes the `overtime_rollups` collection (monthly + total per employee)
+from the full overtime and work_hours history
+"""
+
+import asyncio
+import os
+import sys
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+
+from overtime_ledger import OvertimeLedger
+from db_indexes import ensure_indexes
+
+# Load environment variables
+load_dotenv()
+
+# MongoDB connection
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.getenv("DB_NAME", "test_database")
+
+
+async def rebuild_rollups():
+    """Rebuild overtime rollups for the configured database"""
+    client = AsyncIOMotorClient(MONGO_URL)
+    db = client[DB_NAME]
+
+    try:
+        print(f"🔁 Rebuilding overtime rollups for database '{DB_NAME}'...")
+        await ensure_indexes(db)
+
+        result = await OvertimeLedger(db).rebuild()
+
+        print(f"⏰ Movements processed: {result['movements']}")
+        print(f"💾 Rollup documents: {result['rollups']}")
+        print("🎉 Overtime rollups rebuilt successfully!")
+
+    except Exception as e:
+        print(f"❌ Fatal error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(rebuild_rollups())
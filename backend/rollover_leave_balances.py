@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Script for the year-end rollover of MOZAIK RH leave balances
+Opens next year's balances (CCN66 rights + carry-over of the closing year)
+in one bulk pass per database. Runs as a dry run unless --apply is given.
+
+Usage:
+    python rollover_leave_balances.py                      # dry run, closes last year
+    python rollover_leave_balances.py --from-year 2025 --apply
+    python rollover_leave_balances.py --all-tenants --apply
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+
+from db_indexes import ensure_indexes
+from leave_rollover import LeaveRolloverService
+
+# Load environment variables
+load_dotenv()
+
+# MongoDB connection
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.getenv("DB_NAME", "test_database")
+CENTRAL_DB_NAME = "mozaik_central"
+
+
+def print_report(db_name, report):
+    mode = "DRY RUN" if report["dry_run"] else "APPLIED"
+    print(f"\n📆 [{db_name}] Rollover {report['from_year']} → {report['to_year']} ({mode})")
+    print(f"👥 Employees: {report['total_employees']}")
+    print(f"🆕 Opened: {report['opened']}  🔧 Adjusted: {report['adjusted']}  ⏭️ Unchanged: {report['unchanged']}")
+    print(f"➡️ Carried over: {report['carried']}")
+    print(f"⌛ Expired: {report['expired']}")
+
+
+async def rollover_database(db, db_name, from_year, apply):
+    await ensure_indexes(db)
+    report = await LeaveRolloverService(db).rollover(from_year, dry_run=not apply)
+    print_report(db_name, report)
+
+
+async def run_rollover(from_year=None, apply=False, all_tenants=False):
+    """Roll leave balances over for the configured database (or every active tenant)"""
+    client = AsyncIOMotorClient(MONGO_URL)
+
+    try:
+        if all_tenants:
+            db_names = [
+                tenant["db_name"]
+                async for tenant in client[CENTRAL_DB_NAME].tenants.find({"status": {"$in": ["active", None]}})
+            ]
+        else:
+            db_names = [DB_NAME]
+
+        print(f"📆 Leave balance rollover on {len(db_names)} database(s)...")
+        for db_name in db_names:
+            await rollover_database(client[db_name], db_name, from_year, apply)
+
+        if not apply:
+            print("\nℹ️ Dry run only - re-run with --apply to write the balances")
+        print("🎉 Rollover completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Fatal error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Year-end rollover of leave balances")
+    parser.add_argument("--from-year", type=int, default=None, help="Year being closed (default: last year)")
+    parser.add_argument("--apply", action="store_true", help="Write the balances (default: dry run)")
+    parser.add_argument("--all-tenants", action="store_true", help="Run on every active tenant database")
+    args = parser.parse_args()
+    asyncio.run(run_rollover(args.from_year, args.apply, args.all_tenants))
@@ -5,6 +5,8 @@ from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
@@ -19,10 +21,28 @@ from datetime import datetime, date, timedelta, timezone
 import jwt
 import bcrypt
 import secrets
+import time
 import string
 
 # Import du service de synchronisation
 from sync_service import DataSyncService
+from db_indexes import ensure_indexes
+from absence_analytics import DEFAULT_DEPARTMENT, build_absence_kpi_pipeline, format_absence_kpi
+from absence_rollups import AbsenceRollupService
+from absenteeism_engine import AbsenteeismEngine
+from absence_reports import AbsenceReportService, MEDIA_TYPES as REPORT_MEDIA_TYPES, PARQUET_AVAILABLE
+from leave_balance_init import LeaveBalanceInitializer
+from leave_ledger import LeaveLedger
+from leave_rollover import LeaveRolloverService
+from overtime_ledger import OvertimeLedger
+from overtime_summary import OvertimeSummaryService
+from on_call_quotas import OnCallQuotaService
+from on_call_rota import DEFAULT_ITERATIONS as ROTA_ITERATIONS, OnCallRotaService
+from on_call_export import OnCallExportService, MEDIA_TYPES as ON_CALL_EXPORT_MEDIA_TYPES
+from cse_balances import (
+    CSEBalanceService, calculer_heures_delegation_reglementaires, month_range, parse_period, parse_usage_date
+)
+import leave_projection
 from websocket_manager import ws_manager
 from websocket_routes import router as websocket_router
 
@@ -86,6 +106,24 @@ logger = logging.getLogger(__name__)
 sync_service = DataSyncService(db)
 logger.info("🔄 Service de synchronisation globale initialisé")
 
+# Rollups analytics absences (maintenus à chaque écriture sur `absences`)
+rollup_service = AbsenceRollupService(db)
+absenteeism_engine = AbsenteeismEngine(db)
+report_service = AbsenceReportService()
+
+# Grand livre des congés (source de vérité des compteurs, leave_balances = projection)
+leave_ledger = LeaveLedger(db)
+
+# Soldes mensuels d'heures de délégation CSE (cse_monthly_balances, report 12 mois)
+cse_balance_service = CSEBalanceService(db)
+
+# Grand livre des heures supplémentaires (mouvements + rollups mensuels par employé)
+overtime_ledger = OvertimeLedger(db)
+overtime_summary_service = OvertimeSummaryService(db)
+on_call_quota_service = OnCallQuotaService(db)
+on_call_rota_service = OnCallRotaService(db)
+on_call_export_service = OnCallExportService(db)
+
 # Startup event for auto-backup and restore
 @app.on_event("startup")
 async def startup_event():
@@ -267,6 +305,31 @@ def calculate_end_date(start_date_str: str, days_count: int, counting_method: st
     # Return in French format DD/MM/YYYY
     return end_date.strftime("%d/%m/%Y")
 
+def normalize_date_iso(date_str: Optional[str]) -> Optional[str]:
+    """
+    Normalise une date (DD/MM/YYYY, YYYY-MM-DD ou datetime ISO) au format YYYY-MM-DD
+    
+    Le format ISO est triable lexicographiquement : les filtres par période
+    deviennent de simples requêtes $gte/$lte sur un champ indexé.
+    
+    Returns:
+        Date au format YYYY-MM-DD, ou None si non reconnue
+    """
+    if not date_str:
+        return None
+    
+    date_str = str(date_str).strip()
+    for fmt in ("%d/%m/%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(date_str[:10], fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    
+    try:
+        return datetime.fromisoformat(date_str.replace("Z", "+00:00")).strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
 def generate_internal_email(prenom: str, nom: str) -> str:
     """
     Generate an internal email for employees without professional email
@@ -799,54 +862,6 @@ class ImportSettings(BaseModel):
 # CSE MANAGEMENT MODELS
 # ========================================
 
-def calculer_heures_delegation_reglementaires(effectif: int, statut: str) -> int:
-    """
-    Calcule les heures de délégation mensuelles selon la réglementation française
-    Source: https://www.service-public.gouv.fr/particuliers/vosdroits/F34474
-    
-    Args:
-        effectif: Nombre de salariés dans l'entreprise
-        statut: 'Titulaire' ou 'Suppléant'
-    
-    Returns:
-        Nombre d'heures mensuelles réglementaires
-        
-    Note: Les suppléants n'ont PAS d'heures de délégation (sauf remplacement)
-    """
-    # Suppléants n'ont pas d'heures de délégation
-    if statut and statut.lower() in ['suppléant', 'suppleant']:
-        return 0
-    
-    # Titulaires selon effectif (règles légales)
-    if effectif < 50:
-        return 0  # Pas de CSE obligatoire
-    elif 50 <= effectif < 75:
-        return 18
-    elif 75 <= effectif < 100:
-        return 19
-    elif 100 <= effectif < 200:
-        return 21
-    elif 200 <= effectif < 500:
-        return 22
-    elif 500 <= effectif < 1500:
-        return 24
-    elif 1500 <= effectif < 3500:
-        return 26
-    elif 3500 <= effectif < 4000:
-        return 27
-    elif 4000 <= effectif < 5000:
-        return 28
-    elif 5000 <= effectif < 6750:
-        return 29
-    elif 6750 <= effectif < 7500:
-        return 30
-    elif 7500 <= effectif < 7750:
-        return 31
-    elif 7750 <= effectif < 9750:
-        return 32
-    else:  # 9750+
-        return 34
-
 class CSEDelegate(BaseModel):
     """Modèle pour les délégués CSE (titulaires et suppléants)"""
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -931,14 +946,17 @@ class CSECession(BaseModel):
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
 class CSEMonthlyBalance(BaseModel):
-    """Solde mensuel des heures de délégation CSE avec report"""
+    """Solde mensuel des heures de délégation CSE (collection cse_monthly_balances, maintenue à chaque écriture)"""
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     delegate_id: str  # ID du délégué (user_id)
     delegate_name: str  # Nom pour référence
     year: int  # Année
     month: int  # Mois (1-12)
+    period: str  # Mois YYYY-MM (clé unique avec delegate_id)
     credit_mensuel: float  # Crédit du mois (heures_mensuelles du délégué)
     report_mois_precedent: float = 0.0  # Heures reportées du mois précédent
+    heures_declarees: float = 0.0  # Heures déclarées ce mois (delegation_hours)
+    heures_prises_en_compte: float = 0.0  # Dont déclarations prises en compte
     heures_utilisees: float = 0.0  # Heures utilisées ce mois (cessions données)
     heures_recues: float = 0.0  # Heures reçues ce mois (cessions reçues)
     solde_fin_mois: float = 0.0  # Solde à reporter au mois suivant
@@ -990,6 +1008,12 @@ class EmployeeLeaveBalance(BaseModel):
     last_updated: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+# Compteurs d'un solde créé à la volée (mouvement "opening" du grand livre)
+DEFAULT_LEAVE_OPENING = {
+    field: value for field, value in EmployeeLeaveBalance(employee_id="", employee_name="", year=0).dict().items()
+    if field.endswith(("_initial", "_balance", "_accumulated")) and value
+}
+
 class LeaveTransaction(BaseModel):
     """Historique des mouvements de compteurs de congés"""
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -1827,6 +1851,7 @@ async def create_user(request: Request, user_data: UserCreate, current_user: Use
     )
     
     await db.users.insert_one(user_in_db.dict())
+    await leave_projection.invalidate(db)
     
     return TempPasswordResponse(
         temp_password=temp_password,
@@ -1876,6 +1901,7 @@ async def update_user(user_id: str, user_data: UserUpdate, current_user: User =
         
         # Mettre à jour l'utilisateur
         await db.users.update_one({"id": user_id}, {"$set": update_data})
+        await leave_projection.invalidate(db)
         
         # 🔄 PROPAGATION INTERACTIVE DANS TOUS LES MODULES
         if name_changed or email_changed:
@@ -1892,6 +1918,8 @@ async def update_user(user_id: str, user_data: UserUpdate, current_user: User =
                 )
                 total_updated += result.modified_count
                 logger.info(f"   ✅ Absences: {result.modified_count} mises à jour")
+                await rollup_service.rename_employee(user_id, new_name)
+                await leave_projection.invalidate(db)
             
             if email_changed:
                 result = await db.absences.update_many(
@@ -1925,6 +1953,7 @@ async def update_user(user_id: str, user_data: UserUpdate, current_user: User =
                     {"employee_id": user_id},
                     {"$set": {"employee_name": new_name}}
                 )
+                await overtime_ledger.rename_employee(user_id, new_name)
                 total_updated += result.modified_count
                 logger.info(f"   ✅ Heures supplémentaires: {result.modified_count} mises à jour")
             
@@ -1997,6 +2026,7 @@ async def update_user(user_id: str, user_data: UserUpdate, current_user: User =
                     {"employee_id": user_id},
                     {"$set": request_update}
                 )
+                await leave_projection.invalidate(db)
                 total_updated += result.modified_count
                 logger.info(f"   ✅ Demandes absence: {result.modified_count} mises à jour")
             
@@ -2636,6 +2666,7 @@ async def get_cse_cessions(current_user: User = Depends(get_current_user)):
         for cession in cessions:
             if "_id" in cession:
                 del cession["_id"]
+            cession.pop("usage_at", None)
             result.append(cession)
         
         return result
@@ -2652,11 +2683,13 @@ async def create_cse_cession(cession: CSECession, current_user: User = Depends(g
     - Le bénéficiaire ne doit pas dépasser 1.5x le crédit de base (selon CCN66)
     """
     try:
-        # Convertir en dict pour MongoDB
+        # Convertir en dict pour MongoDB (date d'utilisation typée pour les soldes)
         cession_dict = cession.dict()
+        cession_dict["usage_at"] = parse_usage_date(cession.usage_date)
         
         # Sauvegarder dans MongoDB
         await db.cse_cessions.insert_one(cession_dict)
+        await cse_balance_service.record_cession(cession_dict)
         
         print(f"Cession CSE créée: {cession.from_name} → {cession.to_name} ({cession.hours}h)")
         
@@ -2763,6 +2796,25 @@ class OnCallValidationResponse(BaseModel):
     warnings: List[str] = []
     stats: Optional[Dict[str, Any]] = None
 
+class OnCallRotaValidationRequest(BaseModel):
+    assignments: List[OnCallValidationRequest]
+
+class OnCallRotaValidationResponse(BaseModel):
+    isValid: bool
+    errors: List[str] = []
+    warnings: List[str] = []
+    employees: List[Dict[str, Any]] = []
+
+class OnCallRotaGenerateRequest(BaseModel):
+    year: int
+    month: int
+    mode: str = "week"  # week (dimanche → samedi), day
+    weights: Dict[str, float] = {}  # Poids d'équité par employé (1 par défaut, 0 = exclu)
+    employee_ids: Optional[List[str]] = None
+    seed: int = 0
+    iterations: int = ROTA_ITERATIONS
+    dry_run: bool = False
+
 # Absence Requests endpoints
 @api_router.get("/absence-requests", response_model=List[dict])
 async def get_absence_requests(current_user: User = Depends(get_current_user)):
@@ -2810,6 +2862,7 @@ async def create_absence_request(request_data: dict, current_user: User = Depend
     
     # Save to database
     await db.absence_requests.insert_one(absence_request.dict())
+    await leave_projection.invalidate(db)
     
     return absence_request
 
@@ -2865,6 +2918,7 @@ async def approve_absence_request(request_id: str, current_user: User = Depends(
                 "approvedDate": approved_date
             }}
         )
+        await leave_projection.invalidate(db)
         
         logger.info(f"✅ Demande {request_id} approuvée par {current_user.name}")
         
@@ -2921,6 +2975,8 @@ async def approve_absence_request(request_id: str, current_user: User = Depends(
         
         # 💾 Insérer dans la collection 'absences'
         await db.absences.insert_one(absence_dict)
+        await rollup_service.apply(absence_dict)
+        await leave_projection.invalidate(db)
         
         logger.info(f"📅 Absence créée dans 'absences' pour planning: {new_absence.id}")
         
@@ -2938,6 +2994,7 @@ async def approve_absence_request(request_id: str, current_user: User = Depends(
         
         # ⏰ 5. Si REC, créer overtime "recovered"
         overtime_created = False
+        overtime_balance = None
         if absence_request.get("type") == "REC" or (absence_request.get("type") and "récup" in absence_request.get("type", "").lower()):
             try:
                 # Calculer les heures
@@ -2945,24 +3002,26 @@ async def approve_absence_request(request_id: str, current_user: User = Depends(
                 duration_days = float(duration_str.split()[0]) if duration_str else 0
                 hours_recovered = duration_days * 7  # 7h par jour standard
                 
-                # Créer overtime "recovered"
-                overtime_entry = {
-                    "id": str(uuid.uuid4()),
-                    "employee_id": employee.get("id") if employee else "unknown",
-                    "employee_name": absence_request.get("employee", "Unknown"),
-                    "department": employee.get("department", "N/A") if employee else "N/A",
-                    "date": absence_request.get("startDate"),
-                    "hours": hours_recovered,
-                    "type": "recovered",
-                    "reason": f"Récupération validée - {absence_request.get('reason', 'Récupération')}",
-                    "validated": True,
-                    "validated_by": current_user.name,
-                    "validated_at": approved_date,
-                    "created_at": approved_date
-                }
-                
-                await db.overtime.insert_one(overtime_entry)
+                # Créer overtime "recovered" (grand livre + rollups de l'employé)
+                await overtime_ledger.recover(
+                    {
+                        "id": employee.get("id") if employee else "unknown",
+                        "name": absence_request.get("employee", "Unknown"),
+                        "department": employee.get("department", "N/A") if employee else "N/A"
+                    },
+                    date=absence_request.get("startDate"),
+                    hours=hours_recovered,
+                    reason=f"Récupération validée - {absence_request.get('reason', 'Récupération')}",
+                    validated_by=current_user.name,
+                    validated_at=approved_date
+                )
                 overtime_created = True
+                
+                # Solde restant : un seul document de cumul
+                if employee:
+                    overtime_balance = (await overtime_ledger.balance(employee["id"]))["balance"]
+                    if overtime_balance < 0:
+                        logger.warning(f"⚠️ Solde heures sup négatif après REC: {overtime_balance}h pour {employee.get('name')}")
                 logger.info(f"⏰ Overtime 'recovered' créé: {hours_recovered}h pour {absence_request.get('employee')}")
             except Exception as e:
                 logger.error(f"❌ Erreur création overtime: {str(e)}")
@@ -3000,6 +3059,7 @@ async def approve_absence_request(request_id: str, current_user: User = Depends(
             "approved_date": approved_date,
             "counters_synced": sync_performed,
             "overtime_deducted": overtime_created,
+            "overtime_balance": overtime_balance,
             "planning_updated": True,  # 🎯 NOUVEAU : Confirme que le planning est alimenté
             "steps_completed": {
                 "absence_request_updated": True,
@@ -3066,6 +3126,7 @@ async def reject_absence_request(request_id: str, rejection_data: dict, current_
                 "rejectionReason": rejection_data.get("reason", "Aucune raison spécifiée")
             }}
         )
+        await leave_projection.invalidate(db)
         
         logger.info(f"❌ Demande {request_id} rejetée par {current_user.name}")
         
@@ -3180,146 +3241,67 @@ async def get_employee_categories(current_user: User = Depends(get_current_user)
 
 # KPI and Analytics endpoints  
 @api_router.get("/analytics/absence-kpi")
-async def get_absence_kpi(current_user: User = Depends(get_current_user)):
+async def get_absence_kpi(
+    year: Optional[int] = None,
+    current_user: User = Depends(get_current_user)
+):
     """
     📊 ANALYTICS KPI - DONNÉES RÉELLES DEPUIS MONGODB
-    Remplace les anciennes données mockées par des vraies requêtes
+    Un seul pipeline $facet (motif, mois sur dates normalisées, département
+    via $lookup users) : Python ne fait que mettre en forme le résultat.
+    Lit les rollups pré-agrégés (absence_rollups) dès qu'ils existent.
     """
     if current_user.role not in ["admin", "manager"]:
         raise HTTPException(status_code=403, detail="Access denied")
     
+    trend_year = year or datetime.now().year
+    timings = {}
+    started = time.perf_counter()
+    
     try:
-        # 📊 1. RÉSUMÉ GLOBAL
-        all_absences = await db.absences.find({}).to_list(10000)
-        total_absences = len(all_absences)
-        
-        # Compter les absences DEL vs Personal
-        del_absences = [a for a in all_absences if a.get("motif_absence") == "DEL"]
-        del_count = len(del_absences)
-        personal_count = total_absences - del_count
+        # 📊 1. AGRÉGATION UNIQUE (rollups si disponibles, sinon absences brutes)
+        step = time.perf_counter()
+        if await rollup_service.has_rollups():
+            source = "rollups"
+            facets = [await rollup_service.kpi_facets(trend_year)]
+        else:
+            source = "absences"
+            pipeline = build_absence_kpi_pipeline(trend_year)
+            facets = await db.absences.aggregate(pipeline).to_list(1)
+        timings["aggregation"] = round((time.perf_counter() - step) * 1000, 2)
         
-        # Moyenne par employé
+        # 👥 2. EFFECTIF ET DÉPARTEMENTS CONNUS
+        step = time.perf_counter()
         total_employees = await db.users.count_documents({})
-        avg_per_employee = round(total_absences / total_employees, 1) if total_employees > 0 else 0
-        
-        # Taux de délégation
-        delegation_rate = round((del_count / total_absences * 100), 1) if total_absences > 0 else 0
-        
-        # 📈 2. PAR CATÉGORIE
-        # Agréger par motif_absence
-        by_category_pipeline = [
-            {"$group": {
-                "_id": "$motif_absence",
-                "count": {"$sum": 1}
-            }},
-            {"$sort": {"count": -1}}
-        ]
-        by_category_data = await db.absences.aggregate(by_category_pipeline).to_list(100)
-        
-        # Mapper aux couleurs et noms
-        motif_colors = {
-            "DEL": {"name": "Délégation CSE", "color": "bg-indigo-600", "justified": True},
-            "CA": {"name": "CA - Congés Annuels", "color": "bg-blue-500", "justified": True},
-            "AM": {"name": "Arrêt maladie", "color": "bg-red-500", "justified": False},
-            "RTT": {"name": "RTT/Récupération", "color": "bg-green-500", "justified": True},
-            "REC": {"name": "Récupération", "color": "bg-green-400", "justified": True},
-            "FO": {"name": "Formation", "color": "bg-purple-500", "justified": True},
-            "AT": {"name": "Accident travail", "color": "bg-red-600", "justified": False},
-            "MAT": {"name": "Congé maternité", "color": "bg-pink-500", "justified": True},
-            "PAT": {"name": "Congé paternité", "color": "bg-pink-400", "justified": True},
-            "FAM": {"name": "Événement familial", "color": "bg-purple-300", "justified": True},
-            "CT": {"name": "Congés Trimestriels", "color": "bg-blue-300", "justified": True},
-            "NAUT": {"name": "Absence non autorisée", "color": "bg-red-700", "justified": False},
-            "AUT": {"name": "Absence autorisée", "color": "bg-gray-500", "justified": True},
-            "TEL": {"name": "Télétravail", "color": "bg-cyan-500", "justified": True},
-            "STG": {"name": "Stage", "color": "bg-cyan-400", "justified": True},
-            "CEX": {"name": "Congé exceptionnel", "color": "bg-indigo-400", "justified": True}
-        }
-        
-        by_category = []
-        for item in by_category_data:
-            code = item["_id"]
-            count = item["count"]
-            percentage = round((count / total_absences * 100), 1) if total_absences > 0 else 0
-            
-            config = motif_colors.get(code, {"name": code, "color": "bg-gray-500", "justified": False})
-            
-            by_category.append({
-                "code": code,
-                "name": config["name"],
-                "count": count,
-                "percentage": percentage,
-                "color": config["color"],
-                "justified": config["justified"]
-            })
-        
-        # 📅 3. TENDANCE MENSUELLE (12 derniers mois)
-        from datetime import datetime, timedelta
-        current_date = datetime.now()
-        
-        monthly_trend = []
-        months_fr = ["Jan", "Fév", "Mar", "Avr", "Mai", "Juin", "Juil", "Août", "Sep", "Oct", "Nov", "Déc"]
-        
-        for i in range(12):
-            month_date = datetime(current_date.year, i + 1, 1)
-            month_name = months_fr[i]
-            
-            # Compter absences du mois
-            month_absences = [a for a in all_absences if a.get("date_debut", "").startswith(f"{i+1:02d}/") or 
-                             a.get("date_debut", "").endswith(f"/{i+1:02d}/") or
-                             (f"-{i+1:02d}-" in a.get("date_debut", ""))]
-            
-            del_month = len([a for a in month_absences if a.get("motif_absence") == "DEL"])
-            total_month = len(month_absences)
-            personal_month = total_month - del_month
-            
-            monthly_trend.append({
-                "month": month_name,
-                "del": del_month,
-                "personal": personal_month,
-                "total": total_month
-            })
-        
-        # 🏢 4. RÉPARTITION PAR DÉPARTEMENT
-        users = await db.users.find({}).to_list(1000)
-        department_breakdown = []
-        
-        departments = list(set([u.get("department", "Non spécifié") for u in users]))
-        
-        for dept in departments:
-            dept_employees = [u["id"] for u in users if u.get("department") == dept]
-            dept_absences = [a for a in all_absences if a.get("employee_id") in dept_employees]
-            
-            dept_del = len([a for a in dept_absences if a.get("motif_absence") == "DEL"])
-            dept_total = len(dept_absences)
-            dept_personal = dept_total - dept_del
-            dept_del_rate = round((dept_del / dept_total * 100), 1) if dept_total > 0 else 0
-            
-            department_breakdown.append({
-                "department": dept,
-                "del": dept_del,
-                "personal": dept_personal,
-                "total": dept_total,
-                "delRate": dept_del_rate
-            })
-        
-        # Trier par total décroissant
-        department_breakdown.sort(key=lambda x: x["total"], reverse=True)
+        departments = await db.users.distinct("department")
+        # distinct ignore les employés sans département : bucket "Non spécifié"
+        if await db.users.find_one({"department": None}, {"_id": 1}):
+            departments.append(DEFAULT_DEPARTMENT)
+        timings["employees"] = round((time.perf_counter() - step) * 1000, 2)
+        
+        # 🎨 3. MISE EN FORME
+        step = time.perf_counter()
+        result = format_absence_kpi(facets[0] if facets else {}, total_employees, departments)
+        timings["formatting"] = round((time.perf_counter() - step) * 1000, 2)
+        
+        # 📈 4. TAUX D'ABSENTÉISME ET ÉVOLUTION N-1 (année en cours : à date)
+        step = time.perf_counter()
+        period_start, period_end = date(trend_year, 1, 1), min(date(trend_year, 12, 31), date.today())
+        if period_end >= period_start:
+            try:
+                rates = await absenteeism_engine.compute(period_start, period_end, top_bradford=0)
+                delta = rates["comparison"]["absenteeismRateDelta"]
+                result["summary"]["absenteeismRate"] = rates["overall"]["absenteeismRate"]
+                result["summary"]["comparisonLastYear"] = f"{delta:+.1f} pts"
+            except Exception as e:
+                logger.warning(f"⚠️ Comparaison N-1 indisponible: {str(e)}")
+        timings["absenteeism"] = round((time.perf_counter() - step) * 1000, 2)
         
-        # ✅ RETOUR DES DONNÉES RÉELLES
-        return {
-            "summary": {
-                "totalAbsences": total_absences,
-                "delegationHours": del_count,
-                "personalAbsences": personal_count,
-                "averagePerEmployee": avg_per_employee,
-                "delegationRate": delegation_rate,
-                "comparisonLastYear": "N/A"  # Nécessite historique année précédente
-            },
-            "byCategory": by_category[:10],  # Top 10
-            "monthlyTrend": monthly_trend,
-            "departmentBreakdown": department_breakdown
-        }
+        timings["total"] = round((time.perf_counter() - started) * 1000, 2)
+        result["year"] = trend_year
+        result["source"] = source
+        result["timings"] = timings
+        return result
         
     except Exception as e:
         logger.error(f"❌ Erreur calcul analytics: {str(e)}")
@@ -3335,9 +3317,67 @@ async def get_absence_kpi(current_user: User = Depends(get_current_user)):
             },
             "byCategory": [],
             "monthlyTrend": [],
-            "departmentBreakdown": []
+            "departmentBreakdown": [],
+            "year": trend_year,
+            "timings": {"total": round((time.perf_counter() - started) * 1000, 2)}
         }
 
+@api_router.get("/analytics/absenteeism")
+async def get_absenteeism_indicators(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    motifs: Optional[str] = None,
+    top: int = 20,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    📈 Taux d'absentéisme (pondéré temps de travail), indices de fréquence et de gravité,
+    facteur de Bradford par employé et évolution N-1 par département
+    
+    Args:
+        start_date / end_date: Période (DD/MM/YYYY ou YYYY-MM-DD), défaut = année en cours à date
+        motifs: Codes comptés, séparés par des virgules (défaut AM,AT,MPRO,NAUT,AUT,CSS)
+        top: Nombre d'employés du classement Bradford
+    """
+    if current_user.role not in ["admin", "manager"]:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    start_iso = normalize_date_iso(start_date) if start_date else None
+    end_iso = normalize_date_iso(end_date) if end_date else None
+    if (start_date and not start_iso) or (end_date and not end_iso):
+        raise HTTPException(status_code=400, detail="Format de date invalide (DD/MM/YYYY ou YYYY-MM-DD)")
+    
+    today = date.today()
+    start = date.fromisoformat(start_iso) if start_iso else date(today.year, 1, 1)
+    end = date.fromisoformat(end_iso) if end_iso else today
+    if end < start:
+        raise HTTPException(status_code=400, detail="La date de fin doit être postérieure à la date de début")
+    
+    motif_list = [m.strip() for m in motifs.split(",") if m.strip()] if motifs else None
+    
+    try:
+        return await absenteeism_engine.compute(start, end, motifs=motif_list, top_bradford=max(0, min(top, 200)))
+    except Exception as e:
+        logger.error(f"❌ Erreur calcul absentéisme: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erreur calcul absentéisme: {str(e)}")
+
+@api_router.post("/analytics/rollups/rebuild")
+async def rebuild_absence_rollups(current_user: User = Depends(get_current_user)):
+    """
+    🔁 Reconstruit les rollups analytics depuis l'historique complet des absences
+    (backfill initial, ou après changement de département/site d'employés)
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    try:
+        result = await rollup_service.rebuild()
+        logger.info(f"🔁 Rollups absences reconstruits par {current_user.name}: {result}")
+        return {"success": True, **result}
+    except Exception as e:
+        logger.error(f"❌ Erreur reconstruction rollups: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erreur reconstruction rollups: {str(e)}")
+
 # On-Call Management endpoints
 @api_router.get("/on-call/employees", response_model=List[OnCallEmployee])
 async def get_on_call_employees(current_user: User = Depends(get_current_user)):
@@ -3425,113 +3465,131 @@ async def validate_on_call_assignment(
     current_user: User = Depends(get_current_user)
 ):
     """Valider une assignation d'astreinte selon les règles CCN66"""
-    # Limites CCN66 par catégorie
-    ccn66_limits = {
-        "management": 60,
-        "administrative": 45,
-        "specialized_educators": 50,
-        "technical_educators": 50
-    }
-    
-    # Get employee info from database
     try:
-        user = await db.users.find_one({"id": validation.employeeId})
-        if not user:
-            return OnCallValidationResponse(
-                isValid=False,
-                errors=["Employé non trouvé"]
-            )
-        
-        # Calculate current on-call days for this year
-        current_assignments = await db.on_call_assignments.find({
-            "employeeId": validation.employeeId,
-            "status": "confirmed"
-        }).to_list(1000)
-        
-        current_days = 0
-        current_year = datetime.now().year
-        for assignment in current_assignments:
-            assign_date = datetime.fromisoformat(assignment["startDate"])
-            if assign_date.year == current_year:
-                end_date = datetime.fromisoformat(assignment["endDate"])
-                current_days += (end_date - assign_date).days + 1
-        
-        employee = {
-            "name": user["name"],
-            "category": user.get("department", "administrative").lower().replace(" ", "_"),
-            "currentDays": current_days
-        }
-        
+        result = await on_call_quota_service.validate([validation.dict()])
+    except ValueError as e:
+        return OnCallValidationResponse(isValid=False, errors=[f"Dates invalides: {str(e)}"])
     except Exception as e:
-        print(f"Error getting employee for validation: {e}")
+        logger.error(f"❌ Erreur validation astreinte: {str(e)}")
         return OnCallValidationResponse(
             isValid=False,
             errors=["Erreur lors de la récupération des données employé"]
         )
     
-    # Calcul du nombre de jours demandés
-    start_date = datetime.fromisoformat(validation.startDate)
-    end_date = datetime.fromisoformat(validation.endDate)
-    new_days = (end_date - start_date).days + 1
+    # Une ligne par année couverte : les statistiques affichées sont celles de la première
+    stats = next((employee["stats"] for employee in result["employees"] if employee["stats"]), None)
+    return OnCallValidationResponse(
+        isValid=result["isValid"],
+        errors=result["errors"],
+        warnings=result["warnings"],
+        stats=stats
+    )
+
+@api_router.post("/on-call/validate/rota", response_model=OnCallRotaValidationResponse)
+async def validate_on_call_rota(
+    rota: OnCallRotaValidationRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Valider un planning d'astreintes complet (ex. un mois) selon les limites CCN66
+
+    Les jours déjà planifiés de chaque employé sont comptés en une seule agrégation ;
+    les jours proposés déjà présents au planning ne sont pas comptés deux fois.
+    """
+    if current_user.role not in ["admin", "manager"]:
+        raise HTTPException(status_code=403, detail="Access denied")
     
-    errors = []
-    warnings = []
+    try:
+        result = await on_call_quota_service.validate([a.dict() for a in rota.assignments])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Dates invalides: {str(e)}")
+    except Exception as e:
+        logger.error(f"❌ Erreur validation planning astreintes: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erreur validation planning: {str(e)}")
     
-    # Vérification limite CCN66
-    max_days = ccn66_limits[employee["category"]]
-    total_after = employee["currentDays"] + new_days
+    return OnCallRotaValidationResponse(**result)
+
+@api_router.post("/on-call/rota/generate")
+async def generate_on_call_rota(
+    request: OnCallRotaGenerateRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    🗓️ Génère le planning d'astreintes d'un mois (glouton + recherche locale)
+
+    Respecte les absences approuvées et les quotas annuels CCN66, répartit la charge
+    selon les poids d'équité. Sans dry_run, le planning est enregistré par la création
+    en lot (les jours déjà planifiés sont conservés).
+    """
+    if current_user.role not in ["admin", "manager"]:
+        raise HTTPException(status_code=403, detail="Access denied")
     
-    if total_after > max_days:
-        errors.append(
-            f"⚠️ LIMITE CCN66 DÉPASSÉE: {employee['name']} dépasserait sa limite annuelle "
-            f"({max_days} jours max, actuellement {employee['currentDays']} + {new_days} = {total_after})"
-        )
-    elif total_after > max_days * 0.9:
-        warnings.append(
-            f"⚡ ATTENTION: {employee['name']} s'approche de sa limite annuelle "
-            f"({round((total_after / max_days) * 100)}%)"
+    try:
+        result = await on_call_rota_service.generate(
+            request.year, request.month, mode=request.mode, weights=request.weights,
+            seed=request.seed, employee_ids=request.employee_ids,
+            iterations=min(max(request.iterations, 0), 20 * ROTA_ITERATIONS)
         )
-    
-    return OnCallValidationResponse(
-        isValid=len(errors) == 0,
-        errors=errors,
-        warnings=warnings,
-        stats={
-            "employeeName": employee["name"],
-            "category": employee["category"],
-            "currentDays": employee["currentDays"],
-            "newDays": new_days,
-            "totalAfter": total_after,
-            "maxDays": max_days,
-            "percentageUsed": round((total_after / max_days) * 100, 1)
+        if request.dry_run:
+            return {"success": True, "applied": False, **result}
+        
+        created = await on_call_rota_service.apply(result["schedules"], current_user.email)
+        logger.info(f"🗓️ Planning astreintes {request.month:02d}/{request.year} enregistré par {current_user.name}")
+        return {
+            "success": True,
+            "applied": True,
+            **result,
+            "created": sum(1 for item in created if item["status"] == "created"),
+            "alreadyExisting": sum(1 for item in created if item["status"] != "created")
         }
-    )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"❌ Erreur génération planning astreintes: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erreur génération planning: {str(e)}")
 
 @api_router.get("/on-call/export/{month}/{year}")
 async def export_on_call_planning(
     month: int,
     year: int,
+    format: str = "json",
     current_user: User = Depends(get_current_user)
 ):
-    """Exporter le planning d'astreintes pour l'entreprise de sécurité"""
-    # En production, ici on récupérerait les vraies données
-    return {
-        "month": month,
-        "year": year,
-        "assignments": [
-            {
-                "startDate": "2025-01-05",
-                "endDate": "2025-01-06",
-                "employeeName": "Sophie Martin",
-                "employeePhone": "06.12.34.56.78",
-                "emergencyContact": "Service Direction",
-                "type": "Week-end",
-                "notes": ""
+    """
+    Exporter le planning d'astreintes pour l'entreprise de sécurité
+    
+    Args:
+        format: json (défaut), csv ou xlsx (fichier mis en cache jusqu'à la
+                prochaine modification du planning du mois)
+    """
+    if not 1 <= month <= 12:
+        raise HTTPException(status_code=400, detail="Mois invalide (1-12)")
+    if format != "json" and format not in ON_CALL_EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Format non supporté: {format} (json, csv, xlsx)")
+    
+    try:
+        if format == "json":
+            return {
+                "month": month,
+                "year": year,
+                "assignments": await on_call_export_service.rows(year, month),
+                "generatedAt": datetime.now().isoformat(),
+                "generatedBy": current_user.name
             }
-        ],
-        "generatedAt": datetime.now().isoformat(),
-        "generatedBy": current_user.name
-    }
+        
+        from fastapi.responses import FileResponse
+        
+        artifact_path, cached = await on_call_export_service.get_or_generate(year, month, format)
+        return FileResponse(
+            path=str(artifact_path),
+            filename=f"Astreintes_{year}_{month:02d}.{format}",
+            media_type=ON_CALL_EXPORT_MEDIA_TYPES[format],
+            headers={"X-Export-Cache": "hit" if cached else "miss", "ETag": f'"{artifact_path.stem}"'}
+        )
+        
+    except Exception as e:
+        logger.error(f"❌ Erreur export planning astreintes: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erreur export planning: {str(e)}")
 
 # Excel Import endpoints - Admin only
 def require_admin_access(current_user: User = Depends(get_current_user)):
@@ -3901,6 +3959,7 @@ async def import_absences(
     errors = []
     warnings = []
     successful_imports = 0
+    imported_absences = []
     
     logger.info(f"📥 Import absences lancé par {current_user.name}")
     logger.info(f"📊 Nombre de lignes reçues: {len(request.data)}")
@@ -4009,6 +4068,7 @@ async def import_absences(
                 
                 # Stocker dans MongoDB
                 await db.absences.insert_one(absence_dict)
+                imported_absences.append(absence_dict)
                 successful_imports += 1
                 logger.info(f"✅ Ligne {i+1}: Absence créée pour {employee.get('name')} (du {date_debut} au {date_fin or 'N/A'})")
                 
@@ -4019,6 +4079,15 @@ async def import_absences(
                     "error": f"Erreur lors de l'import: {str(e)}"
                 })
         
+        # 📊 Rollups analytics : un seul bulk_write pour tout l'import
+        await rollup_service.apply_many(imported_absences)
+        await leave_projection.invalidate(db)
+        
+        # 🔄 Compteurs : absences approuvées synchronisées en un seul lot
+        await sync_service.sync_many(
+            [a for a in imported_absences if a.get("status") == "approved"], operation="create"
+        )
+        
         return {
             "success": len(errors) == 0,
             "total_processed": len(request.data),
@@ -4039,12 +4108,24 @@ async def import_work_hours(
     request: ImportDataRequest,
     current_user: User = Depends(require_admin_access)
 ):
-    """Import work hours data from Excel - supports both 'employee_name' and 'nom'+'prenom' formats"""
+    """
+    Import work hours data from Excel - supports both 'employee_name' and 'nom'+'prenom' formats
+    
+    Les lignes sont écrites en un seul bulk_write d'upserts sur la clé (employee_id, date),
+    garantie par l'index unique employee_id_1_date_1 : un ré-import ne crée pas de doublons.
+    Si overwrite_existing=False, les lignes déjà présentes sont conservées telles quelles.
+    """
     errors = []
     warnings = []
     successful_imports = 0
     
     try:
+        # Cache des recherches d'employés : un même nom n'est résolu qu'une fois par import
+        employee_cache = {}
+        # Une seule opération par clé (employee_id, date) : la dernière ligne du fichier l'emporte
+        operations = {}
+        now = datetime.utcnow()
+        
         for i, work_data in enumerate(request.data):
             try:
                 # Support both formats: 'employee_name' OR 'nom'+'prenom'
@@ -4066,32 +4147,12 @@ async def import_work_hours(
                     })
                     continue
                 
-                # UNIFIED EMPLOYEE SEARCH - Try all possible locations
-                employee = None
-                
-                # 1. Try by full name in users.name
-                employee = await db.users.find_one({"name": {"$regex": search_name, "$options": "i"}})
-                
-                # 2. Try by NOM in users collection (case insensitive)
-                if not employee and nom:
-                    employee = await db.users.find_one({
-                        "$or": [
-                            {"name": {"$regex": f".*{nom}.*", "$options": "i"}},
-                            {"email": {"$regex": f".*{nom}.*", "$options": "i"}}
-                        ]
-                    })
-                
-                # 3. Try employees collection as fallback (if it exists)
-                if not employee:
-                    try:
-                        employee = await db.employees.find_one({
-                            "$or": [
-                                {"nom": {"$regex": nom if nom else search_name, "$options": "i"}},
-                                {"prenom": {"$regex": prenom if prenom else search_name, "$options": "i"}}
-                            ]
-                        })
-                    except:
-                        pass  # employees collection may not exist
+                cache_key = (search_name.lower(), nom.lower(), prenom.lower())
+                if cache_key in employee_cache:
+                    employee = employee_cache[cache_key]
+                else:
+                    employee = await find_employee_for_work_hours(search_name, nom, prenom)
+                    employee_cache[cache_key] = employee
                 
                 if not employee:
                     errors.append({
@@ -4100,20 +4161,53 @@ async def import_work_hours(
                     })
                     continue
                 
+                work_date = normalize_date_iso(work_data.get('date', ''))
+                if not work_date:
+                    errors.append({
+                        "row": str(i + 1),
+                        "error": f"Date invalide: '{work_data.get('date', '')}' (attendu JJ/MM/AAAA ou AAAA-MM-JJ)"
+                    })
+                    continue
+                
                 # Get motif/notes
                 motif = work_data.get('motif', work_data.get('notes', ''))
                 
                 work_hours = ImportWorkHours(
                     employee_id=employee.get("id", employee.get("_id")),
                     employee_name=employee.get("name", display_name),
-                    date=work_data.get('date', ''),
+                    date=work_date,
                     heures_travaillees=float(work_data.get('heures_travaillees', 0)),
                     notes=motif,
+                    created_at=now,
                     created_by=current_user.name
                 )
                 
-                # Store in MongoDB
-                await db.work_hours.insert_one(work_hours.dict())
+                key = {"employee_id": work_hours.employee_id, "date": work_hours.date}
+                values = {
+                    "employee_name": work_hours.employee_name,
+                    "heures_travaillees": work_hours.heures_travaillees,
+                    "notes": work_hours.notes
+                }
+                on_insert = {
+                    "id": work_hours.id,
+                    "created_at": work_hours.created_at,
+                    "created_by": work_hours.created_by
+                }
+                
+                if request.overwrite_existing:
+                    update = {
+                        "$set": {**values, "updated_at": now, "updated_by": current_user.name},
+                        "$setOnInsert": on_insert
+                    }
+                else:
+                    update = {"$setOnInsert": {**values, **on_insert}}
+                
+                if (key["employee_id"], key["date"]) in operations:
+                    warnings.append({
+                        "row": str(i + 1),
+                        "warning": f"Ligne en double pour {work_hours.employee_name} le {work_date} - seule la dernière est conservée"
+                    })
+                operations[(key["employee_id"], key["date"])] = UpdateOne(key, update, upsert=True)
                 successful_imports += 1
                 
             except Exception as e:
@@ -4122,6 +4216,20 @@ async def import_work_hours(
                     "error": str(e)
                 })
         
+        if operations:
+            result = await db.work_hours.bulk_write(list(operations.values()), ordered=False)
+            await overtime_ledger.refresh_imported(employee_id for employee_id, _ in operations)
+            unchanged = len(operations) - result.upserted_count - result.modified_count
+            if unchanged > 0 and not request.overwrite_existing:
+                warnings.append({
+                    "row": "-",
+                    "warning": f"{unchanged} ligne(s) déjà importée(s) conservée(s) (overwrite_existing=false)"
+                })
+            logger.info(
+                f"⏱️ Import heures: {result.upserted_count} créée(s), "
+                f"{result.modified_count} mise(s) à jour, {unchanged} inchangée(s)"
+            )
+        
         return ImportResult(
             success=len(errors) == 0,
             total_processed=len(request.data),
@@ -4135,6 +4243,38 @@ async def import_work_hours(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Import error: {str(e)}")
 
+async def find_employee_for_work_hours(search_name: str, nom: str, prenom: str) -> Optional[dict]:
+    """UNIFIED EMPLOYEE SEARCH - Try all possible locations"""
+    projection = {"_id": 0, "id": 1, "name": 1}
+    
+    # 1. Try by full name in users.name
+    employee = await db.users.find_one(
+        {"name": {"$regex": re.escape(search_name), "$options": "i"}}, projection
+    )
+    
+    # 2. Try by NOM in users collection (case insensitive)
+    if not employee and nom:
+        employee = await db.users.find_one({
+            "$or": [
+                {"name": {"$regex": f".*{re.escape(nom)}.*", "$options": "i"}},
+                {"email": {"$regex": f".*{re.escape(nom)}.*", "$options": "i"}}
+            ]
+        }, projection)
+    
+    # 3. Try employees collection as fallback (if it exists)
+    if not employee:
+        try:
+            employee = await db.employees.find_one({
+                "$or": [
+                    {"nom": {"$regex": re.escape(nom if nom else search_name), "$options": "i"}},
+                    {"prenom": {"$regex": re.escape(prenom if prenom else search_name), "$options": "i"}}
+                ]
+            })
+        except:
+            pass  # employees collection may not exist
+    
+    return employee
+
 @api_router.get("/import/statistics")
 async def get_import_statistics(current_user: User = Depends(require_admin_access)):
     """Get statistics about imported data"""
@@ -4154,15 +4294,56 @@ async def get_import_statistics(current_user: User = Depends(require_admin_acces
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/import/work-hours/list")
-async def list_work_hours(current_user: User = Depends(require_admin_access)):
-    """List all imported work hours"""
+async def list_work_hours(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    employee_id: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 100,
+    current_user: User = Depends(require_admin_access)
+):
+    """
+    List imported work hours (paginated)
+    
+    Query params:
+    - start_date / end_date: période (JJ/MM/AAAA ou AAAA-MM-JJ, bornes incluses)
+    - employee_id: filtrer sur un employé
+    - page / page_size: pagination (page_size max 500)
+    """
     try:
-        work_hours = await db.work_hours.find({}).to_list(length=None)
-        # Remove MongoDB _id field for JSON serialization
-        for wh in work_hours:
-            if '_id' in wh:
-                del wh['_id']
-        return work_hours
+        page = max(page, 1)
+        page_size = min(max(page_size, 1), 500)
+        
+        query = {}
+        if employee_id:
+            query["employee_id"] = employee_id
+        
+        date_range = {}
+        for bound, operator in ((start_date, "$gte"), (end_date, "$lte")):
+            if bound:
+                iso = normalize_date_iso(bound)
+                if not iso:
+                    raise HTTPException(status_code=400, detail=f"Date invalide: {bound}")
+                date_range[operator] = iso
+        if date_range:
+            query["date"] = date_range
+        
+        total = await db.work_hours.count_documents(query)
+        work_hours = await db.work_hours.find(query, {"_id": 0}) \
+            .sort([("date", -1), ("employee_id", 1)]) \
+            .skip((page - 1) * page_size) \
+            .limit(page_size) \
+            .to_list(length=page_size)
+        
+        return {
+            "items": work_hours,
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "pages": (total + page_size - 1) // page_size
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error listing work hours: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -4175,6 +4356,7 @@ async def delete_employee_work_hours(
     """Delete all work hours for a specific employee"""
     try:
         result = await db.work_hours.delete_many({"employee_id": employee_id})
+        await overtime_ledger.refresh_imported([employee_id])
         return {
             "success": True,
             "deleted_count": result.deleted_count,
@@ -4211,24 +4393,17 @@ async def get_leave_balance(
                 del balance["_id"]
             return balance
         else:
-            # Créer un solde par défaut si n'existe pas
+            # Créer un solde par défaut si n'existe pas (mouvement d'ouverture du grand livre)
             employee = await db.users.find_one({"id": employee_id})
             if not employee:
                 raise HTTPException(status_code=404, detail="Employé non trouvé")
             
-            new_balance = EmployeeLeaveBalance(
-                employee_id=employee_id,
-                employee_name=employee.get("name", ""),
-                year=year
+            await leave_ledger.append(
+                employee_id, year, "opening", {},
+                projection_on_insert={"employee_name": employee.get("name", "")},
+                defaults=DEFAULT_LEAVE_OPENING
             )
-            
-            # Sauvegarder en base
-            balance_dict = new_balance.dict()
-            balance_dict['last_updated'] = balance_dict['last_updated'].isoformat()
-            balance_dict['created_at'] = balance_dict['created_at'].isoformat()
-            await db.leave_balances.insert_one(balance_dict)
-            
-            return new_balance
+            return await db.leave_balances.find_one({"employee_id": employee_id, "year": year}, {"_id": 0})
             
     except HTTPException:
         raise
@@ -4259,26 +4434,15 @@ async def update_leave_balance(
             "year": year
         })
         
+        opening = None
         if not balance:
-            # Créer un nouveau solde
+            # Nouveau solde : créé avec le mouvement (même upsert)
             employee = await db.users.find_one({"id": update.employee_id})
             if not employee:
                 raise HTTPException(status_code=404, detail="Employé non trouvé")
             
-            balance = {
-                "id": str(uuid.uuid4()),
-                "employee_id": update.employee_id,
-                "employee_name": employee.get("name", ""),
-                "year": year,
-                "ca_initial": 25.0, "ca_taken": 0.0, "ca_pending": 0.0, "ca_reintegrated": 0.0, "ca_balance": 25.0,
-                "rtt_initial": 12.0, "rtt_taken": 0.0, "rtt_pending": 0.0, "rtt_reintegrated": 0.0, "rtt_balance": 12.0,
-                "ct_initial": 0.0, "ct_taken": 0.0, "ct_pending": 0.0, "ct_reintegrated": 0.0, "ct_balance": 0.0,
-                "rec_accumulated": 0.0, "rec_taken": 0.0, "rec_reintegrated": 0.0, "rec_balance": 0.0,
-                "cex_initial": 0.0, "cex_taken": 0.0, "cex_balance": 0.0,
-                "last_updated": datetime.now(timezone.utc).isoformat(),
-                "created_at": datetime.now(timezone.utc).isoformat()
-            }
-            await db.leave_balances.insert_one(balance)
+            opening = DEFAULT_LEAVE_OPENING
+            balance = {"employee_name": employee.get("name", ""), **opening}
         
         # Déterminer les champs à mettre à jour selon le type
         leave_type_map = {
@@ -4296,65 +4460,27 @@ async def update_leave_balance(
         balance_field, taken_field, reint_field, pending_field = leave_type_map[update.leave_type]
         
         balance_before = balance.get(balance_field, 0.0)
-        balance_after = balance_before
         
-        # Appliquer l'opération
+        # Mouvement du grand livre (variations des compteurs)
         if update.operation == "deduct":
             # Déduction : diminue le solde, augmente taken
-            balance_after = balance_before - update.amount
-            await db.leave_balances.update_one(
-                {"employee_id": update.employee_id, "year": year},
-                {
-                    "$set": {
-                        balance_field: balance_after,
-                        "last_updated": datetime.now(timezone.utc).isoformat()
-                    },
-                    "$inc": {taken_field: update.amount}
-                }
-            )
-            
+            deltas = {balance_field: -update.amount, taken_field: update.amount}
         elif update.operation == "reintegrate":
             # Réintégration : augmente le solde et le compteur de réintégration
-            balance_after = balance_before + update.amount
-            update_fields = {
-                balance_field: balance_after,
-                "last_updated": datetime.now(timezone.utc).isoformat()
-            }
+            deltas = {balance_field: update.amount}
             if reint_field:
-                update_fields[reint_field] = balance.get(reint_field, 0.0) + update.amount
-            
-            await db.leave_balances.update_one(
-                {"employee_id": update.employee_id, "year": year},
-                {"$set": update_fields}
-            )
-            
+                deltas[reint_field] = update.amount
         elif update.operation == "grant":
-            # Attribution : augmente le solde initial et le solde disponible
-            balance_after = balance_before + update.amount
-            await db.leave_balances.update_one(
-                {"employee_id": update.employee_id, "year": year},
-                {
-                    "$set": {
-                        balance_field: balance_after,
-                        "last_updated": datetime.now(timezone.utc).isoformat()
-                    },
-                    "$inc": {balance_field.replace("balance", "initial"): update.amount}
-                }
-            )
-            
+            # Attribution : augmente le solde initial (cumul pour REC) et le solde disponible
+            initial_field = "rec_accumulated" if update.leave_type == "REC" else balance_field.replace("balance", "initial")
+            deltas = {balance_field: update.amount, initial_field: update.amount}
         elif update.operation == "cancel":
             # Annulation : augmente le solde, diminue taken
-            balance_after = balance_before + update.amount
-            await db.leave_balances.update_one(
-                {"employee_id": update.employee_id, "year": year},
-                {
-                    "$set": {
-                        balance_field: balance_after,
-                        "last_updated": datetime.now(timezone.utc).isoformat()
-                    },
-                    "$inc": {taken_field: -update.amount}
-                }
-            )
+            deltas = {balance_field: update.amount, taken_field: -update.amount}
+        else:
+            raise HTTPException(status_code=400, detail=f"Opération non gérée: {update.operation}")
+        
+        balance_after = balance_before + deltas[balance_field]
         
         # Créer une transaction dans l'historique
         transaction = LeaveTransaction(
@@ -4373,7 +4499,11 @@ async def update_leave_balance(
         
         transaction_dict = transaction.dict()
         transaction_dict['transaction_date'] = transaction_dict['transaction_date'].isoformat()
-        await db.leave_transactions.insert_one(transaction_dict)
+        await leave_ledger.append(
+            update.employee_id, year, update.operation, deltas, fields=transaction_dict,
+            projection_on_insert={"employee_name": balance.get("employee_name", "")},
+            defaults=opening
+        )
         
         logger.info(f"✅ Leave balance updated: {update.employee_id} - {update.leave_type} {update.operation} {update.amount} days")
         
@@ -4451,108 +4581,17 @@ async def initialize_all_leave_balances(
     - Congés d'ancienneté: 2j/5ans (max 6j) NON proratisés
     """
     try:
-        from ccn66_rules import calculate_employee_rights
-        
-        if year is None:
-            year = datetime.now().year
-        
-        # Récupérer tous les employés
-        employees = await db.users.find().to_list(1000)
-        
-        initialized = 0
-        updated = 0
-        skipped = 0
-        
-        for employee in employees:
-            employee_id = employee.get("id")
-            if not employee_id:
-                continue
-            
-            # Vérifier si le solde existe déjà
-            existing = await db.leave_balances.find_one({
-                "employee_id": employee_id,
-                "year": year
-            })
-            
-            if existing and not force_recalculate:
-                skipped += 1
-                continue
-            
-            # Calculer les droits selon CCN66
-            rights = calculate_employee_rights(
-                categorie_employe=employee.get("categorie_employe"),
-                metier=employee.get("metier"),
-                date_embauche=employee.get("date_debut_contrat") or employee.get("hire_date"),
-                temps_travail=employee.get("temps_travail"),
-                reference_year=year
-            )
-            
-            # Créer ou mettre à jour le solde
-            balance_data = {
-                "employee_id": employee_id,
-                "employee_name": employee.get("name", ""),
-                "year": year,
-                # Congés Payés (CA)
-                "ca_initial": rights["CA"],
-                "ca_taken": existing.get("ca_taken", 0.0) if existing else 0.0,
-                "ca_pending": existing.get("ca_pending", 0.0) if existing else 0.0,
-                "ca_reintegrated": existing.get("ca_reintegrated", 0.0) if existing else 0.0,
-                "ca_balance": rights["CA"] - (existing.get("ca_taken", 0.0) if existing else 0.0) + (existing.get("ca_reintegrated", 0.0) if existing else 0.0),
-                # Congés Trimestriels (CT)
-                "ct_initial": rights["CT"],
-                "ct_taken": existing.get("ct_taken", 0.0) if existing else 0.0,
-                "ct_pending": existing.get("ct_pending", 0.0) if existing else 0.0,
-                "ct_reintegrated": existing.get("ct_reintegrated", 0.0) if existing else 0.0,
-                "ct_balance": rights["CT"] - (existing.get("ct_taken", 0.0) if existing else 0.0) + (existing.get("ct_reintegrated", 0.0) if existing else 0.0),
-                # Congés d'Ancienneté (CEX)
-                "cex_initial": rights["CEX"],
-                "cex_taken": existing.get("cex_taken", 0.0) if existing else 0.0,
-                "cex_balance": rights["CEX"] - (existing.get("cex_taken", 0.0) if existing else 0.0),
-                # RTT (par défaut 0 pour CCN66)
-                "rtt_initial": 0.0,
-                "rtt_taken": existing.get("rtt_taken", 0.0) if existing else 0.0,
-                "rtt_pending": existing.get("rtt_pending", 0.0) if existing else 0.0,
-                "rtt_reintegrated": existing.get("rtt_reintegrated", 0.0) if existing else 0.0,
-                "rtt_balance": 0.0,
-                # Récupération (accumulation variable)
-                "rec_accumulated": existing.get("rec_accumulated", 0.0) if existing else 0.0,
-                "rec_taken": existing.get("rec_taken", 0.0) if existing else 0.0,
-                "rec_reintegrated": existing.get("rec_reintegrated", 0.0) if existing else 0.0,
-                "rec_balance": existing.get("rec_accumulated", 0.0) if existing else 0.0,
-                # Métadonnées CCN66
-                "ccn66_category": rights["category"],
-                "temps_travail_percent": rights["temps_travail_percent"],
-                "is_temps_plein": rights["is_temps_plein"],
-                "last_updated": datetime.now(timezone.utc).isoformat(),
-                "created_at": existing.get("created_at") if existing else datetime.now(timezone.utc).isoformat()
-            }
-            
-            if existing:
-                # Mettre à jour
-                await db.leave_balances.update_one(
-                    {"employee_id": employee_id, "year": year},
-                    {"$set": balance_data}
-                )
-                updated += 1
-                logger.info(f"✅ Updated CCN66 rights: {employee.get('name')} - Cat {rights['category']}: CA={rights['CA']}j, CT={rights['CT']}j, CEX={rights['CEX']}j")
-            else:
-                # Créer
-                balance_data['id'] = str(uuid.uuid4())
-                await db.leave_balances.insert_one(balance_data)
-                initialized += 1
-                logger.info(f"✅ Initialized CCN66 rights: {employee.get('name')} - Cat {rights['category']}: CA={rights['CA']}j, CT={rights['CT']}j, CEX={rights['CEX']}j")
-        
-        total_processed = initialized + updated
-        logger.info(f"✅ CCN66 initialization complete: {initialized} created, {updated} updated, {skipped} skipped")
+        result = await LeaveBalanceInitializer(db).initialize_all(year, force_recalculate)
         
         return {
             "success": True,
-            "year": year,
-            "initialized": initialized,
-            "updated": updated,
-            "skipped": skipped,
-            "total_employees": len(employees),
-            "total_processed": total_processed
+            "year": result["year"],
+            "initialized": result["initialized"],
+            "updated": result["updated"],
+            "skipped": result["skipped"],
+            "errors": result["errors"],
+            "total_employees": result["total_employees"],
+            "total_processed": result["total_processed"]
         }
         
     except Exception as e:
@@ -4561,6 +4600,65 @@ async def initialize_all_leave_balances(
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/leave-balance/{employee_id}/audit")
+async def audit_leave_balance(
+    employee_id: str,
+    year: Optional[int] = None,
+    current_user: User = Depends(require_admin_access)
+):
+    """
+    Compare le solde stocké (projection) au grand livre des transactions (réservé admin).
+    Le grand livre est lu comme dernier snapshot + transactions suivantes.
+    """
+    try:
+        if year is None:
+            year = datetime.now().year
+        
+        audit = await leave_ledger.audit(employee_id, year)
+        return {"employee_id": employee_id, "year": year, "consistent": not audit["drift"], **audit}
+        
+    except Exception as e:
+        logger.error(f"Error auditing leave balance: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/leave-balance/rebuild")
+async def rebuild_leave_balances(
+    year: Optional[int] = None,
+    current_user: User = Depends(require_admin_access)
+):
+    """
+    Recalcule tous les soldes (et snapshots) depuis le grand livre des transactions
+    en une seule agrégation (réservé admin). Sans année : toutes les années.
+    """
+    try:
+        # Soldes jamais repris dans le grand livre : ouverture d'abord, sinon perdus au recalcul
+        adopted = await leave_ledger.adopt_legacy_balances()
+        result = await leave_ledger.rebuild(year)
+        return {"success": True, "year": year, "adopted": adopted, **result}
+        
+    except Exception as e:
+        logger.error(f"Error rebuilding leave balances: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/leave-balance/rollover")
+async def rollover_leave_balances(
+    from_year: Optional[int] = None,
+    dry_run: bool = True,
+    current_user: User = Depends(require_admin_access)
+):
+    """
+    Clôture annuelle (réservé admin) : ouvre les soldes de l'année suivante
+    avec les droits CCN66 et le report des soldes selon le type de congé.
+    Par défaut simulation (dry_run) : rapport sans écriture.
+    """
+    try:
+        report = await LeaveRolloverService(db).rollover(from_year, dry_run=dry_run)
+        return {"success": True, **report}
+        
+    except Exception as e:
+        logger.error(f"Error rolling over leave balances: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Event Management endpoints
 @api_router.get("/events", response_model=List[Event])
 async def get_events(current_user: User = Depends(get_current_user)):
@@ -4785,6 +4883,8 @@ async def create_absence(request: Request, absence: Absence, current_user: User
         
         if result.inserted_id:
             logger.info(f"✅ Absence créée: {absence.id} pour {absence.employee_name}")
+            await rollup_service.apply(absence_dict)
+            await leave_projection.invalidate(db)
             
             # 🔄 SYNCHRONISATION : Si l'absence est approuvée, déduire des compteurs
             if absence.status == "approved":
@@ -4908,6 +5008,8 @@ async def delete_all_absences(current_user: User = Depends(get_current_user)):
     
     try:
         result = await db.absences.delete_many({})
+        await rollup_service.clear()
+        await leave_projection.invalidate(db)
         logger.warning(f"🗑️ ALL ABSENCES DELETED by {current_user.name}: {result.deleted_count} absences removed")
         
         return {
@@ -5053,6 +5155,10 @@ async def update_absence(
     if "_id" in updated_absence:
         del updated_absence["_id"]
     
+    # 📊 Rollups analytics : retrait de l'ancienne version, ajout de la nouvelle
+    await rollup_service.replace(existing_absence, updated_absence)
+    await leave_projection.invalidate(db)
+    
     # 🔄 SYNCHRONISATION COMPTEURS (UNIQUEMENT SUR APPROBATION FINALE)
     sync_performed = False
     
@@ -5167,6 +5273,9 @@ async def delete_absence(
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Absence not found")
     
+    await rollup_service.apply(absence_to_delete, sign=-1)
+    await leave_projection.invalidate(db)
+    
     # 🔄 SYNCHRONISATION : Si l'absence était approved, réintégrer dans les compteurs
     sync_performed = False
     if absence_to_delete.get("status") == "approved":
@@ -5573,19 +5682,10 @@ async def declare_delegation_hours(
         if current_user.id != delegate["user_id"] and current_user.role not in ["admin"]:
             raise HTTPException(status_code=403, detail="Vous ne pouvez déclarer que vos propres heures")
         
-        # Calculer le solde du mois
+        # Calculer le solde du mois (heures déjà déclarées : solde mensuel matérialisé)
         from datetime import datetime as dt
         target_date = dt.strptime(date, "%Y-%m-%d")
-        month_str = target_date.strftime("%Y-%m")
-        
-        # Heures déjà utilisées ce mois
-        declarations = await db.delegation_hours.find({
-            "delegate_id": delegate_id,
-            "date": {"$regex": f"^{month_str}"}
-        }).to_list(100)
-        
-        heures_utilisees_mois = sum(float(d.get("heures_utilisees", 0)) for d in declarations)
-        solde_disponible = delegate["heures_mensuelles"] - heures_utilisees_mois
+        solde_disponible = await cse_balance_service.remaining_hours(delegate, target_date.year, target_date.month)
         
         # Vérifier si dépassement
         if heures_utilisees > solde_disponible:
@@ -5605,12 +5705,14 @@ async def declare_delegation_hours(
             notes=notes
         )
         
-        # Préparer pour MongoDB
+        # Préparer pour MongoDB (date typée pour les filtres et sommes par mois)
         declaration_dict = declaration.dict()
+        declaration_dict["date_at"] = target_date
         if isinstance(declaration_dict.get('created_at'), datetime):
             declaration_dict['created_at'] = declaration_dict['created_at'].isoformat()
         
         await db.delegation_hours.insert_one(declaration_dict)
+        await cse_balance_service.record_declaration(declaration_dict, delegate)
         
         logger.info(f"✅ Heures de délégation déclarées: {heures_utilisees}h par {delegate['user_name']}")
         
@@ -5633,7 +5735,7 @@ async def acknowledge_delegation_hours(declaration_id: str, current_user: User =
         raise HTTPException(status_code=403, detail="Seuls les administrateurs peuvent prendre connaissance")
     
     try:
-        result = await db.delegation_hours.update_one(
+        declaration = await db.delegation_hours.find_one_and_update(
             {"id": declaration_id, "statut": "declared"},
             {"$set": {
                 "statut": "acknowledged",
@@ -5642,9 +5744,11 @@ async def acknowledge_delegation_hours(declaration_id: str, current_user: User =
             }}
         )
         
-        if result.matched_count == 0:
+        if declaration is None:
             raise HTTPException(status_code=404, detail="Déclaration non trouvée ou déjà prise en compte")
         
+        await cse_balance_service.record_acknowledgement(declaration)
+        
         return {"message": "Prise de connaissance enregistrée"}
         
     except HTTPException:
@@ -5657,9 +5761,10 @@ async def get_delegation_hours(
     delegate_id: Optional[str] = None,
     mois: Optional[str] = None,
     statut: Optional[str] = None,
+    limit: int = 100,
     current_user: User = Depends(get_current_user)
 ):
-    """Liste des déclarations d'heures de délégation"""
+    """Liste des déclarations d'heures de délégation (plus récentes d'abord)"""
     try:
         query = {}
         
@@ -5674,20 +5779,21 @@ async def get_delegation_hours(
             query["delegate_id"] = delegate_id
         
         if mois:
-            query["date"] = {"$regex": f"^{mois}"}
+            # Plage sur la date typée (index delegate_id / date_at)
+            periode = parse_period(mois)
+            if periode is None:
+                raise HTTPException(status_code=400, detail="Mois invalide (format attendu : YYYY-MM)")
+            query["date_at"] = month_range(*periode)
         
         if statut:
             query["statut"] = statut
         
-        declarations = await db.delegation_hours.find(query).sort("date", -1).to_list(100)
-        
-        # Nettoyer les ObjectIds
-        for decl in declarations:
-            if "_id" in decl:
-                del decl["_id"]
-        
-        return declarations
+        return await db.delegation_hours.find(
+            query, {"_id": 0, "date_at": 0}
+        ).sort("date_at", -1).to_list(max(1, min(limit, 1000)))
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Erreur récupération heures: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Erreur: {str(e)}")
@@ -5716,14 +5822,11 @@ async def request_hours_cession(
         if not beneficiaire:
             raise HTTPException(status_code=404, detail="Bénéficiaire non trouvé ou inactif")
         
-        # Vérifier le solde du cédant
-        declarations = await db.delegation_hours.find({
-            "delegate_id": cedant["id"],
-            "date": {"$regex": f"^{mois}"}
-        }).to_list(100)
-        
-        heures_utilisees = sum(float(d.get("heures_utilisees", 0)) for d in declarations)
-        solde_disponible = cedant["heures_mensuelles"] - heures_utilisees
+        # Vérifier le solde du cédant (solde mensuel matérialisé)
+        periode = parse_period(mois)
+        if periode is None:
+            raise HTTPException(status_code=400, detail="Mois invalide (format attendu : YYYY-MM)")
+        solde_disponible = await cse_balance_service.remaining_hours(cedant, *periode)
         
         if heures_cedees > solde_disponible:
             raise HTTPException(
@@ -5768,7 +5871,7 @@ async def acknowledge_cession(cession_id: str, current_user: User = Depends(get_
         raise HTTPException(status_code=403, detail="Accès refusé")
     
     try:
-        result = await db.hours_cessions.update_one(
+        cession = await db.hours_cessions.find_one_and_update(
             {"id": cession_id, "statut": "pending"},
             {"$set": {
                 "statut": "acknowledged",
@@ -5777,9 +5880,12 @@ async def acknowledge_cession(cession_id: str, current_user: User = Depends(get_
             }}
         )
         
-        if result.matched_count == 0:
+        if cession is None:
             raise HTTPException(status_code=404, detail="Cession non trouvée")
         
+        # Cession prise en compte : heures données au cédant, reçues au bénéficiaire
+        await cse_balance_service.record_hours_cession(cession)
+        
         return {"message": "Cession prise en compte"}
         
     except HTTPException:
@@ -5821,6 +5927,7 @@ async def get_delegate_balance_with_report(
     Calcule le solde d'un délégué avec report des mois précédents
     
     Règle réglementaire : Les heures non utilisées peuvent être reportées sur 12 mois maximum
+    (mois calendaires exacts, soldes mensuels lus en une requête indexée)
     """
     try:
         # Utiliser mois actuel si non spécifié
@@ -5834,87 +5941,52 @@ async def get_delegate_balance_with_report(
         if not delegate:
             raise HTTPException(status_code=404, detail="Délégué non trouvé")
         
-        credit_mensuel = delegate.get("heures_mensuelles", 0)
-        
-        # Calculer le report des 12 derniers mois
-        report_total = 0.0
-        mois_avec_report = []
-        
-        # Parcourir les 12 mois précédents
-        for i in range(1, 13):
-            date_test = datetime(year, month, 1) - timedelta(days=i*30)
-            y, m = date_test.year, date_test.month
-            
-            # Récupérer les cessions du mois
-            start_date = f"{y:04d}-{m:02d}-01"
-            if m == 12:
-                end_date = f"{y+1:04d}-01-01"
-            else:
-                end_date = f"{y:04d}-{m+1:02d}-01"
-            
-            cessions_donnees = await db.hours_cessions.find({
-                "from_id": delegate_id,
-                "usage_date": {"$gte": start_date, "$lt": end_date}
-            }).to_list(100)
-            
-            cessions_recues = await db.hours_cessions.find({
-                "to_id": delegate_id,
-                "usage_date": {"$gte": start_date, "$lt": end_date}
-            }).to_list(100)
-            
-            heures_donnees = sum(c.get("hours", 0) for c in cessions_donnees)
-            heures_recues = sum(c.get("hours", 0) for c in cessions_recues)
-            
-            solde_mois = credit_mensuel - heures_donnees + heures_recues
-            
-            if solde_mois > 0:
-                report_total += solde_mois
-                mois_avec_report.append({
-                    "year": y,
-                    "month": m,
-                    "solde": solde_mois
-                })
-        
-        # Calculer le mois en cours
-        start_date_current = f"{year:04d}-{month:02d}-01"
-        if month == 12:
-            end_date_current = f"{year+1:04d}-01-01"
-        else:
-            end_date_current = f"{year:04d}-{month+1:02d}-01"
-        
-        cessions_donnees_current = await db.hours_cessions.find({
-            "from_id": delegate_id,
-            "usage_date": {"$gte": start_date_current, "$lt": end_date_current}
-        }).to_list(100)
-        
-        cessions_recues_current = await db.hours_cessions.find({
-            "to_id": delegate_id,
-            "usage_date": {"$gte": start_date_current, "$lt": end_date_current}
-        }).to_list(100)
+        return await cse_balance_service.balance(delegate, year, month)
         
-        heures_donnees_current = sum(c.get("hours", 0) for c in cessions_donnees_current)
-        heures_recues_current = sum(c.get("hours", 0) for c in cessions_recues_current)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Erreur calcul balance avec report: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erreur: {str(e)}")
+
+@api_router.get("/cse/balances")
+async def get_delegates_balances_with_report(
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Soldes de tous les délégués actifs avec report (une lecture indexée pour tous)
+    """
+    try:
+        if not year or not month:
+            now = datetime.utcnow()
+            year = year or now.year
+            month = month or now.month
         
-        # Solde total = crédit mois + report + reçues - données
-        solde_total = credit_mensuel + report_total + heures_recues_current - heures_donnees_current
+        delegates = await db.cse_delegates.find(
+            {"actif": True}, {"_id": 0, "user_id": 1, "user_name": 1, "heures_mensuelles": 1}
+        ).to_list(None)
         
-        return {
-            "delegate_id": delegate_id,
-            "delegate_name": delegate.get("user_name"),
-            "year": year,
-            "month": month,
-            "credit_mensuel": credit_mensuel,
-            "report_12_mois": report_total,
-            "heures_donnees_mois": heures_donnees_current,
-            "heures_recues_mois": heures_recues_current,
-            "solde_disponible": solde_total,
-            "detail_report": mois_avec_report[:3]  # Montrer 3 derniers mois avec solde
-        }
+        return await cse_balance_service.balances(delegates, year, month)
         
     except Exception as e:
-        logger.error(f"Erreur calcul balance avec report: {str(e)}")
+        logger.error(f"Erreur calcul balances avec report: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Erreur: {str(e)}")
 
+@api_router.post("/cse/balances/rebuild")
+async def rebuild_cse_monthly_balances(current_user: User = Depends(require_admin_access)):
+    """
+    🔁 Reconstruit les soldes mensuels CSE depuis les déclarations et cessions (admin uniquement)
+    """
+    try:
+        await cse_balance_service.backfill_usage_dates()
+        result = await cse_balance_service.rebuild()
+        return {"success": True, **result}
+    except Exception as e:
+        logger.error(f"❌ Erreur reconstruction soldes CSE: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erreur reconstruction soldes CSE: {str(e)}")
+
 # ========================================
 # STATISTIQUES CSE
 # ========================================
@@ -5936,11 +6008,12 @@ async def get_cse_statistics(mois: Optional[str] = None, current_user: User = De
         # Heures allouées totales
         heures_allouees_mois = sum(d.get("heures_mensuelles", 0) for d in delegates)
         
-        # Heures utilisées ce mois
-        declarations = await db.delegation_hours.find({
-            "date": {"$regex": f"^{mois}"}
-        }).to_list(1000)
-        heures_utilisees_mois = sum(float(d.get("heures_utilisees", 0)) for d in declarations)
+        # Heures utilisées ce mois (somme des soldes mensuels matérialisés)
+        periode = parse_period(mois)
+        if periode is None:
+            raise HTTPException(status_code=400, detail="Mois invalide (format attendu : YYYY-MM)")
+        totaux = await cse_balance_service.month_totals(*periode)
+        heures_utilisees_mois = totaux["heures_declarees"]
         
         # Taux d'utilisation
         taux_utilisation = (heures_utilisees_mois / heures_allouees_mois * 100) if heures_allouees_mois > 0 else 0
@@ -5958,6 +6031,8 @@ async def get_cse_statistics(mois: Optional[str] = None, current_user: User = De
             "cessions_en_attente": cessions_pending
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Erreur statistiques CSE: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Erreur: {str(e)}")
@@ -5967,113 +6042,112 @@ async def get_cse_statistics(mois: Optional[str] = None, current_user: User = De
 # ========================================
 
 @api_router.get("/overtime/all")
-async def get_all_overtime(current_user: User = Depends(get_current_user)):
-    """Get overtime data for all employees - includes imported work hours"""
+async def get_all_overtime(month: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """
+    Get overtime totals for all employees - includes imported work hours
+    
+    One aggregation per source (grouped by employee, department joined from users).
+    `thisMonth` covers the given month (YYYY-MM, default: current month).
+    Movement details: GET /overtime/{employee_id}/details
+    """
     try:
-        # Fetch all overtime records from database
-        overtime_records = await db.overtime.find({}).to_list(length=None)
-        
-        # Fetch imported work hours (these are treated as accumulated overtime)
-        work_hours_records = await db.work_hours.find({}).to_list(length=None)
-        
-        # Group by employee and calculate totals
-        employee_overtime = {}
+        year = month_number = None
+        if month:
+            try:
+                parsed = datetime.strptime(month, "%Y-%m")
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Mois invalide (format attendu : YYYY-MM)")
+            year, month_number = parsed.year, parsed.month
         
-        # Process overtime records
-        for record in overtime_records:
-            emp_id = record.get('employee_id')
-            emp_name = record.get('employee_name')
-            
-            if emp_id not in employee_overtime:
-                employee_overtime[emp_id] = {
-                    'id': emp_id,
-                    'name': emp_name,
-                    'department': record.get('department', 'N/A'),
-                    'accumulated': 0,
-                    'recovered': 0,
-                    'balance': 0,
-                    'thisMonth': 0,
-                    'details': []
-                }
-            
-            hours = record.get('hours', 0)
-            record_type = record.get('type', 'accumulated')
-            
-            if record_type == 'accumulated':
-                employee_overtime[emp_id]['accumulated'] += hours
-                employee_overtime[emp_id]['thisMonth'] += hours
-            elif record_type == 'recovered':
-                employee_overtime[emp_id]['recovered'] += hours
-            
-            employee_overtime[emp_id]['details'].append({
-                'date': record.get('date'),
-                'hours': hours if record_type == 'accumulated' else -hours,
-                'type': record_type,
-                'reason': record.get('reason', ''),
-                'validated': record.get('validated', False)
-            })
+        return await overtime_summary_service.summaries(year, month_number)
         
-        # Process imported work hours (treated as accumulated overtime)
-        for record in work_hours_records:
-            emp_id = record.get('employee_id')
-            emp_name = record.get('employee_name')
-            hours = record.get('heures_travaillees', 0)
-            
-            if emp_id not in employee_overtime:
-                # Get employee info to get department
-                employee = await db.users.find_one({"id": emp_id})
-                department = employee.get('department', 'N/A') if employee else 'N/A'
-                
-                employee_overtime[emp_id] = {
-                    'id': emp_id,
-                    'name': emp_name,
-                    'department': department,
-                    'accumulated': 0,
-                    'recovered': 0,
-                    'balance': 0,
-                    'thisMonth': 0,
-                    'details': []
-                }
-            
-            # Add imported hours as accumulated overtime
-            employee_overtime[emp_id]['accumulated'] += hours
-            employee_overtime[emp_id]['thisMonth'] += hours
-            
-            employee_overtime[emp_id]['details'].append({
-                'date': record.get('date'),
-                'hours': hours,
-                'type': 'accumulated',
-                'reason': 'Heures importées',
-                'validated': True  # Imported hours are pre-validated
-            })
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching overtime data: {str(e)}")
+        return []  # Return empty list if no data
+
+
+@api_router.get("/overtime/{employee_id}/details")
+async def get_overtime_details(
+    employee_id: str,
+    page: int = 1,
+    page_size: int = 50,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Overtime movements of one employee, most recent first (paginated)
+    
+    Query params:
+    - page / page_size: pagination (page_size max 200)
+    """
+    if current_user.role not in ["admin", "manager"] and current_user.id != employee_id:
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    try:
+        return await overtime_summary_service.details(employee_id, page, page_size)
+    except Exception as e:
+        logger.error(f"Error fetching overtime details: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@api_router.get("/overtime/balance/{employee_id}")
+async def get_overtime_balance(employee_id: str, current_user: User = Depends(get_current_user)):
+    """Overtime balance of one employee (single rollup document)"""
+    if current_user.role not in ["admin", "manager"] and current_user.id != employee_id:
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    try:
+        return await overtime_ledger.balance(employee_id)
+    except Exception as e:
+        logger.error(f"Error fetching overtime balance: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@api_router.post("/overtime/accumulate")
+async def accumulate_overtime(overtime_data: dict, current_user: User = Depends(get_current_user)):
+    """
+    Record accumulated overtime hours for an employee (pending manager validation)
+    
+    Body: {"employee_id", "date" (AAAA-MM-JJ), "hours", "reason"}
+    """
+    employee_id = overtime_data.get("employee_id") or current_user.id
+    if current_user.role not in ["admin", "manager"] and employee_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    try:
+        hours = float(overtime_data.get("hours", 0))
+        date_iso = normalize_date_iso(overtime_data.get("date", ""))
+        if hours <= 0 or not date_iso:
+            raise HTTPException(status_code=400, detail="Date (AAAA-MM-JJ) et nombre d'heures positif requis")
         
-        # Calculate balance for each employee and add educational sector flag
-        result = []
-        for emp_data in employee_overtime.values():
-            emp_data['balance'] = emp_data['accumulated'] - emp_data['recovered']
-            
-            # Check if employee is educational sector for manager validation
-            employee = await db.users.find_one({"id": emp_data['id']})
-            if employee:
-                from ccn66_rules import is_category_a
-                emp_data['is_educational_sector'] = is_category_a(
-                    employee.get('categorie_employe'), 
-                    employee.get('metier')
-                )
-                emp_data['categorie_employe'] = employee.get('categorie_employe', 'N/A')
-                emp_data['metier'] = employee.get('metier', 'N/A')
-            else:
-                emp_data['is_educational_sector'] = False
-                emp_data['categorie_employe'] = 'N/A'
-                emp_data['metier'] = 'N/A'
-            
-            result.append(emp_data)
+        employee = await db.users.find_one({"id": employee_id}, {"_id": 0, "id": 1, "name": 1, "department": 1})
+        if not employee:
+            raise HTTPException(status_code=404, detail="Employé non trouvé")
         
-        return result
+        entry = await overtime_ledger.accumulate(
+            employee, date_iso, hours, overtime_data.get("reason", ""), created_by=current_user.name
+        )
+        return {"success": True, "entry": entry, **await overtime_ledger.balance(employee_id)}
         
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error fetching overtime data: {str(e)}")
-        return []  # Return empty list if no data
+        logger.error(f"Error recording overtime: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@api_router.post("/overtime/rollups/rebuild")
+async def rebuild_overtime_rollups(current_user: User = Depends(require_admin_access)):
+    """
+    🔁 Rebuild overtime rollups from the full overtime and work_hours history (admin only)
+    """
+    try:
+        result = await overtime_ledger.rebuild()
+        return {"success": True, **result}
+    except Exception as e:
+        logger.error(f"❌ Erreur reconstruction rollups heures sup: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erreur reconstruction rollups: {str(e)}")
 
 
 @api_router.put("/overtime/validate/{employee_id}")
@@ -6118,41 +6192,13 @@ async def validate_overtime(
         date_to_validate = validation_data.get('date')
         hours_to_validate = validation_data.get('hours', 0)
         
-        # Update overtime records for this employee/date
-        update_result = await db.overtime.update_many(
-            {
-                "employee_id": employee_id,
-                "date": date_to_validate,
-                "type": "accumulated",
-                "validated": False  # Only update non-validated records
-            },
-            {
-                "$set": {
-                    "validated": True,
-                    "validated_by": current_user.id,
-                    "validated_by_name": current_user.name,
-                    "validated_at": datetime.now(timezone.utc).isoformat()
-                }
-            }
-        )
-        
-        # Also update work_hours records if applicable
-        work_hours_update = await db.work_hours.update_many(
-            {
-                "employee_id": employee_id,
-                "date": date_to_validate
-            },
-            {
-                "$set": {
-                    "validated": True,
-                    "validated_by": current_user.id,
-                    "validated_by_name": current_user.name,
-                    "validated_at": datetime.now(timezone.utc).isoformat()
-                }
-            }
+        # Validate non-validated overtime records (and work_hours) for this employee/date,
+        # then update the employee's monthly rollups
+        validation = await overtime_ledger.validate(
+            employee_id, date_to_validate, {"id": current_user.id, "name": current_user.name}
         )
         
-        total_updated = update_result.modified_count + work_hours_update.modified_count
+        total_updated = validation["records"] + validation["work_hours"]
         
         if total_updated == 0:
             logger.warning(f"No overtime records found to validate for employee {employee_id} on {date_to_validate}")
@@ -6529,6 +6575,8 @@ async def seed_demo_data(current_user: User = Depends(get_current_user)):
                     if isinstance(absence_dict.get('created_at'), datetime):
                         absence_dict['created_at'] = absence_dict['created_at'].isoformat()
                     await db.absences.insert_one(absence_dict)
+                    await rollup_service.apply(absence_dict)
+                    await leave_projection.invalidate(db)
                     logger.info(f"✅ Absence created: {employee.get('name')} - {abs_data['motif_absence']} ({abs_data['date_debut']})")
         
         # ==================================================
@@ -6558,6 +6606,7 @@ async def seed_demo_data(current_user: User = Depends(get_current_user)):
                     if isinstance(wh_dict.get('created_at'), datetime):
                         wh_dict['created_at'] = wh_dict['created_at'].isoformat()
                     await db.work_hours.insert_one(wh_dict)
+                    await overtime_ledger.refresh_imported([employee["id"]])
                     logger.info(f"✅ Work hours created: {employee.get('name')} - {wh_data['date']} ({wh_data['heures_travaillees']}h)")
         
         # ==================================================
@@ -6769,109 +6818,87 @@ async def create_auto_notification(
 
 
 # 📊 ENDPOINT: GÉNÉRATION RAPPORT ABSENCES DOUBLE-BLOC
+async def iter_report_rows_from_absences(year: int, month: Optional[int] = None):
+    """Lignes source du rapport lues directement dans `absences` (rollups non initialisés)"""
+    if month:
+        query = {
+            "$or": [
+                {"date_debut": {"$regex": f"/{month:02d}/{year}"}},
+                {"date_debut": {"$regex": f"{year}-{month:02d}-"}}
+            ]
+        }
+    else:
+        query = {
+            "$or": [
+                {"date_debut": {"$regex": f"/{year}"}},
+                {"date_debut": {"$regex": f"{year}-"}}
+            ]
+        }
+    
+    projection = {"_id": 0, "employee_name": 1, "motif_absence": 1, "jours_absence": 1,
+                  "date_debut": 1, "date_fin": 1, "status": 1}
+    async for absence in db.absences.find(query, projection):
+        yield {
+            'EmployeNom': absence.get('employee_name', 'Inconnu'),
+            'TypeAbsence': absence.get('motif_absence', 'INCONNU'),
+            'Duree': absence.get('jours_absence', '0'),
+            'DateDebut': absence.get('date_debut', ''),
+            'DateFin': absence.get('date_fin', ''),
+            'StatutPlanif': absence.get('status', 'approved')
+        }
+
 @api_router.post("/analytics/generate-absence-report")
 async def generate_absence_report(
     year: int,
     month: int = None,
+    format: str = "xlsx",
     current_user: User = Depends(get_current_user)
 ):
     """
     📊 Génère un rapport Excel double-bloc (Programmées | Absentéisme)
     
+    L'adaptateur s'exécute en processus (pool de workers) sur un DataFrame construit
+    depuis le curseur MongoDB. Le fichier est mis en cache sous une clé dérivée de la
+    période et des données : un rapport inchangé est resservi sans régénération.
+    
     Args:
         year: Année du rapport
         month: Mois (optionnel, si None = toute l'année)
+        format: xlsx (défaut, double-bloc), csv ou parquet (tableau plat pour outils BI)
     
     Returns:
-        Fichier Excel avec les deux blocs côte à côte
+        Fichier Excel avec les deux blocs côte à côte (ou export CSV/Parquet)
     """
     if current_user.role not in ["admin", "manager"]:
         raise HTTPException(status_code=403, detail="Access denied")
+    if format not in REPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Format non supporté: {format} (xlsx, csv, parquet)")
+    if format == "parquet" and not PARQUET_AVAILABLE:
+        raise HTTPException(status_code=400, detail="Export Parquet indisponible : pyarrow n'est pas installé")
     
     try:
-        import subprocess
-        import tempfile
-        from pathlib import Path
-        
-        # 1. Extraire les données d'absences depuis MongoDB
-        query = {}
+        from fastapi.responses import FileResponse
         
-        if month:
-            # Filtrer par mois
-            query = {
-                "$or": [
-                    {"date_debut": {"$regex": f"/{month:02d}/{year}"}},
-                    {"date_debut": {"$regex": f"{year}-{month:02d}-"}}
-                ]
-            }
+        # 1. Données source (rollups par employé et par mois si disponibles)
+        if await rollup_service.has_rollups():
+            rows = rollup_service.iter_report_rows(year, month)
         else:
-            # Toute l'année
-            query = {
-                "$or": [
-                    {"date_debut": {"$regex": f"/{year}"}},
-                    {"date_debut": {"$regex": f"{year}-"}}
-                ]
-            }
+            rows = iter_report_rows_from_absences(year, month)
+        source_df = await report_service.dataframe_from_cursor(rows)
         
-        absences = await db.absences.find(query).to_list(10000)
-        
-        if not absences:
+        if source_df.empty:
             raise HTTPException(status_code=404, detail="Aucune absence trouvée pour cette période")
         
-        # 2. Créer fichier temporaire CSV
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.csv', delete=False, encoding='utf-8') as tmp_source:
-            import csv
-            writer = csv.DictWriter(tmp_source, fieldnames=['EmployeNom', 'TypeAbsence', 'Duree', 'DateDebut', 'DateFin', 'StatutPlanif'])
-            writer.writeheader()
-            
-            for absence in absences:
-                writer.writerow({
-                    'EmployeNom': absence.get('employee_name', 'Inconnu'),
-                    'TypeAbsence': absence.get('motif_absence', 'INCONNU'),
-                    'Duree': absence.get('jours_absence', '0'),
-                    'DateDebut': absence.get('date_debut', ''),
-                    'DateFin': absence.get('date_fin', ''),
-                    'StatutPlanif': absence.get('status', 'approved')
-                })
-            
-            tmp_source_path = tmp_source.name
-        
-        # 3. Générer nom fichier output
+        # 2. Artefact en cache ou génération dans le pool de workers
         period_str = f"{year}_{month:02d}" if month else f"{year}"
-        output_filename = f"Analyse_Absences_{period_str}.xlsx"
-        output_path = Path(f"./out/{output_filename}")
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        # 4. Exécuter le script adapter
-        script_path = Path(__file__).parent / "adapt_absences_tableau.py"
-        mapping_path = Path(__file__).parent / "config" / "mapping_absences.csv"
-        
-        result = subprocess.run([
-            "python",
-            str(script_path),
-            "--source", tmp_source_path,
-            "--mapping", str(mapping_path),
-            "--output", str(output_path)
-        ], capture_output=True, text=True, timeout=60)
-        
-        # 5. Nettoyer fichier temporaire
-        Path(tmp_source_path).unlink(missing_ok=True)
-        
-        if result.returncode != 0:
-            logger.error(f"Erreur génération rapport: {result.stderr}")
-            raise HTTPException(status_code=500, detail=f"Erreur génération: {result.stderr}")
-        
-        # 6. Vérifier que le fichier existe
-        if not output_path.exists():
-            raise HTTPException(status_code=500, detail="Fichier de sortie non créé")
-        
-        # 7. Retourner le fichier
-        from fastapi.responses import FileResponse
+        artifact_path, cached = await report_service.get_or_generate(period_str, source_df, output_format=format)
         
+        # 3. Retourner le fichier
         return FileResponse(
-            path=str(output_path),
-            filename=output_filename,
-            media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            path=str(artifact_path),
+            filename=f"Analyse_Absences_{period_str}.{format}",
+            media_type=REPORT_MEDIA_TYPES[format],
+            headers={"X-Report-Cache": "hit" if cached else "miss", "ETag": f'"{artifact_path.stem}"'}
         )
         
     except HTTPException:
@@ -6929,11 +6956,63 @@ logging.basicConfig(
 )
 # logger déjà défini plus haut
 
+async def backfill_work_hours_dates() -> int:
+    """
+    Convertit au format YYYY-MM-DD les dates `work_hours` importées en DD/MM/YYYY (idempotent)
+    
+    Les filtres par période sont des plages $gte/$lte sur la chaîne ISO : une
+    ligne restée en DD/MM/YYYY n'en ferait jamais partie. Une ligne dont le
+    jour existe déjà au format ISO pour le même employé (index unique) est
+    laissée telle quelle et signalée.
+    """
+    operations = []
+    async for row in db.work_hours.find({"date": {"$regex": r"^\d{2}/\d{2}/\d{4}"}}, {"_id": 1, "date": 1}):
+        iso = normalize_date_iso(row.get("date"))
+        if iso:
+            operations.append(UpdateOne({"_id": row["_id"]}, {"$set": {"date": iso}}))
+    
+    if not operations:
+        return 0
+    
+    try:
+        result = await db.work_hours.bulk_write(operations, ordered=False)
+        converted = result.modified_count
+    except BulkWriteError as e:
+        converted = e.details.get("nModified", 0)
+        logger.warning(f"⚠️ Heures importées : {len(e.details.get('writeErrors', []))} lignes DD/MM/YYYY "
+                       f"en double d'une ligne ISO du même jour, non converties")
+    
+    logger.info(f"🗓️ Heures importées : {converted} dates converties au format YYYY-MM-DD")
+    return converted
+
 @app.on_event("startup")
 async def startup_db_init():
-    """Initialize database with default admin user"""
+    """Initialize database with default admin user and required indexes"""
     await initialize_admin_user()
+    await ensure_indexes(db)
+    
+    # Backfill initial des rollups analytics si l'historique n'a jamais été agrégé
+    if not await rollup_service.has_rollups() and await db.absences.find_one({}, {"_id": 1}):
+        await rollup_service.rebuild()
+    
+    # Reprise dans le grand livre des soldes créés avant sa mise en place
+    await leave_ledger.adopt_legacy_balances()
+    
+    # Dates typées des cessions (`usage_at`) et déclarations CSE (`date_at`) antérieures
+    await cse_balance_service.backfill_usage_dates()
+    
+    # Heures importées avant la normalisation ISO des dates
+    await backfill_work_hours_dates()
+    
+    # Rollups heures supplémentaires jamais alimentés : reconstruction depuis l'historique
+    if not await overtime_ledger.has_rollups() and await overtime_ledger.has_history():
+        await overtime_ledger.rebuild()
+    
+    # Soldes mensuels CSE jamais matérialisés : reconstruction depuis l'historique
+    if not await cse_balance_service.has_balances() and await cse_balance_service.has_history():
+        await cse_balance_service.rebuild()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    report_service.shutdown()
     client.close()
@@ -17,6 +17,12 @@ from typing import Optional, List, Dict
 import logging
 import uuid
 
+from pymongo import UpdateOne
+
+from french_holidays import working_days_between
+from models_leave_balance import BALANCE_TYPES, DEFAULT_BALANCE
+import leave_projection
+
 logger = logging.getLogger(__name__)
 
 
@@ -60,14 +66,12 @@ class LeaveBalanceService:
                 "id": str(uuid.uuid4()),
                 "user_id": user_id,
                 "fiscal_year": fiscal_year,
-                "ca_balance": 25.0,  # Défaut : 25 jours CA
-                "rtt_balance": 12.0,  # Défaut : 12 jours RTT
-                "ct_balance": 0.0,    # Défaut : 0 (dépend catégorie)
-                "rec_balance": 0.0,   # Défaut : 0
+                **DEFAULT_BALANCE,
                 "last_updated": datetime.utcnow()
             }
             
             result = await self.balances_collection.insert_one(balance)
+            await leave_projection.invalidate(self.db)
             
             logger.info(f"✅ Solde créé pour user {user_id} (année {fiscal_year})")
         
@@ -242,6 +246,8 @@ class LeaveBalanceService:
             }
         )
         
+        await leave_projection.invalidate(self.db)
+        
         # Enregistrer la transaction
         await self.create_transaction(
             user_id=user_id,
@@ -360,98 +366,163 @@ class LeaveBalanceService:
         - L'approbation d'un arrêt maladie
         - La création d'un arrêt maladie déjà approuvé
         
+        Le chevauchement est l'intersection des périodes, découpée par année
+        fiscale, et compté en jours ouvrés hors fériés (forme close). Les
+        soldes sont mis à jour en un seul `bulk_write` et les transactions
+        insérées en un `insert_many`. Opération idempotente : seul l'écart
+        avec les réintégrations déjà enregistrées pour cet arrêt est appliqué.
+        
         Args:
             sick_leave_absence: Document de l'arrêt maladie
             
         Returns:
             Liste des réintégrations effectuées
         """
-        if sick_leave_absence["absence_type"] != "MALADIE":
+        if sick_leave_absence.get("absence_type") != "MALADIE":
             return []
         
         user_id = sick_leave_absence["user_id"]
-        sick_start = sick_leave_absence["start_date"]
-        sick_end = sick_leave_absence["end_date"]
-        
-        # Convertir en datetime si nécessaire
-        if isinstance(sick_start, str):
-            sick_start = datetime.fromisoformat(sick_start.replace('Z', '+00:00'))
-        if isinstance(sick_end, str):
-            sick_end = datetime.fromisoformat(sick_end.replace('Z', '+00:00'))
+        sick_leave_id = self._document_id(sick_leave_absence)
+        sick_start = self._as_date(sick_leave_absence["start_date"])
+        sick_end = self._as_date(sick_leave_absence["end_date"])
         
         # Chercher les absences CA/RTT/CT/REC approuvées qui chevauchent
         overlapping_absences = await self.absences_collection.find({
             "user_id": user_id,
-            "absence_type": {"$in": ["CA", "RTT", "CT", "REC"]},
+            "absence_type": {"$in": list(BALANCE_TYPES)},
             "status": "approved",
-            "start_date": {"$lte": sick_end},
-            "end_date": {"$gte": sick_start}
+            "start_date": {"$lte": sick_leave_absence["end_date"]},
+            "end_date": {"$gte": sick_leave_absence["start_date"]}
         }).to_list(length=None)
         
-        reintegrations = []
-        
+        # Jours dus par (absence initiale, type, année) : intersection des périodes
+        due: Dict[tuple, float] = {}
         for absence in overlapping_absences:
-            # Calculer le chevauchement
-            overlap_start = max(
-                sick_start,
-                datetime.fromisoformat(absence["start_date"].replace('Z', '+00:00'))
-            )
-            overlap_end = min(
-                sick_end,
-                datetime.fromisoformat(absence["end_date"].replace('Z', '+00:00'))
-            )
-            
-            # Calculer le nombre de jours ouvrables chevauchés
-            days_overlapped = self._calculate_working_days(overlap_start, overlap_end)
+            overlap_start = max(sick_start, self._as_date(absence["start_date"]))
+            overlap_end = min(sick_end, self._as_date(absence["end_date"]))
+            for year in range(overlap_start.year, overlap_end.year + 1):
+                days = working_days_between(max(overlap_start, date(year, 1, 1)),
+                                            min(overlap_end, date(year, 12, 31)))
+                if days:
+                    due[(self._document_id(absence), absence["absence_type"], year)] = float(days)
+        
+        # Déjà réintégré pour cet arrêt (exécutions précédentes)
+        already: Dict[tuple, float] = {}
+        cursor = self.transactions_collection.find(
+            {"user_id": user_id, "operation_type": "REINTEGRATION", "absence_id": sick_leave_id},
+            {"_id": 0, "replaced_absence_id": 1, "leave_type": 1, "fiscal_year": 1, "amount": 1}
+        )
+        async for transaction in cursor:
+            key = (transaction.get("replaced_absence_id"), transaction.get("leave_type"),
+                   transaction.get("fiscal_year", sick_start.year))
+            already[key] = already.get(key, 0.0) + transaction.get("amount", 0.0)
+        
+        changes = {
+            key: days - already.get(key, 0.0)
+            for key, days in {**{k: 0.0 for k in already}, **due}.items()
+            if abs(days - already.get(key, 0.0)) > 1e-9
+        }
+        if not changes:
+            return []
+        
+        return await self._apply_reintegrations(user_id, sick_leave_id, changes)
+    
+    
+    async def _apply_reintegrations(self, user_id: str, sick_leave_id: str,
+                                    changes: Dict[tuple, float]) -> List[Dict]:
+        """Un bulk_write sur les soldes (un upsert par année) + un insert_many de transactions"""
+        years = sorted({year for _, _, year in changes})
+        balances = {}
+        cursor = self.balances_collection.find({"user_id": user_id, "fiscal_year": {"$in": years}})
+        async for balance in cursor:
+            balances[balance["fiscal_year"]] = balance
+        
+        now = datetime.utcnow()
+        running = {year: dict(DEFAULT_BALANCE, **{k: v for k, v in balances.get(year, {}).items()
+                                                  if k in DEFAULT_BALANCE and v is not None})
+                   for year in years}
+        increments: Dict[int, Dict[str, float]] = {year: {} for year in years}
+        transactions, reintegrations = [], []
+        
+        for (original_absence_id, leave_type, year), days in sorted(changes.items()):
+            balance_field = f"{leave_type.lower()}_balance"
+            balance_before = running[year][balance_field]
+            running[year][balance_field] = balance_before + days
+            increments[year][balance_field] = increments[year].get(balance_field, 0.0) + days
             
-            if days_overlapped > 0:
-                # Réintégrer les jours
-                result = await self.reintegrate_leave(
-                    user_id=user_id,
-                    leave_type=absence["absence_type"],
-                    days=days_overlapped,
-                    original_absence_id=str(absence["_id"]),
-                    sick_leave_absence_id=str(sick_leave_absence["_id"])
-                )
-                
-                reintegrations.append({
-                    "absence_id": str(absence["_id"]),
-                    "leave_type": absence["absence_type"],
-                    "days_reintegrated": days_overlapped,
-                    "new_balance": result[f"{absence['absence_type'].lower()}_balance"]
-                })
-                
-                logger.info(
-                    f"🔄 Réintégration automatique : {days_overlapped}j de {absence['absence_type']} "
-                    f"pour user {user_id}"
-                )
+            transactions.append({
+                "id": str(uuid.uuid4()),
+                "user_id": user_id,
+                "fiscal_year": year,
+                "operation_type": "REINTEGRATION",
+                "leave_type": leave_type,
+                "amount": days,
+                "reason": (
+                    f"Réintégration {days} jour(s) de {leave_type} suite à arrêt maladie. "
+                    f"Absence initiale: {original_absence_id}, Arrêt maladie: {sick_leave_id}"
+                ),
+                "created_by": "system",
+                "balance_before": balance_before,
+                "balance_after": running[year][balance_field],
+                "absence_id": sick_leave_id,
+                "replaced_absence_id": original_absence_id,
+                "created_at": now
+            })
+            reintegrations.append({
+                "absence_id": original_absence_id,
+                "leave_type": leave_type,
+                "fiscal_year": year,
+                "days_reintegrated": days,
+                "new_balance": running[year][balance_field]
+            })
+            logger.info(
+                f"🔄 Réintégration automatique : {days}j de {leave_type} ({year}) pour user {user_id}"
+            )
+        
+        operations = []
+        for year, fields in increments.items():
+            stage = {field: {"$add": [{"$ifNull": [f"${field}", DEFAULT_BALANCE[field]]}, delta]}
+                     for field, delta in fields.items()}
+            stage.update({
+                "id": {"$ifNull": ["$id", str(uuid.uuid4())]},
+                "last_updated": {"$literal": now}
+            })
+            operations.append(UpdateOne(
+                {"user_id": user_id, "fiscal_year": year}, [{"$set": stage}], upsert=True
+            ))
+        
+        await self.balances_collection.bulk_write(operations, ordered=False)
+        await self.transactions_collection.insert_many(transactions, ordered=False)
+        await leave_projection.invalidate(self.db)
         
         return reintegrations
     
     
+    @staticmethod
+    def _document_id(document: Dict) -> str:
+        return str(document["_id"]) if "_id" in document else document["id"]
+    
+    
+    @staticmethod
+    def _as_date(value) -> date:
+        """Date d'une valeur datetime, date ou chaîne ISO"""
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        return value.date() if isinstance(value, datetime) else value
+    
+    
     def _calculate_working_days(self, start_date: datetime, end_date: datetime) -> float:
         """
-        Calcule le nombre de jours ouvrables entre deux dates (L-V)
+        Calcule le nombre de jours ouvrés entre deux dates (L-V, hors fériés)
         
         Args:
             start_date: Date de début
             end_date: Date de fin
             
         Returns:
-            Nombre de jours ouvrables (float)
+            Nombre de jours ouvrés (float)
         """
-        current = start_date.date() if isinstance(start_date, datetime) else start_date
-        end = end_date.date() if isinstance(end_date, datetime) else end_date
-        
-        working_days = 0
-        
-        while current <= end:
-            # Lundi = 0, Dimanche = 6
-            if current.weekday() < 5:  # Lundi à Vendredi
-                working_days += 1
-            current = date.fromordinal(current.toordinal() + 1)
-        
-        return float(working_days)
+        return float(working_days_between(self._as_date(start_date), self._as_date(end_date)))
     
     
     # ========================================================================
@@ -482,33 +553,99 @@ class LeaveBalanceService:
                 "requested": float
             }
         """
-        # Types non soumis à solde
-        if leave_type not in ["CA", "RTT", "CT", "REC"]:
-            return {
-                "valid": True,
-                "message": "Ce type d'absence n'est pas soumis à un solde",
-                "available": None,
-                "requested": days
-            }
+        verdict = (await self.validate_leave_requests(
+            [{"user_id": user_id, "leave_type": leave_type, "amount": days}], fiscal_year
+        ))[0]
+        return {key: verdict[key] for key in ("valid", "message", "available", "requested")}
+    
+    
+    async def validate_leave_requests(
+        self,
+        requests: List[Dict],
+        fiscal_year: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        Valide un lot de demandes candidates (plans d'équipe)
         
-        balance = await self.get_balance(user_id, fiscal_year)
-        balance_field = f"{leave_type.lower()}_balance"
-        available = balance[balance_field]
+        Les soldes concernés sont lus en une requête ; les jours demandés
+        sont cumulés par employé et par type dans l'ordre du lot, de sorte
+        que plusieurs demandes sur un même solde sont jugées ensemble.
+        Aucun solde n'est créé : un employé sans solde est évalué sur le
+        solde par défaut.
         
-        if available >= days:
-            return {
-                "valid": True,
-                "message": f"Solde suffisant ({available} jours disponibles)",
-                "available": available,
+        Args:
+            requests: [{"user_id", "leave_type", "amount", "reference"?}]
+            fiscal_year: Année fiscale (défaut: année en cours)
+            
+        Returns:
+            Un verdict par demande, dans l'ordre :
+            {"index", "reference", "user_id", "leave_type", "valid", "message",
+             "available", "requested", "cumulative_requested", "remaining"}
+        """
+        if fiscal_year is None:
+            fiscal_year = datetime.now().year
+        
+        user_ids = list({r["user_id"] for r in requests if r["leave_type"] in BALANCE_TYPES})
+        balances = {}
+        if user_ids:
+            cursor = self.balances_collection.find(
+                {"user_id": {"$in": user_ids}, "fiscal_year": fiscal_year},
+                {"_id": 0, "user_id": 1, **{f"{t.lower()}_balance": 1 for t in BALANCE_TYPES}}
+            )
+            async for balance in cursor:
+                balances[balance["user_id"]] = balance
+        
+        cumulated: Dict[tuple, float] = {}
+        verdicts = []
+        for index, request in enumerate(requests):
+            user_id, leave_type, days = request["user_id"], request["leave_type"], request["amount"]
+            verdict = {
+                "index": index,
+                "reference": request.get("reference"),
+                "user_id": user_id,
+                "leave_type": leave_type,
                 "requested": days
             }
-        else:
-            return {
-                "valid": False,
-                "message": f"Solde insuffisant : {available} jours disponibles, {days} demandés",
+            
+            # Types non soumis à solde
+            if leave_type not in BALANCE_TYPES:
+                verdicts.append({
+                    **verdict,
+                    "valid": True,
+                    "message": "Ce type d'absence n'est pas soumis à un solde",
+                    "available": None,
+                    "cumulative_requested": None,
+                    "remaining": None
+                })
+                continue
+            
+            balance_field = f"{leave_type.lower()}_balance"
+            available = (balances.get(user_id) or {}).get(balance_field)
+            if available is None:
+                available = DEFAULT_BALANCE[balance_field]
+            
+            key = (user_id, leave_type)
+            cumulated[key] = cumulated.get(key, 0.0) + days
+            total = cumulated[key]
+            
+            if available >= total:
+                message = f"Solde suffisant ({available} jours disponibles)"
+            elif total == days:
+                message = f"Solde insuffisant : {available} jours disponibles, {days} demandés"
+            else:
+                message = (f"Solde insuffisant : {available} jours disponibles, "
+                           f"{total} demandés avec les demandes précédentes du lot")
+            
+            verdicts.append({
+                **verdict,
+                "valid": available >= total,
+                "message": message,
                 "available": available,
-                "requested": days
-            }
+                "cumulative_requested": total,
+                "remaining": available - total
+            })
+        
+        return verdicts
     
     
     # ========================================================================
@@ -1,18 +1,26 @@
 """
 Service de synchronisation pour maintenir la cohérence des données
+Les mouvements de compteurs sont écrits dans le grand livre (leave_ledger)
 """
-from datetime import datetime, timezone
-from typing import Dict, Optional
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional, Tuple
 import logging
 
+from absence_rollups import parse_absence_date
+from leave_ledger import COUNTER_FIELDS, LeaveLedger
+
 logger = logging.getLogger(__name__)
 
+# Compteur créé à la volée pour un employé sans solde de l'année
+DEFAULT_COUNTERS = {"ca_initial": 30.0, "ca_balance": 30.0, "ct_initial": 18.0, "ct_balance": 18.0}
+
 
 class DataSyncService:
     """Service centralisé pour la synchronisation des données"""
     
     def __init__(self, db):
         self.db = db
+        self.ledger = LeaveLedger(db)
     
     async def sync_absence_to_counters(self, absence: Dict, operation: str = "create"):
         """
@@ -28,71 +36,13 @@ class DataSyncService:
                 logger.error("sync_absence_to_counters: employee_id manquant")
                 return False
             
-            # Récupérer le compteur de l'employé
-            current_year = datetime.now().year
-            balance = await self.db.leave_balances.find_one({
-                "employee_id": employee_id,
-                "year": current_year
-            })
-            
-            if not balance:
-                logger.warning(f"Compteur non trouvé pour {employee_id}, création automatique")
-                # Créer un compteur par défaut (devrait normalement être initialisé)
-                balance = {
-                    "id": str(uuid.uuid4()),
-                    "employee_id": employee_id,
-                    "employee_name": absence.get("employee_name", ""),
-                    "year": current_year,
-                    "ca_initial": 30.0,
-                    "ca_taken": 0.0,
-                    "ca_balance": 30.0,
-                    "ct_initial": 18.0,
-                    "ct_taken": 0.0,
-                    "ct_balance": 18.0,
-                    "cex_initial": 0.0,
-                    "cex_taken": 0.0,
-                    "cex_balance": 0.0,
-                    "rec_accumulated": 0.0,
-                    "rec_taken": 0.0,
-                    "rec_balance": 0.0
-                }
-                await self.db.leave_balances.insert_one(balance)
-            
-            # Déterminer le type d'absence et le champ à mettre à jour
-            absence_type = absence.get("motif_absence", "")
-            jours = float(absence.get("jours_absence", 0))
-            absence_unit = absence.get("absence_unit", "jours")
-            
-            # Convertir heures en jours si nécessaire
-            if absence_unit == "heures":
-                jours = jours / 7.0  # 7 heures = 1 jour
-            
-            # Mapper le type d'absence au compteur
-            counter_field = self._map_absence_to_counter(absence_type)
-            
-            if not counter_field:
-                logger.info(f"Type d'absence '{absence_type}' ne nécessite pas de déduction de compteur")
-                return True
-            
-            # Calculer la modification selon l'opération
-            if operation in ["create", "approve"]:
-                # Déduire des compteurs
-                await self._deduct_from_counter(employee_id, counter_field, jours, absence)
-                logger.info(f"✅ Déduit {jours}j de {counter_field} pour {employee_id}")
-                
-            elif operation == "delete":
-                # Réintégrer dans les compteurs
-                await self._reintegrate_to_counter(employee_id, counter_field, jours, absence)
-                logger.info(f"✅ Réintégré {jours}j dans {counter_field} pour {employee_id}")
-                
-            elif operation == "reject":
-                # Ne rien faire (les jours n'ont jamais été déduits)
-                logger.info(f"✅ Rejet absence - pas de modification compteur")
-                
-            elif operation == "update":
-                # Recalculer (réintégrer ancien + déduire nouveau)
-                # Note: nécessite l'ancienne valeur
-                logger.info(f"✅ Mise à jour absence - recalcul des compteurs")
+            entries = self._absence_entries(absence, operation)
+            if entries:
+                # Création du compteur (valeurs par défaut) et mouvement en un upsert
+                await self.ledger.append_many(entries)
+                for entry in entries:
+                    logger.info(f"✅ {entry['operation']} {entry['fields']['amount']}j "
+                                f"({entry['fields']['type']}, {entry['year']}) pour {employee_id}")
             
             return True
             
@@ -100,6 +50,132 @@ class DataSyncService:
             logger.error(f"Erreur sync_absence_to_counters: {str(e)}")
             return False
     
+    async def sync_many(self, absences: List[Dict], operation: str = "create") -> Dict:
+        """
+        Synchronise un lot d'absences (imports, validations en masse)
+        
+        Les mouvements sont écrits en un upsert par compteur (création des
+        compteurs manquants incluse, upserts en parallèle) et un
+        `insert_many` dans le grand livre.
+        
+        Chaque absence est imputée sur l'année de ses dates (date_debut /
+        date_fin), répartie entre deux années si elle chevauche le 1er janvier :
+        importer un historique ne touche pas les compteurs de l'année en cours.
+        
+        Returns:
+            {"synced": mouvements écrits, "ignored": absences sans mouvement,
+             "errors": absences sans employee_id}
+        """
+        entries, errors, synced = [], 0, 0
+        for absence in absences:
+            if not absence.get("employee_id"):
+                errors += 1
+                continue
+            absence_entries = self._absence_entries(absence, operation)
+            if absence_entries:
+                entries.extend(absence_entries)
+                synced += 1
+        
+        if errors:
+            logger.error(f"sync_many: {errors} absence(s) sans employee_id")
+        if entries:
+            await self.ledger.append_many(entries)
+            logger.info(f"✅ {len(entries)} mouvement(s) '{operation}' synchronisé(s)")
+        
+        return {"synced": len(entries), "ignored": len(absences) - synced - errors, "errors": errors}
+    
+    @staticmethod
+    def _year_shares(absence: Dict, jours: float) -> List[Tuple[int, float]]:
+        """
+        Répartition des jours d'une absence par année civile
+        
+        Au prorata des jours calendaires de chaque année quand l'absence
+        chevauche le 1er janvier ; année en cours si les dates sont illisibles.
+        """
+        start = parse_absence_date(absence.get("date_debut"))
+        if not start:
+            return [(datetime.now().year, jours)]
+        end = parse_absence_date(absence.get("date_fin")) or start
+        if end.year == start.year or end < start:
+            return [(start.year, jours)]
+        
+        total_days = (end - start).days + 1
+        shares, remaining = [], jours
+        for year in range(start.year, end.year + 1):
+            if year == end.year:
+                shares.append((year, round(remaining, 2)))
+                break
+            year_days = (min(end, date(year, 12, 31)) - max(start, date(year, 1, 1))).days + 1
+            share = round(jours * year_days / total_days, 2)
+            shares.append((year, share))
+            remaining -= share
+        return [(year, share) for year, share in shares if share]
+    
+    def _absence_entries(self, absence: Dict, operation: str) -> List[Dict]:
+        """
+        Mouvements du grand livre correspondant à une absence (un par année couverte)
+        
+        - create / approve : déduction
+        - delete : réintégration
+        - reject : rien (les jours n'ont jamais été déduits)
+        - update : rien (nécessite l'ancienne valeur)
+        """
+        # Déterminer le type d'absence et le champ à mettre à jour
+        absence_type = absence.get("motif_absence", "")
+        counter_field = self._map_absence_to_counter(absence_type)
+        if not counter_field:
+            logger.info(f"Type d'absence '{absence_type}' ne nécessite pas de déduction de compteur")
+            return []
+        
+        if operation in ["create", "approve"]:
+            kind = "deduct"
+        elif operation == "delete":
+            kind = "reintegrate"
+        else:
+            logger.info(f"✅ Opération '{operation}' - pas de modification compteur")
+            return []
+        
+        jours = float(absence.get("jours_absence", 0))
+        # Convertir heures en jours si nécessaire
+        if absence.get("absence_unit", "jours") == "heures":
+            jours = jours / 7.0  # 7 heures = 1 jour
+        
+        return [
+            self._entry(absence, counter_field, kind, year, amount)
+            for year, amount in self._year_shares(absence, jours)
+        ]
+    
+    def _entry(self, absence: Dict, counter_field: str, kind: str, year: int, jours: float) -> Dict:
+        """Mouvement du grand livre sur le compteur d'une année"""
+        absence_type = absence.get("motif_absence", "")
+        if kind == "deduct":
+            deltas = {f"{counter_field}_taken": jours, f"{counter_field}_balance": -jours}
+            reason = f"Absence {absence_type} du {absence.get('date_debut')} au {absence.get('date_fin')}"
+        else:
+            deltas = {f"{counter_field}_taken": -jours, f"{counter_field}_balance": jours}
+            if f"{counter_field}_reintegrated" in COUNTER_FIELDS:
+                deltas[f"{counter_field}_reintegrated"] = jours
+            reason = f"Annulation absence {absence_type}"
+        
+        employee_name = absence.get("employee_name", "")
+        return {
+            "employee_id": absence["employee_id"],
+            "year": year,
+            "operation": kind,
+            "deltas": deltas,
+            "fields": {
+                "employee_name": employee_name,
+                "type": counter_field.upper(),
+                "amount": jours,
+                "date": datetime.now(timezone.utc).isoformat(),
+                "absence_id": absence.get("id"),
+                "reason": reason
+            },
+            "projection_on_insert": {"employee_name": employee_name},
+            # Compteur par défaut si absent (devrait normalement être initialisé)
+            "defaults": DEFAULT_COUNTERS
+        }
+    
     def _map_absence_to_counter(self, absence_type: str) -> Optional[str]:
         """Mapper un type d'absence au champ de compteur correspondant"""
         mapping = {
@@ -110,86 +186,3 @@ class DataSyncService:
             "RTT": "rtt"
         }
         return mapping.get(absence_type)
-    
-    async def _deduct_from_counter(self, employee_id: str, counter_field: str, 
-                                   amount: float, absence: Dict):
-        """Déduire du compteur et créer une transaction"""
-        current_year = datetime.now().year
-        
-        # Mettre à jour les champs taken et balance
-        update_fields = {
-            f"{counter_field}_taken": amount,
-            "last_updated": datetime.now(timezone.utc).isoformat()
-        }
-        
-        # Utiliser $inc pour incrémenter taken et décrémenter balance
-        await self.db.leave_balances.update_one(
-            {"employee_id": employee_id, "year": current_year},
-            {
-                "$inc": {
-                    f"{counter_field}_taken": amount,
-                    f"{counter_field}_balance": -amount
-                },
-                "$set": {
-                    "last_updated": datetime.now(timezone.utc).isoformat()
-                }
-            }
-        )
-        
-        # Créer une transaction
-        transaction = {
-            "id": str(uuid.uuid4()),
-            "employee_id": employee_id,
-            "employee_name": absence.get("employee_name", ""),
-            "type": counter_field.upper(),
-            "operation": "deduct",
-            "amount": amount,
-            "date": datetime.now(timezone.utc).isoformat(),
-            "absence_id": absence.get("id"),
-            "reason": f"Absence {absence.get('motif_absence')} du {absence.get('date_debut')} au {absence.get('date_fin')}",
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        
-        await self.db.leave_transactions.insert_one(transaction)
-        logger.info(f"📊 Transaction créée: -{amount}j de {counter_field}")
-    
-    async def _reintegrate_to_counter(self, employee_id: str, counter_field: str, 
-                                      amount: float, absence: Dict):
-        """Réintégrer dans le compteur"""
-        current_year = datetime.now().year
-        
-        # Utiliser $inc pour décrémenter taken et incrémenter balance
-        await self.db.leave_balances.update_one(
-            {"employee_id": employee_id, "year": current_year},
-            {
-                "$inc": {
-                    f"{counter_field}_taken": -amount,
-                    f"{counter_field}_balance": amount,
-                    f"{counter_field}_reintegrated": amount
-                },
-                "$set": {
-                    "last_updated": datetime.now(timezone.utc).isoformat()
-                }
-            }
-        )
-        
-        # Créer une transaction
-        transaction = {
-            "id": str(uuid.uuid4()),
-            "employee_id": employee_id,
-            "employee_name": absence.get("employee_name", ""),
-            "type": counter_field.upper(),
-            "operation": "reintegrate",
-            "amount": amount,
-            "date": datetime.now(timezone.utc).isoformat(),
-            "absence_id": absence.get("id"),
-            "reason": f"Annulation absence {absence.get('motif_absence')}",
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        
-        await self.db.leave_transactions.insert_one(transaction)
-        logger.info(f"📊 Transaction créée: +{amount}j dans {counter_field}")
-
-
-# Import nécessaire
-import uuid
@@ -9,12 +9,52 @@ const OvertimeModule = ({ user }) => {
   const [isLoading, setIsLoading] = useState(false);
   const [isTestMode, setIsTestMode] = useState(false);
   const [validatingRecord, setValidatingRecord] = useState(null);
+  const [details, setDetails] = useState([]);
+  const [detailsPage, setDetailsPage] = useState(1);
+  const [detailsPages, setDetailsPages] = useState(0);
+  const [isLoadingDetails, setIsLoadingDetails] = useState(false);
 
   // Load overtime data from backend
   useEffect(() => {
     fetchOvertimeData();
   }, []);
 
+  // Load the selected employee's movements (paginated)
+  useEffect(() => {
+    setDetails([]);
+    setDetailsPages(0);
+    if (selectedEmployee?.id) {
+      fetchDetails(selectedEmployee.id, 1);
+    }
+  }, [selectedEmployee?.id]);
+
+  const fetchDetails = async (employeeId, page) => {
+    try {
+      setIsLoadingDetails(true);
+      const response = await fetch(
+        `${process.env.REACT_APP_BACKEND_URL}/api/overtime/${employeeId}/details?page=${page}&page_size=50`,
+        {
+          headers: {
+            'Authorization': `Bearer ${localStorage.getItem('token')}`
+          }
+        }
+      );
+
+      if (response.ok) {
+        const data = await response.json();
+        setDetails(previous => (page === 1 ? data.items : [...previous, ...data.items]));
+        setDetailsPage(data.page);
+        setDetailsPages(data.pages);
+      } else {
+        console.error('❌ Failed to fetch overtime details:', response.status, response.statusText);
+      }
+    } catch (error) {
+      console.error('❌ Error fetching overtime details:', error);
+    } finally {
+      setIsLoadingDetails(false);
+    }
+  };
+
   const fetchOvertimeData = async () => {
     try {
       setIsLoading(true);
@@ -66,6 +106,7 @@ const OvertimeModule = ({ user }) => {
         
         // Reload data to reflect validation
         await fetchOvertimeData();
+        await fetchDetails(selectedEmployee.id, 1);
         
         // Update selected employee
         const updatedEmployee = overtimeData.find(emp => emp.id === selectedEmployee.id);
@@ -403,7 +444,7 @@ const OvertimeModule = ({ user }) => {
                     )}
                   </div>
                   <div className="space-y-3">
-                    {selectedEmployee.details.map((detail, index) => (
+                    {details.map((detail, index) => (
                       <div key={index} className={`p-4 rounded-lg border-l-4 ${
                         detail.type === 'accumulated' 
                           ? 'bg-blue-50 border-blue-500' 
@@ -463,6 +504,15 @@ const OvertimeModule = ({ user }) => {
                         <div className="text-sm text-gray-600">{detail.reason}</div>
                       </div>
                     ))}
+                    {detailsPage < detailsPages && (
+                      <button
+                        onClick={() => fetchDetails(selectedEmployee.id, detailsPage + 1)}
+                        disabled={isLoadingDetails}
+                        className="w-full py-2 text-sm text-blue-600 bg-blue-50 hover:bg-blue-100 rounded-lg disabled:text-gray-400 transition-colors duration-200"
+                      >
+                        {isLoadingDetails ? '⏳ Chargement...' : 'Voir plus'}
+                      </button>
+                    )}
                   </div>
                 </div>
               </div>